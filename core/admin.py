@@ -1,3 +1,159 @@
+import os
+from pathlib import Path
+
+from django.conf import settings
 from django.contrib import admin
+from django.core.exceptions import PermissionDenied
+from django.http import FileResponse, Http404
+from django.shortcuts import get_object_or_404
+from django.template.defaultfilters import filesizeformat, truncatechars
+from django.template.response import TemplateResponse
+from django.urls import path, reverse
+from django.utils.html import format_html
+from django.views.decorators.http import require_GET
+
+from . import memory, profiling
+from .models import QueryFingerprint, RequestProfile, SlowQuery
+
+
+class QueryStatsAdmin(admin.ModelAdmin):
+    """Rows are written by core.querystats; the admin may only view and delete them."""
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    @admin.display(description='SQL')
+    def short_sql(self, obj):
+        return truncatechars(obj.sql, 120)
+
+    @admin.display(description='SQL')
+    def formatted_sql(self, obj):
+        return format_html('<pre style="white-space: pre-wrap">{}</pre>', obj.sql)
+
+
+@admin.register(QueryFingerprint)
+class QueryFingerprintAdmin(QueryStatsAdmin):
+    list_display = ['fingerprint', 'short_sql', 'calls', 'total_time', 'mean_ms', 'max_ms', 'last_seen']
+    search_fields = ['sql']
+    readonly_fields = ['fingerprint', 'formatted_sql', 'calls', 'total_time', 'mean_ms', 'max_ms', 'last_seen']
+    fields = readonly_fields
+    sortable_by = ['calls', 'total_time', 'last_seen']
+
+    @admin.display(description='mean (ms)')
+    def mean_ms(self, obj):
+        return f'{obj.mean_time * 1000:.1f}'
+
+    @admin.display(description='max (ms)', ordering='max_time')
+    def max_ms(self, obj):
+        return f'{obj.max_time * 1000:.1f}'
+
+
+@admin.register(SlowQuery)
+class SlowQueryAdmin(QueryStatsAdmin):
+    list_display = ['created', 'duration_ms', 'view', 'fingerprint', 'short_sql']
+    list_filter = ['view']
+    search_fields = ['fingerprint', 'sql']
+    readonly_fields = ['created', 'duration_ms', 'view', 'fingerprint', 'formatted_sql', 'formatted_plan']
+    fields = readonly_fields
+
+    @admin.display(description='duration (ms)', ordering='duration')
+    def duration_ms(self, obj):
+        return f'{obj.duration * 1000:.1f}'
+
+    @admin.display(description='plan')
+    def formatted_plan(self, obj):
+        return format_html('<pre>{}</pre>', obj.plan or '-')
+
+
+@admin.register(RequestProfile)
+class RequestProfileAdmin(admin.ModelAdmin):
+    """
+    Profiles are taken by core.profiling; the admin lists, downloads and deletes them and issues tokens.
+
+    It also hosts the superuser-only worker memory page (see core.memory).
+    """
+
+    list_display = ['created', 'method', 'path', 'view', 'status', 'duration_ms', 'samples', 'file_size', 'download']
+    list_filter = ['view', 'method']
+    search_fields = ['path']
+    readonly_fields = [
+        'created', 'method', 'path', 'view', 'status', 'duration_ms', 'samples', 'user_id', 'file_size', 'download',
+    ]
+    fields = readonly_fields
+    change_list_template = 'admin/core/requestprofile/change_list.html'
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def get_urls(self):
+        return [
+            path('token/', self.admin_site.admin_view(self.token_view), name='core_requestprofile_token'),
+            path('<int:pk>/download/', self.admin_site.admin_view(self.download_view),
+                 name='core_requestprofile_download'),
+            path('memory/', self.admin_site.admin_view(require_GET(self.memory_view)),
+                 name='core_requestprofile_memory'),
+        ] + super().get_urls()
+
+    @admin.display(description='duration (ms)', ordering='duration')
+    def duration_ms(self, obj):
+        return f'{obj.duration * 1000:.1f}'
+
+    @admin.display(description='size', ordering='size')
+    def file_size(self, obj):
+        return filesizeformat(obj.size)
+
+    @admin.display(description='stacks')
+    def download(self, obj):
+        return format_html('<a href="{}">{}</a>', reverse('admin:core_requestprofile_download', args=[obj.pk]),
+                           obj.file)
+
+    def token_view(self, request):
+        """Issue a profiling token for the signed-in staff user"""
+        if not self.has_view_permission(request):
+            raise PermissionDenied
+        context = {
+            **self.admin_site.each_context(request),
+            'title': 'Profiling token',
+            'opts': self.opts,
+            'token': profiling.make_token(request.user),
+            'header': 'X-Profile',
+            'parameter': profiling.QUERY_PARAMETER,
+            'max_age_minutes': settings.PROFILE_TOKEN_MAX_AGE // 60,
+        }
+        request.current_app = self.admin_site.name
+        return TemplateResponse(request, 'admin/core/requestprofile/token.html', context)
+
+    def download_view(self, request, pk):
+        if not self.has_view_permission(request):
+            raise PermissionDenied
+        profile = get_object_or_404(RequestProfile, pk=pk)
+        file_path = Path(settings.PROFILE_DIR) / profile.file
+        if not file_path.is_file():
+            raise Http404
+        return FileResponse(open(file_path, 'rb'), as_attachment=True, filename=profile.file,
+                            content_type='text/plain; charset=utf-8')
 
-# Register your models here.
+    def memory_view(self, request):
+        """List each worker's memory; snapshots are taken per worker with SIGUSR2 (see core.memory)"""
+        # Worker pids and memory are operational details, not for every staff account
+        if not request.user.is_superuser:
+            raise PermissionDenied
+        workers = memory.worker_samples()
+        pid = os.getpid()
+        # This worker's live numbers, also when METRICS_DIR is off or it has not been sampled yet
+        workers[pid] = memory.read_usage()
+        context = {
+            **self.admin_site.each_context(request),
+            'title': 'Worker memory',
+            'opts': self.opts,
+            'pid': pid,
+            'workers': sorted(workers.items()),
+        }
+        request.current_app = self.admin_site.name
+        return TemplateResponse(request, 'admin/core/requestprofile/memory.html', context)
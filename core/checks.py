@@ -0,0 +1,191 @@
+"""
+System checks for settings that slow production down, tagged ``performance``.
+
+They are deploy checks, run by ``manage.py check --deploy`` (``post_deploy.sh``
+does so on every deploy). Each finding has an ID to look up here or to add
+to ``SILENCED_SYSTEM_CHECKS`` once it has been weighed:
+
+* ``core.W001``: django-debug-toolbar is installed; its middleware runs on every request.
+* ``core.W002``: a logger is at DEBUG (``django.db.backends`` then formats every query).
+* ``core.W003``: ``SESSION_SAVE_EVERY_REQUEST`` writes the session row on every request.
+* ``core.W004``: a cache is private to each worker (rate limits, user cache, throttles).
+* ``core.W005``: ``ATOMIC_REQUESTS`` wraps every view, reads included, in a transaction.
+* ``core.W006``: ``CONN_MAX_AGE = 0`` without a pool opens a connection per request.
+* ``core.W007``: ``CONN_MAX_AGE = None`` without ``CONN_HEALTH_CHECKS`` reuses dead connections.
+* ``core.E001``: a psycopg pool together with ``CONN_MAX_AGE``, which Django refuses at runtime.
+* ``core.W008``: a field of the user model that is looked up on every sign-in or by a job has no index.
+* ``core.W009``: templates are loaded without the cached loader.
+* ``core.W010``: template debugging is on (``OPTIONS['debug']``).
+"""
+from django.apps import apps
+from django.conf import settings
+from django.core import checks
+from django.db.models import F
+
+from .health import LOCAL_CACHE_BACKENDS
+
+TAG = 'performance'
+
+# User model fields filtered on by hot paths, and by whom
+USER_LOOKUPS = {
+    'email': 'allauth, on every sign-in, signup and password reset (email__iexact)',
+    'date_joined': 'users.stats.reconcile_signups, nightly',
+    'last_seen': 'the admin and users.activity',
+}
+
+CACHED_LOADER = 'django.template.loaders.cached.Loader'
+
+
+@checks.register(TAG, deploy=True)
+def check_debug_toolbar(app_configs, **kwargs):
+    installed = 'debug_toolbar' in settings.INSTALLED_APPS
+    middleware = [path for path in settings.MIDDLEWARE if path.startswith('debug_toolbar.')]
+    if not (installed or middleware):
+        return []
+    return [checks.Warning(
+        'django-debug-toolbar is installed%s.' % (', and its middleware runs on every request' if middleware else ''),
+        hint="Add 'debug_toolbar' to INSTALLED_APPS and MIDDLEWARE (and its URLs) only when DEBUG is on.",
+        id='core.W001',
+    )]
+
+
+@checks.register(TAG, deploy=True)
+def check_logging_levels(app_configs, **kwargs):
+    config = settings.LOGGING or {}
+    loggers = {'root': config.get('root', {}), **config.get('loggers', {})}
+    verbose = sorted(
+        name for name, logger in loggers.items() if str(logger.get('level', '')).upper() in ('DEBUG', '10')
+    )
+    if not verbose:
+        return []
+    return [checks.Warning(
+        f"LOGGING sets {', '.join(verbose)} to DEBUG, so every debug record is formatted and written "
+        "(including each SQL query from django.db.backends).",
+        hint='Use INFO or WARNING in production, e.g. from an environment variable.',
+        id='core.W002',
+    )]
+
+
+@checks.register(TAG, deploy=True)
+def check_session_save_every_request(app_configs, **kwargs):
+    if not settings.SESSION_SAVE_EVERY_REQUEST:
+        return []
+    return [checks.Warning(
+        'SESSION_SAVE_EVERY_REQUEST writes the session row on every request, even when nothing changed.',
+        hint='Set it to False; sessions still expire after SESSION_COOKIE_AGE, counted from their last change.',
+        id='core.W003',
+    )]
+
+
+@checks.register(TAG, deploy=True)
+def check_shared_cache(app_configs, **kwargs):
+    return [
+        checks.Warning(
+            f"CACHES['{alias}'] ({config['BACKEND'].rsplit('.', 1)[-1]}) is private to each worker process, so rate "
+            "limits count per worker and the user cache (USER_CACHE_ENABLED) stays off.",
+            hint='Set CACHE_URL to a redis:// or memcached:// server shared by all workers.',
+            id='core.W004',
+        )
+        for alias, config in settings.CACHES.items() if config['BACKEND'] in LOCAL_CACHE_BACKENDS
+    ]
+
+
+def check_database(alias, config):
+    errors = []
+    max_age = config.get('CONN_MAX_AGE', 0)
+    pooled = bool(config.get('OPTIONS', {}).get('pool'))
+    if config.get('ATOMIC_REQUESTS'):
+        errors.append(checks.Warning(
+            f"DATABASES['{alias}'] has ATOMIC_REQUESTS, so every view, reads included, runs in a transaction "
+            "that holds its locks and connection until the response is built.",
+            hint='Turn it off and wrap the views that write in transaction.atomic, or exempt hot read-only '
+                 'views with transaction.non_atomic_requests.',
+            id='core.W005',
+        ))
+    if pooled and max_age != 0:
+        errors.append(checks.Error(
+            f"DATABASES['{alias}'] uses a connection pool with CONN_MAX_AGE = {max_age}; Django refuses to "
+            "open connections with both.",
+            hint='Set CONN_MAX_AGE to 0 when OPTIONS["pool"] is set.',
+            id='core.E001',
+        ))
+    elif max_age == 0 and not pooled and config['ENGINE'] != 'django.db.backends.sqlite3':
+        errors.append(checks.Warning(
+            f"DATABASES['{alias}'] opens and closes a connection on every request (CONN_MAX_AGE = 0, no pool).",
+            hint='Set CONN_MAX_AGE (e.g. 60), or OPTIONS["pool"] = True on PostgreSQL with psycopg 3.',
+            id='core.W006',
+        ))
+    elif max_age is None and not config.get('CONN_HEALTH_CHECKS'):
+        errors.append(checks.Warning(
+            f"DATABASES['{alias}'] keeps connections forever (CONN_MAX_AGE = None) without CONN_HEALTH_CHECKS, "
+            "so a request after a database restart fails on a dead connection.",
+            hint='Set CONN_HEALTH_CHECKS = True, or a finite CONN_MAX_AGE.',
+            id='core.W007',
+        ))
+    return errors
+
+
+@checks.register(TAG, deploy=True)
+def check_database_connections(app_configs, **kwargs):
+    return [error for alias, config in settings.DATABASES.items() for error in check_database(alias, config)]
+
+
+def indexed_fields(model):
+    """Return the names of the fields that lead an index or unique constraint of ``model``."""
+    opts = model._meta
+    names = {field.name for field in opts.concrete_fields if field.primary_key or field.unique or field.db_index}
+    names.update(fields[0] for fields in opts.unique_together)
+    for index in [*opts.indexes, *opts.constraints]:
+        fields = getattr(index, 'fields', ())
+        expressions = getattr(index, 'expressions', ())
+        if fields:
+            names.add(fields[0].lstrip('-'))
+        elif expressions:
+            # e.g. Index(Upper('email')) for case-insensitive lookups
+            names.update(node.name for node in expressions[0].flatten() if isinstance(node, F))
+    return names
+
+
+@checks.register(TAG, deploy=True)
+def check_user_indexes(app_configs, **kwargs):
+    model = apps.get_model(settings.AUTH_USER_MODEL)
+    indexed = indexed_fields(model)
+    field_names = {field.name for field in model._meta.concrete_fields}
+    return [
+        checks.Warning(
+            f"{model._meta.label}.{name} has no index but is looked up by {used_by}.",
+            hint=f"Add an index on {expression} to {model._meta.label}.Meta.indexes, built with "
+                 "core.operations.AddIndexConcurrently.",
+            obj=model,
+            id='core.W008',
+        )
+        for name, used_by in USER_LOOKUPS.items() if name in field_names and name not in indexed
+        # iexact compares UPPER(field) on PostgreSQL, which a plain index does not serve
+        for expression in [f"Upper('{name}')" if 'iexact' in used_by else f"'{name}'"]
+    ]
+
+
+@checks.register(TAG, deploy=True)
+def check_template_loaders(app_configs, **kwargs):
+    errors = []
+    for config in settings.TEMPLATES:
+        if config['BACKEND'] != 'django.template.backends.django.DjangoTemplates':
+            continue
+        options = config.get('OPTIONS', {})
+        loaders = options.get('loaders')
+        # Without 'loaders', Django wraps the default ones in the cached loader
+        if loaders is not None and not any(
+            (loader[0] if isinstance(loader, (list, tuple)) else loader) == CACHED_LOADER for loader in loaders
+        ):
+            errors.append(checks.Warning(
+                'Templates are loaded without the cached loader, so each render reads and compiles them again.',
+                hint=f"Remove OPTIONS['loaders'], or wrap the loaders in ('{CACHED_LOADER}', [...]).",
+                id='core.W009',
+            ))
+        if options.get('debug'):
+            errors.append(checks.Warning(
+                "TEMPLATES OPTIONS['debug'] is on, which records source positions for every node.",
+                hint="Leave OPTIONS['debug'] unset; it follows DEBUG.",
+                id='core.W010',
+            ))
+    return errors
@@ -0,0 +1,199 @@
+"""
+Negotiated response compression (brotli, zstd or gzip) for dynamic pages.
+
+``CompressionMiddleware`` picks the best coding the client accepts from
+those available here: gzip always, brotli with the ``brotli`` package, zstd
+with Python 3.14's ``compression.zstd`` or the ``zstandard`` package. The
+levels in ``COMPRESSION_LEVELS`` trade a little ratio for CPU, since every
+page is compressed again on every request. Streamed responses are compressed
+chunk by chunk and flushed after each one, so early chunks still arrive early.
+
+BREACH: a page that reflects attacker-chosen input next to a secret leaks
+the secret through its compressed length. Django already masks the CSRF token
+differently in every response. Pages that used the CSRF token also get
+1-``COMPRESSION_MAX_PADDING`` random bytes of padding that decoders ignore: a
+random file name in the gzip header (as Django's GZipMiddleware does) or a
+zstd skippable frame. Brotli has no such field, so those pages never get it.
+"""
+import os
+import re
+import secrets
+import struct
+import zlib
+
+try:
+    import brotli
+except ImportError:  # brotli is optional
+    brotli = None
+
+try:
+    from compression import zstd
+except ImportError:  # Python < 3.14
+    zstd = None
+
+try:
+    import zstandard
+except ImportError:  # zstd is optional
+    zstandard = None
+
+COMPRESSIBLE_TYPES = re.compile(
+    r'^(text/(?!event-stream)|application/(json|javascript|xml|xhtml\+xml|manifest\+json)|image/svg\+xml)'
+)
+
+ZSTD_SKIPPABLE_MAGIC = 0x184D2A50
+
+
+class GzipEncoder:
+    """gzip with a hand-written header, so the padding can go into the FNAME field."""
+
+    name = 'gzip'
+    supports_padding = True
+
+    def __init__(self, level, padding=0):
+        self.compressor = zlib.compressobj(level, zlib.DEFLATED, -zlib.MAX_WBITS)
+        self.crc = 0
+        self.size = 0
+        flags, name = 0, b''
+        if padding:
+            # Any bytes but NUL; decoders read the name and drop it
+            flags, name = 0x08, bytes(secrets.randbelow(255) + 1 for _ in range(padding)) + b'\0'
+        self.header = b'\x1f\x8b\x08' + bytes([flags]) + b'\0\0\0\0\0\xff' + name
+
+    def start(self):
+        header, self.header = self.header, b''
+        return header
+
+    def compress(self, data):
+        self.crc = zlib.crc32(data, self.crc)
+        self.size += len(data)
+        return self.start() + self.compressor.compress(data)
+
+    def flush(self):
+        return self.start() + self.compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self):
+        return self.start() + self.compressor.flush() + struct.pack('<II', self.crc, self.size & 0xffffffff)
+
+
+class BrotliEncoder:
+    name = 'br'
+    supports_padding = False
+
+    def __init__(self, level, padding=0):
+        self.compressor = brotli.Compressor(mode=brotli.MODE_TEXT, quality=level)
+
+    def compress(self, data):
+        return self.compressor.process(data)
+
+    def flush(self):
+        return self.compressor.flush()
+
+    def finish(self):
+        return self.compressor.finish()
+
+
+class ZstdEncoder:
+    """zstd through ``compression.zstd`` or ``zstandard``; padding goes into a leading skippable frame."""
+
+    name = 'zstd'
+    supports_padding = True
+
+    def __init__(self, level, padding=0):
+        self.prefix = struct.pack('<II', ZSTD_SKIPPABLE_MAGIC, padding) + os.urandom(padding) if padding else b''
+        if zstd is not None:
+            self.compressor = zstd.ZstdCompressor(level=level)
+        else:
+            self.compressor = zstandard.ZstdCompressor(level=level).compressobj()
+
+    def start(self):
+        prefix, self.prefix = self.prefix, b''
+        return prefix
+
+    def compress(self, data):
+        return self.start() + self.compressor.compress(data)
+
+    def flush(self):
+        if zstd is not None:
+            return self.start() + self.compressor.flush(zstd.ZstdCompressor.FLUSH_BLOCK)
+        return self.start() + self.compressor.flush(zstandard.COMPRESSOBJ_FLUSH_BLOCK)
+
+    def finish(self):
+        return self.start() + self.compressor.flush()
+
+
+def available_encoders():
+    """Encoders usable in this environment, most preferred first."""
+    encoders = []
+    if brotli is not None:
+        encoders.append(BrotliEncoder)
+    if zstd is not None or zstandard is not None:
+        encoders.append(ZstdEncoder)
+    encoders.append(GzipEncoder)
+    return encoders
+
+
+def parse_accept_encoding(header):
+    """Return ``{coding: q}`` for an Accept-Encoding header."""
+    accepted = {}
+    for item in header.split(','):
+        coding, *params = [part.strip() for part in item.split(';')]
+        if not coding:
+            continue
+        q = 1.0
+        for param in params:
+            name, _, value = param.partition('=')
+            if name.strip().lower() == 'q':
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        accepted[coding.lower()] = q
+    return accepted
+
+
+def negotiate(header, encoders, padded=False):
+    """Pick the encoder with the highest q for ``header``, ties going to the order of ``encoders``."""
+    accepted = parse_accept_encoding(header)
+    best, best_q = None, 0.0
+    for encoder in encoders:
+        if padded and not encoder.supports_padding:
+            continue
+        q = accepted.get(encoder.name, accepted.get('*', 0.0))
+        if q > best_q:
+            best, best_q = encoder, q
+    return best
+
+
+def is_compressible(response, min_size):
+    if response.has_header('Content-Encoding') or response.status_code in (204, 206, 304):
+        return False
+    if not COMPRESSIBLE_TYPES.match(response.get('Content-Type', '')):
+        return False
+    if response.streaming:
+        # Responses of a known size (such as FileResponse) are usually files served as they are
+        return not response.has_header('Content-Length')
+    return len(response.content) >= min_size
+
+
+def compress(encoder, content):
+    return encoder.compress(content) + encoder.finish()
+
+
+def compress_sequence(encoder, chunks):
+    for chunk in chunks:
+        data = encoder.compress(chunk) + encoder.flush()
+        if data:
+            yield data
+    yield encoder.finish()
+
+
+async def acompress_sequence(encoder, chunks):
+    async for chunk in chunks:
+        data = encoder.compress(chunk) + encoder.flush()
+        if data:
+            yield data
+    yield encoder.finish()
+
+
+def padding_size(max_padding):
+    return secrets.randbelow(max_padding) + 1 if max_padding > 0 else 0
@@ -0,0 +1,86 @@
+"""
+Conditional GET support for per-user pages.
+
+The ETag is computed from cheap request state (user version, site, template
+version, language, CSRF cookie and Unpoly target), so a matching
+``If-None-Match`` is answered with a 304 before the view or its templates run.
+"""
+import hashlib
+from functools import cache, wraps
+
+import allauth
+import django
+from django.conf import settings
+from django.contrib.messages import get_messages
+from django.utils import translation
+from django.utils.cache import patch_cache_control
+from django.views.decorators.http import condition
+
+from .sites import get_site
+
+
+@cache
+def template_version():
+    """
+    Return a fingerprint of the project templates, computed once per process.
+
+    ``TEMPLATE_VERSION`` overrides it. Otherwise file paths, sizes and mtimes
+    are hashed together with the Django and allauth versions, so every worker
+    of a deployment agrees on the value and a redeploy changes it.
+    """
+    if settings.TEMPLATE_VERSION:
+        return settings.TEMPLATE_VERSION
+    digest = hashlib.sha256(f'{django.__version__}:{allauth.__version__}'.encode())
+    for directory in settings.TEMPLATES[0]['DIRS']:
+        for path in sorted(directory.rglob('*.html')):
+            stat = path.stat()
+            digest.update(f'{path.relative_to(directory)}:{stat.st_size}:{stat.st_mtime_ns}'.encode())
+    return digest.hexdigest()[:16]
+
+
+def user_etag(request, *args, **kwargs):
+    """
+    Return the ETag for a page rendered only from ``request.user``.
+
+    Returns None (no conditional handling) for anonymous users, when flash
+    messages are waiting to be shown, or when no CSRF cookie exists yet.
+    """
+    user = getattr(request, 'user', None)
+    if user is None or not user.is_authenticated:
+        return None
+    if len(get_messages(request)):
+        return None
+    csrf_cookie = request.COOKIES.get(settings.CSRF_COOKIE_NAME)
+    if not csrf_cookie:
+        return None
+    site = getattr(request, 'site', None) or get_site(request)
+    parts = (
+        str(user.pk),
+        user.updated_at.isoformat(),
+        f'{site.pk}:{site.domain}:{site.name}',
+        template_version(),
+        translation.get_language() or '',
+        request.get_full_path(),
+        request.headers.get('X-Up-Target', ''),
+        request.headers.get('X-Up-Fail-Target', ''),
+        csrf_cookie,
+    )
+    return 'W/"%s"' % hashlib.sha256('|'.join(parts).encode()).hexdigest()[:32]
+
+
+def conditional_page(view_func):
+    """
+    Answer repeat GETs of a per-user page with 304 Not Modified.
+
+    Responses are marked ``private, no-cache`` so browsers (and Unpoly's cache)
+    revalidate with ``If-None-Match`` instead of reusing stale HTML.
+    """
+    conditional_view = condition(etag_func=user_etag)(view_func)
+
+    @wraps(view_func)
+    def wrapper(request, *args, **kwargs):
+        response = conditional_view(request, *args, **kwargs)
+        patch_cache_control(response, private=True, no_cache=True)
+        return response
+
+    return wrapper
@@ -0,0 +1,19 @@
+from django.conf import settings
+from django.urls import reverse
+
+from .sites import get_site
+
+
+def site(request):
+    """Add ``current_site``, the Site resolved from the request's host, for per-site branding."""
+    return {'current_site': getattr(request, 'site', None) or get_site(request)}
+
+
+def events(request):
+    """Add ``events_url`` for base.html's EventSource, unless events are disabled (see core.events)."""
+    return {'events_url': settings.EVENTS_URL if settings.EVENTS_ENABLED and settings.EVENTS_BROADCAST else ''}
+
+
+def service_worker(request):
+    """Add ``service_worker_url`` for base.html's registration, unless the service worker is disabled."""
+    return {'service_worker_url': reverse('service_worker') if settings.SERVICE_WORKER_ENABLED else ''}
@@ -0,0 +1,172 @@
+"""
+Mailgun email backend that reuses connections and batches identical messages.
+
+Enable with ``EMAIL_BACKEND=core.email.MailgunBatchBackend``. It wraps anymail's
+Mailgun backend and adds:
+
+* one pooled ``requests.Session`` per worker process, kept open across sends,
+  instead of a new TLS connection for every ``send_mail()`` call;
+* batch sends: messages in one ``send_messages()`` call that differ only in
+  their single ``to`` address are merged into one Mailgun API request using
+  ``recipient-variables``, chunked by ``MAILGUN_BATCH_SIZE``;
+* per-recipient fallback: when a batch request fails, each message in it is
+  retried individually, with backoff on transient (5xx/429/network) errors.
+"""
+import logging
+import os
+import threading
+import time
+from email.utils import parseaddr
+
+from anymail.backends.mailgun import EmailBackend as MailgunBackend
+from anymail.exceptions import AnymailError, AnymailRequestsAPIError
+from anymail.message import AnymailMessage, AnymailStatus
+from anymail.utils import UNSET, get_anymail_setting
+from requests.adapters import HTTPAdapter
+
+logger = logging.getLogger(__name__)
+
+# Mailgun accepts at most 1000 recipients per batch send
+MAX_BATCH_SIZE = 1000
+
+# Anymail attributes that must match for two messages to share one batch
+BATCH_ATTRS = (
+    'esp_extra', 'envelope_sender', 'metadata', 'send_at', 'tags', 'track_clicks',
+    'track_opens', 'template_id', 'merge_global_data',
+)
+
+_session = None
+_session_pid = None
+_session_lock = threading.Lock()
+
+
+def batch_key(message):
+    """Return a hashable key shared by messages that can be batch sent together, or None."""
+    if len(message.to) != 1 or message.cc or message.bcc or message.attachments:
+        return None
+    if any(getattr(message, attr, UNSET) not in (UNSET, None, {}) for attr in ('merge_headers', 'merge_metadata')):
+        return None
+    return (
+        type(message),
+        message.from_email,
+        message.subject,
+        message.body,
+        getattr(message, 'content_subtype', 'plain'),
+        repr(getattr(message, 'alternatives', [])),
+        tuple(message.reply_to),
+        repr(sorted(message.extra_headers.items())),
+        *(repr(getattr(message, attr, UNSET)) for attr in BATCH_ATTRS),
+    )
+
+
+def is_transient(error):
+    """Return True for errors worth retrying: network failures, 429 and 5xx responses."""
+    if not isinstance(error, AnymailRequestsAPIError):
+        return False
+    if error.status_code is None:
+        return True
+    return error.status_code == 429 or error.status_code >= 500
+
+
+class MailgunBatchBackend(MailgunBackend):
+    """Anymail Mailgun backend with a shared connection pool and batch sends."""
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        esp_name = self.esp_name
+        self.batch_size = min(
+            get_anymail_setting('batch_size', esp_name=esp_name, kwargs=kwargs, default=MAX_BATCH_SIZE),
+            MAX_BATCH_SIZE,
+        )
+        self.retries = get_anymail_setting('retries', esp_name=esp_name, kwargs=kwargs, default=2)
+        self.retry_backoff = get_anymail_setting('retry_backoff', esp_name=esp_name, kwargs=kwargs, default=0.5)
+
+    def create_session(self):
+        """Return this process's shared session, creating it after start-up or fork."""
+        global _session, _session_pid
+        with _session_lock:
+            if _session is None or _session_pid != os.getpid():
+                session = super().create_session()
+                adapter = HTTPAdapter(pool_connections=2, pool_maxsize=10)
+                session.mount('https://', adapter)
+                session.mount('http://', adapter)
+                _session, _session_pid = session, os.getpid()
+            return _session
+
+    def close(self):
+        # Keep the shared session (and its pooled keep-alive connections) open
+        self.session = None
+
+    def send_messages(self, email_messages):
+        if not email_messages:
+            return 0
+        created_session = self.open()
+        num_sent = 0
+        try:
+            for group in self.group_messages(email_messages):
+                if len(group) == 1:
+                    num_sent += self.send_single(group[0])
+                    continue
+                for start in range(0, len(group), self.batch_size):
+                    num_sent += self.send_batch(group[start:start + self.batch_size])
+        finally:
+            if created_session:
+                self.close()
+        return num_sent
+
+    def group_messages(self, email_messages):
+        """Group batchable messages by content, keeping unbatchable ones on their own."""
+        groups = {}
+        for index, message in enumerate(email_messages):
+            key = batch_key(message)
+            groups.setdefault(key if key is not None else ('single', index), []).append(message)
+        return list(groups.values())
+
+    def send_batch(self, messages):
+        """Send ``messages`` as one Mailgun batch, falling back to one request per message."""
+        first = messages[0]
+        batch = AnymailMessage(
+            subject=first.subject,
+            body=first.body,
+            from_email=first.from_email,
+            to=[message.to[0] for message in messages],
+            reply_to=first.reply_to,
+            headers=first.extra_headers,
+            alternatives=getattr(first, 'alternatives', None),
+        )
+        batch.content_subtype = first.content_subtype
+        for attr in BATCH_ATTRS:
+            setattr(batch, attr, getattr(first, attr, UNSET))
+        # merge_data makes anymail send recipient-variables, so each recipient only sees their own address
+        batch.merge_data = {}
+        for message in messages:
+            address = parseaddr(message.to[0])[1]
+            merge_data = getattr(message, 'merge_data', UNSET)
+            merge_data = {} if merge_data in (UNSET, None) else merge_data
+            batch.merge_data[address] = merge_data.get(address, {})
+        try:
+            self._send(batch)
+        except AnymailError as error:
+            logger.warning("Mailgun batch of %d failed (%s), retrying per recipient", len(messages), error)
+            return sum(self.send_single(message) for message in messages)
+        for message in messages:
+            address = parseaddr(message.to[0])[1]
+            message.anymail_status = AnymailStatus()
+            if address in batch.anymail_status.recipients:
+                message.anymail_status.set_recipient_status({address: batch.anymail_status.recipients[address]})
+            message.anymail_status.esp_response = batch.anymail_status.esp_response
+        return len(messages)
+
+    def send_single(self, message):
+        """Send one message, retrying transient failures. Returns 1 if sent, else 0."""
+        for attempt in range(self.retries + 1):
+            try:
+                return 1 if self._send(message) else 0
+            except AnymailError as error:
+                if attempt < self.retries and is_transient(error):
+                    time.sleep(self.retry_backoff * 2 ** attempt)
+                    continue
+                if self.fail_silently:
+                    return 0
+                raise
+        return 0
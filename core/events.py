@@ -0,0 +1,236 @@
+"""
+Server-Sent Events for account changes, served by the ASGI app (``project.asgi``).
+
+Each browser tab keeps one ``EventSource`` open on ``EVENTS_URL``. The
+connection is an idle coroutine waiting on a small queue in the process's
+``Hub``, so one ASGI process holds thousands of them; no thread or database
+connection stays busy. Events are refresh hints without user data: base.html
+reloads the sidebar and messages through Unpoly when one arrives.
+
+``publish()`` is called from ordinary (WSGI) Django code and hands the event
+to ``EVENTS_BROADCAST`` after the transaction commits (only with
+``EVENTS_ENABLED``, which is off unless an ASGI server serves ``EVENTS_URL``):
+
+* ``PostgresBroadcast`` sends ``NOTIFY`` on the default database, and every
+  ASGI process ``LISTEN``s on its own connection;
+* ``LocalBroadcast`` delivers within the process, for development and tests
+  where one ASGI server handles every request.
+
+Events sent while a listener reconnects are lost, which only delays a refresh.
+"""
+import asyncio
+import io
+import json
+import logging
+from contextlib import contextmanager
+from functools import cache
+from importlib import import_module
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth import get_user
+from django.core.exceptions import DisallowedHost
+from django.core.handlers.asgi import ASGIRequest
+from django.db import close_old_connections, connections, transaction
+from django.utils.module_loading import import_string
+
+logger = logging.getLogger(__name__)
+
+CHANNEL = 'core_events'
+# Events are hints, so a connection that falls this far behind just misses some
+QUEUE_SIZE = 8
+# NOTIFY payloads are limited to 8000 bytes
+USERS_PER_MESSAGE = 500
+RECONNECT_DELAY = 5
+RETRY_MS = 5000
+
+
+class LocalBroadcast:
+    """Deliver events to this process's hub only (development and tests)."""
+
+    def publish(self, message):
+        get_hub().deliver_threadsafe(message)
+
+    async def listen(self, deliver):
+        pass
+
+
+class PostgresBroadcast:
+    """Carry events between processes with PostgreSQL NOTIFY/LISTEN on the default database."""
+
+    def publish(self, message):
+        with connections['default'].cursor() as cursor:
+            cursor.execute('SELECT pg_notify(%s, %s)', [CHANNEL, json.dumps(message)])
+
+    def connection_params(self):
+        params = connections['default'].get_connection_params()
+        # Django's cursor class and type adapters are for its own synchronous connections
+        params.pop('cursor_factory', None)
+        params.pop('context', None)
+        return params
+
+    async def listen(self, deliver):
+        import psycopg
+
+        while True:
+            try:
+                async with await psycopg.AsyncConnection.connect(**self.connection_params(), autocommit=True) as conn:
+                    await conn.execute(f'LISTEN {CHANNEL}')
+                    async for notify in conn.notifies():
+                        deliver(json.loads(notify.payload))
+            except (psycopg.Error, OSError):
+                logger.warning("Lost the %s LISTEN connection, reconnecting", CHANNEL, exc_info=True)
+                await asyncio.sleep(RECONNECT_DELAY)
+
+
+class Hub:
+    """Per-process fan-out from broadcast messages to the open event streams of each user."""
+
+    def __init__(self, broadcast):
+        self.broadcast = broadcast
+        self.subscribers = {}  # user_id -> set of asyncio.Queue
+        self.connections = 0
+        self.loop = None
+        self.listener = None
+
+    def start(self):
+        """Start listening on the running event loop, once per loop."""
+        loop = asyncio.get_running_loop()
+        if self.loop is not loop:
+            self.loop = loop
+            self.listener = loop.create_task(self.broadcast.listen(self.deliver))
+
+    @contextmanager
+    def subscribe(self, user_id):
+        self.start()
+        queue = asyncio.Queue(QUEUE_SIZE)
+        self.subscribers.setdefault(user_id, set()).add(queue)
+        self.connections += 1
+        try:
+            yield queue
+        finally:
+            self.connections -= 1
+            queues = self.subscribers[user_id]
+            queues.discard(queue)
+            if not queues:
+                del self.subscribers[user_id]
+
+    def deliver(self, message):
+        """Queue ``message`` for every stream of its users; runs on the event loop."""
+        for user_id in message['users']:
+            for queue in self.subscribers.get(user_id, ()):
+                try:
+                    queue.put_nowait(message)
+                except asyncio.QueueFull:
+                    pass
+
+    def deliver_threadsafe(self, message):
+        if self.loop is not None and not self.loop.is_closed():
+            self.loop.call_soon_threadsafe(self.deliver, message)
+
+
+@cache
+def get_broadcast():
+    return import_string(settings.EVENTS_BROADCAST)() if settings.EVENTS_BROADCAST else None
+
+
+@cache
+def get_hub():
+    return Hub(get_broadcast())
+
+
+def publish(user_ids, event, data=None):
+    """Send ``event`` to the users' open event streams once the current transaction commits."""
+    broadcast = get_broadcast() if settings.EVENTS_ENABLED else None
+    user_ids = list(user_ids)
+    if broadcast is None or not user_ids:
+        return
+
+    def send():
+        for start in range(0, len(user_ids), USERS_PER_MESSAGE):
+            try:
+                broadcast.publish({'users': user_ids[start:start + USERS_PER_MESSAGE], 'event': event, 'data': data})
+            except Exception:
+                logger.exception("Publishing %s event failed", event)
+
+    transaction.on_commit(send)
+
+
+def format_event(message):
+    return f"event: {message['event']}\ndata: {json.dumps(message['data'])}\n\n".encode()
+
+
+def get_user_id(scope):
+    """Return the id of the user signed in on the scope's session, or None; raises DisallowedHost."""
+    close_old_connections()
+    try:
+        request = ASGIRequest(scope, io.BytesIO())
+        request.get_host()
+        request.session = import_module(settings.SESSION_ENGINE).SessionStore(
+            request.COOKIES.get(settings.SESSION_COOKIE_NAME)
+        )
+        # Also checks the session auth hash, so sessions ended by a password change cannot reconnect
+        user = get_user(request)
+        return user.pk if user.is_authenticated else None
+    finally:
+        close_old_connections()
+
+
+async def respond(send, status, body=b'', headers=()):
+    await send({
+        'type': 'http.response.start', 'status': status,
+        'headers': [(b'content-type', b'text/plain; charset=utf-8'), *headers],
+    })
+    await send({'type': 'http.response.body', 'body': body})
+
+
+async def wait_for_disconnect(receive):
+    while (await receive())['type'] != 'http.disconnect':
+        pass
+
+
+async def stream(receive, send, queue):
+    await send({
+        'type': 'http.response.start', 'status': 200,
+        'headers': [
+            (b'content-type', b'text/event-stream'),
+            (b'cache-control', b'no-store'),
+            (b'x-accel-buffering', b'no'),  # let nginx pass each event on immediately
+        ],
+    })
+    await send({'type': 'http.response.body', 'body': f'retry: {RETRY_MS}\n\n'.encode(), 'more_body': True})
+    disconnect = asyncio.ensure_future(wait_for_disconnect(receive))
+    try:
+        while True:
+            get = asyncio.ensure_future(queue.get())
+            done, _ = await asyncio.wait({get, disconnect}, timeout=settings.EVENTS_HEARTBEAT,
+                                         return_when=asyncio.FIRST_COMPLETED)
+            if disconnect in done:
+                get.cancel()
+                return
+            if get in done:
+                body = format_event(get.result())
+            else:
+                get.cancel()
+                body = b': ping\n\n'  # keeps proxies from closing the idle connection
+            await send({'type': 'http.response.body', 'body': body, 'more_body': True})
+    finally:
+        disconnect.cancel()
+
+
+async def application(scope, receive, send):
+    """ASGI app for ``EVENTS_URL``: an event stream for the signed-in user."""
+    if scope['method'] != 'GET':
+        return await respond(send, 405, headers=[(b'allow', b'GET')])
+    try:
+        user_id = await sync_to_async(get_user_id)(scope)
+    except DisallowedHost:
+        return await respond(send, 400)
+    # Any status but 200 makes EventSource give up instead of reconnecting
+    if user_id is None:
+        return await respond(send, 403)
+    hub = get_hub()
+    if hub.connections >= settings.EVENTS_MAX_CONNECTIONS:
+        return await respond(send, 503, headers=[(b'retry-after', b'60')])
+    with hub.subscribe(user_id) as queue:
+        await stream(receive, send, queue)
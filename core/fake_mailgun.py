@@ -0,0 +1,91 @@
+"""
+A local stand-in for the Mailgun messages API, for offline benchmarks.
+
+It accepts ``POST /v3/<domain>/messages`` and answers like Mailgun, counting
+requests and recipients. Point ``MAILGUN_API_URL`` at it (for example
+``http://127.0.0.1:8025/v3``) or run ``manage.py bench_mailgun``.
+"""
+import json
+import random
+import threading
+import time
+import uuid
+from email.parser import BytesParser
+from email.policy import HTTP
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+
+
+class FakeMailgunHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # keep-alive, so connection reuse is measurable
+    disable_nagle_algorithm = True
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        server = self.server
+        if server.latency:
+            time.sleep(server.latency)
+        if not self.path.endswith('/messages'):
+            return self.respond(404, {'message': 'Not Found'})
+        if server.failure_rate and random.random() < server.failure_rate:
+            with server.lock:
+                server.failures += 1
+            return self.respond(503, {'message': 'Service Unavailable'})
+        recipients = len(self.parse_recipients(body))
+        with server.lock:
+            server.requests += 1
+            server.recipients += recipients
+        domain = self.path.rstrip('/').split('/')[-2]
+        self.respond(200, {'id': f'<{uuid.uuid4().hex}@{domain}>', 'message': 'Queued. Thank you.'})
+
+    def parse_recipients(self, body):
+        content_type = self.headers.get('Content-Type', '')
+        if content_type.startswith('multipart/form-data'):
+            message = BytesParser(policy=HTTP).parsebytes(
+                b'Content-Type: ' + content_type.encode() + b'\r\n\r\n' + body
+            )
+            fields = [part for part in message.iter_parts() if part.get_param('name', header='content-disposition') == 'to']
+            values = [part.get_content() for part in fields]
+        else:
+            values = parse_qs(body.decode()).get('to', [])
+        return [value for value in values if value.strip()]
+
+    def respond(self, status, payload):
+        content = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+
+class FakeMailgunServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address=('127.0.0.1', 0), latency=0.0, failure_rate=0.0, verbose=False):
+        super().__init__(address, FakeMailgunHandler)
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.verbose = verbose
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.recipients = 0
+        self.failures = 0
+
+    @property
+    def api_url(self):
+        host, port = self.server_address[:2]
+        return f'http://{host}:{port}/v3'
+
+    def start(self):
+        """Serve from a daemon thread and return self."""
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def reset(self):
+        with self.lock:
+            self.requests = self.recipients = self.failures = 0
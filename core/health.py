@@ -0,0 +1,79 @@
+"""
+Liveness and readiness checks for load balancers and systemd.
+
+``HealthCheckMiddleware`` answers ``/healthz`` and ``/readyz`` before any
+other middleware runs. Readiness probes the database (and a shared cache,
+when one is configured) from a single background thread that keeps its own
+connection, waits at most ``HEALTHCHECK_TIMEOUT`` seconds, and reuses the
+result for ``HEALTHCHECK_CACHE_SECONDS``, so frequent polling costs almost
+nothing.
+"""
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import connections
+
+# Cache backends that live inside the worker process and cannot be "down"
+LOCAL_CACHE_BACKENDS = {
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+}
+
+_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='healthcheck')
+_lock = threading.Lock()
+_result = None
+_checked_at = 0.0
+
+
+def check_database():
+    connection = connections['default']
+    # Runs in the probe thread, so this only recycles the probe's own connection
+    connection.close_if_unusable_or_obsolete()
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT 1')
+        cursor.fetchone()
+
+
+def check_cache():
+    caches['default'].get('healthcheck')
+
+
+def get_checks():
+    """Return the readiness checks that apply to the configured backends."""
+    checks = {'database': check_database}
+    if settings.CACHES['default']['BACKEND'] not in LOCAL_CACHE_BACKENDS:
+        checks['cache'] = check_cache
+    return checks
+
+
+def run_check(check, timeout):
+    try:
+        _executor.submit(check).result(timeout=timeout)
+    except TimeoutError:
+        return 'timeout'
+    except Exception as error:
+        return f'error: {type(error).__name__}'
+    return 'ok'
+
+
+def readiness(force=False):
+    """
+    Return ``(ready, {check name: status})``, cached for ``HEALTHCHECK_CACHE_SECONDS``.
+
+    Concurrent callers share one run of the checks; while a check is stuck in
+    the probe thread, new checks queue behind it and time out as not ready.
+    """
+    global _result, _checked_at
+    with _lock:
+        now = time.monotonic()
+        if force or _result is None or now - _checked_at >= settings.HEALTHCHECK_CACHE_SECONDS:
+            statuses = {
+                name: run_check(check, settings.HEALTHCHECK_TIMEOUT)
+                for name, check in get_checks().items()
+            }
+            _result = (all(status == 'ok' for status in statuses.values()), statuses)
+            _checked_at = time.monotonic()
+        return _result
@@ -0,0 +1,53 @@
+import time
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.test import Client
+
+from core.compression import available_encoders, compress
+
+DEFAULT_URLS = ['/', '/accounts/login/', '/accounts/signup/']
+LEVELS = {'br': [1, 4, 5, 11], 'zstd': [1, 3, 6, 19], 'gzip': [1, 6, 9]}
+
+
+class Command(BaseCommand):
+    help = 'Benchmark response compression: bytes and CPU time per response for each coding and level'
+
+    def add_arguments(self, parser):
+        parser.add_argument('urls', nargs='*', help=f'Pages to render (default: {" ".join(DEFAULT_URLS)})')
+        parser.add_argument('--user', help='Render the pages signed in as this username (e.g. for /users/profile/)')
+        parser.add_argument('--iterations', type=int, default=200)
+
+    def handle(self, *args, **options):
+        client = Client()
+        if options['user']:
+            try:
+                client.force_login(get_user_model().objects.get(username=options['user']))
+            except get_user_model().DoesNotExist:
+                raise CommandError(f"No user named {options['user']}")
+        host = next((host for host in settings.ALLOWED_HOSTS if host != '*' and not host.startswith('.')), 'localhost')
+        encoders = available_encoders()
+        self.stdout.write(f"Codings available: {', '.join(encoder.name for encoder in encoders)} "
+                          f"(* = COMPRESSION_LEVELS)")
+        for url in options['urls'] or DEFAULT_URLS:
+            response = client.get(url, HTTP_HOST=host)
+            if response.status_code != 200 or response.streaming:
+                self.stderr.write(f'{url}: skipped (status {response.status_code})')
+                continue
+            content = response.content
+            self.stdout.write(f'{url}: {len(content):,} bytes uncompressed')
+            for encoder in encoders:
+                for level in LEVELS[encoder.name]:
+                    self.run(encoder, level, content, options['iterations'])
+
+    def run(self, encoder, level, content, iterations):
+        started = time.process_time()
+        for _ in range(iterations):
+            size = len(compress(encoder(level), content))
+        cpu = (time.process_time() - started) / iterations
+        marker = '*' if settings.COMPRESSION_LEVELS[encoder.name] == level else ' '
+        self.stdout.write(
+            f'  {encoder.name:>4} {level:>2}{marker} {size:>8,} bytes ({size / len(content):6.1%}) '
+            f'{cpu * 1e6:8.0f} µs CPU/response'
+        )
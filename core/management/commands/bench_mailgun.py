@@ -0,0 +1,60 @@
+import time
+
+from django.core.mail import EmailMessage, get_connection
+from django.core.management.base import BaseCommand
+
+from core.fake_mailgun import FakeMailgunServer
+
+BACKENDS = {
+    'anymail': 'anymail.backends.mailgun.EmailBackend',
+    'batch': 'core.email.MailgunBatchBackend',
+}
+
+
+class Command(BaseCommand):
+    help = 'Benchmark Mailgun email backends against a local fake Mailgun server'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--messages', type=int, default=500)
+        parser.add_argument('--latency', type=float, default=0.02,
+                            help='Simulated Mailgun response time in seconds (default: %(default)s)')
+        parser.add_argument('--api-url', help='Use an already running fake server instead of starting one')
+
+    def handle(self, *args, **options):
+        server = None
+        api_url = options['api_url']
+        if not api_url:
+            server = FakeMailgunServer(latency=options['latency']).start()
+            api_url = server.api_url
+        messages = options['messages']
+        self.stdout.write(f'Sending {messages} messages per backend to {api_url}')
+        try:
+            for name, backend in BACKENDS.items():
+                if server:
+                    server.reset()
+                self.run(name, backend, api_url, messages, server)
+        finally:
+            if server:
+                server.shutdown()
+                server.server_close()
+
+    def run(self, name, backend, api_url, count, server):
+        options = {'api_key': 'bench', 'sender_domain': 'bench.example.com', 'api_url': api_url}
+        notices = [
+            EmailMessage('Security notice', 'Your password was changed.', 'noreply@bench.example.com',
+                         [f'user{i}@example.com'])
+            for i in range(count)
+        ]
+        # One send_mail() per message, as allauth does
+        started = time.perf_counter()
+        for message in notices:
+            get_connection(backend, **options).send_messages([message])
+        single = time.perf_counter() - started
+        # One send_messages() call for the whole list, as a bulk announcement would
+        started = time.perf_counter()
+        get_connection(backend, **options).send_messages(notices)
+        bulk = time.perf_counter() - started
+        requests = f', {server.requests} HTTP requests' if server else ''
+        self.stdout.write(
+            f'{name:>8}: individual {count / single:8.1f} msg/s | bulk {count / bulk:8.1f} msg/s{requests}'
+        )
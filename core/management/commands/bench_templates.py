@@ -0,0 +1,52 @@
+import fnmatch
+import json
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from core.templatebench import CASES, compare, measure
+
+DEFAULT_BASELINE = Path(settings.BASE_DIR) / 'benchmarks' / 'templates.json'
+
+
+class Command(BaseCommand):
+    help = 'Benchmark template rendering (renders/s and peak memory) and compare against a saved baseline'
+
+    def add_arguments(self, parser):
+        parser.add_argument('cases', nargs='*', help='Case names or patterns, e.g. "profile/*" (default: all)')
+        parser.add_argument('--baseline', default=str(DEFAULT_BASELINE),
+                            help='Baseline JSON file (default: %(default)s)')
+        parser.add_argument('--save', action='store_true', help='Write these results as the new baseline')
+        parser.add_argument('--tolerance', type=float, default=0.10,
+                            help='Flag cases this much slower or larger than the baseline (default: %(default)s)')
+        parser.add_argument('--min-time', type=float, default=0.5, help='Seconds spent timing each case')
+
+    def handle(self, *args, **options):
+        patterns = options['cases'] or ['*']
+        cases = [case for case in CASES if any(fnmatch.fnmatch(case.name, pattern) for pattern in patterns)]
+        if not cases:
+            raise CommandError(f"No case matches {' '.join(patterns)}; cases: {', '.join(c.name for c in CASES)}")
+        baseline_path = Path(options['baseline'])
+        baseline = json.loads(baseline_path.read_text()) if baseline_path.exists() else {}
+        results = {}
+        for case in cases:
+            result = results[case.name] = measure(case, options['min_time'])
+            before = baseline.get(case.name)
+            change = f"  {result['ops'] / before['ops'] - 1:+6.1%} vs baseline" if before else ''
+            self.stdout.write(
+                f"{case.name:<24} {result['ops']:9.0f} renders/s {result['peak_kib']:8.1f} KiB peak "
+                f"{result['bytes']:7,} bytes{change}"
+            )
+        if options['save']:
+            baseline_path.parent.mkdir(parents=True, exist_ok=True)
+            baseline_path.write_text(json.dumps({**baseline, **results}, indent=2, sort_keys=True) + '\n')
+            self.stdout.write(self.style.SUCCESS(f'Saved the baseline to {baseline_path}'))
+            return
+        regressions = compare(results, baseline, options['tolerance'])
+        if regressions:
+            for name, problems in regressions.items():
+                self.stderr.write(f"{name}: {', '.join(problems)}")
+            raise CommandError(f'{len(regressions)} case(s) regressed beyond {options["tolerance"]:.0%}')
+        if baseline:
+            self.stdout.write(self.style.SUCCESS(f'No regressions beyond {options["tolerance"]:.0%}'))
@@ -0,0 +1,46 @@
+import time
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.test import Client, override_settings
+
+
+class Command(BaseCommand):
+    help = 'Benchmark time to first byte and to the full page, with and without early flush (EARLY_FLUSH_ENABLED)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('url', nargs='?', default='/users/profile/')
+        parser.add_argument('--user', help='Render the page signed in as this username (needed for /users/profile/)')
+        parser.add_argument('--iterations', type=int, default=50)
+
+    def handle(self, *args, **options):
+        client = Client()
+        if options['user']:
+            try:
+                client.force_login(get_user_model().objects.get(username=options['user']))
+            except get_user_model().DoesNotExist:
+                raise CommandError(f"No user named {options['user']}")
+        host = next((host for host in settings.ALLOWED_HOSTS if host != '*' and not host.startswith('.')), 'localhost')
+        for enabled in (False, True):
+            with override_settings(EARLY_FLUSH_ENABLED=enabled):
+                self.run(client, options['url'], host, enabled, options['iterations'])
+
+    def run(self, client, url, host, enabled, iterations):
+        first_byte = total = 0.0
+        for _ in range(iterations):
+            started = time.perf_counter()
+            response = client.get(url, HTTP_HOST=host)
+            if response.status_code != 200:
+                raise CommandError(f'{url}: status {response.status_code}')
+            chunks = iter(response.streaming_content) if response.streaming else iter([response.content])
+            next(chunks, b'')
+            first_byte += time.perf_counter() - started
+            for _ in chunks:
+                pass
+            total += time.perf_counter() - started
+        label = 'early flush' if enabled and response.streaming else 'buffered'
+        self.stdout.write(
+            f'{url} {label:>11}: first byte {first_byte / iterations * 1000:7.2f} ms, '
+            f'full page {total / iterations * 1000:7.2f} ms'
+        )
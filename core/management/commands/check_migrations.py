@@ -0,0 +1,36 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS
+
+from core.migration_checks import LEVELS, check_migrations
+
+
+class Command(BaseCommand):
+    help = 'Report migration operations that would lock busy tables (run before migrate on deploy)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('app_label', nargs='*', help='Only check these apps (default: all)')
+        parser.add_argument('--all', action='store_true', dest='include_applied',
+                            help='Also check migrations that are already applied (needs no database)')
+        parser.add_argument('--fail-level', choices=list(LEVELS), default='error',
+                            help='Exit with an error if a finding is at least this severe (default: %(default)s)')
+        parser.add_argument('--database', default=DEFAULT_DB_ALIAS)
+
+    def handle(self, *args, **options):
+        findings = check_migrations(options['app_label'], options['include_applied'], options['database'])
+        styles = {'error': self.style.ERROR, 'warning': self.style.WARNING, 'info': self.style.NOTICE}
+        current = None
+        for finding in findings:
+            if finding.migration != current:
+                current = finding.migration
+                self.stdout.write(self.style.MIGRATE_HEADING(current))
+            self.stdout.write(f'  {finding.operation}')
+            self.stdout.write('    ' + styles[finding.level](f'{finding.level} [{finding.code}] {finding.message}'))
+            if finding.hint:
+                self.stdout.write(f'    Hint: {finding.hint}')
+        failing = [finding for finding in findings if LEVELS[finding.level] >= LEVELS[options['fail_level']]]
+        if failing:
+            raise CommandError(
+                f'{len(failing)} blocking operation(s) found. Rewrite them with core.operations or add '
+                'check_migrations_ignore = {...} to the migration once reviewed.'
+            )
+        self.stdout.write(self.style.SUCCESS(f'No blocking operations ({len(findings)} notes).'))
@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand
+
+from core.fake_mailgun import FakeMailgunServer
+
+
+class Command(BaseCommand):
+    help = 'Run a local fake Mailgun API server (set MAILGUN_API_URL to the printed URL)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--port', type=int, default=8025)
+        parser.add_argument('--latency', type=float, default=0.0, help='Seconds to delay each response')
+        parser.add_argument('--failure-rate', type=float, default=0.0, help='Fraction of requests answered with 503')
+
+    def handle(self, *args, **options):
+        server = FakeMailgunServer(
+            ('127.0.0.1', options['port']),
+            latency=options['latency'],
+            failure_rate=options['failure_rate'],
+            verbose=options['verbosity'] > 1,
+        )
+        self.stdout.write(self.style.SUCCESS(f'Fake Mailgun listening on {server.api_url} (Ctrl+C to stop)'))
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+            self.stdout.write(f'Handled {server.requests} requests for {server.recipients} recipients')
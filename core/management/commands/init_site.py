@@ -1,14 +1,26 @@
+import tomllib
+
 from django.conf import settings
 from django.contrib.sites.models import Site
-from django.core.management.base import BaseCommand
+from django.core.management.base import BaseCommand, CommandError
+
+from core.sites import sync_sites
 
 
 class Command(BaseCommand):
-    help = 'Initialize or update the Django Site model based on settings'
+    help = 'Initialize or update the Django Site model based on settings, or sync many sites from a TOML file'
 
-    def handle(self, *args, **kwargs):
+    def add_arguments(self, parser):
+        parser.add_argument('--config',
+                            help='TOML file with [[sites]] tables (domain, name and optional id), synced in one transaction')
+        parser.add_argument('--prune', action='store_true',
+                            help='With --config, delete sites that are not listed (never DEFAULT_SITE_ID)')
+
+    def handle(self, *args, **options):
+        if options['config']:
+            return self.sync(options['config'], options['prune'])
         site, created = Site.objects.update_or_create(
-            id=settings.SITE_ID,
+            id=settings.DEFAULT_SITE_ID,
             defaults={
                 'domain': settings.SITE_DOMAIN,
                 'name': settings.SITE_NAME,
@@ -16,3 +28,20 @@ class Command(BaseCommand):
         )
         action = "Created" if created else "Updated"
         self.stdout.write(self.style.SUCCESS(f'{action} site: {site.domain}'))
+
+    def sync(self, path, prune):
+        try:
+            with open(path, 'rb') as fp:
+                entries = tomllib.load(fp).get('sites', [])
+        except (OSError, tomllib.TOMLDecodeError) as error:
+            raise CommandError(f'Cannot read {path}: {error}')
+        for entry in entries:
+            if not entry.get('domain') or not entry.get('name'):
+                raise CommandError(f'Every site in {path} needs a domain and a name: {entry}')
+        try:
+            created, updated, deleted = sync_sites(entries, prune=prune)
+        except ValueError as error:
+            raise CommandError(error)
+        self.stdout.write(self.style.SUCCESS(
+            f'Synced {len(entries)} sites: {created} created, {updated} updated, {deleted} deleted'
+        ))
@@ -0,0 +1,49 @@
+import time
+
+from django.conf import settings
+from django.core.management.commands.migrate import Command as MigrateCommand
+from django.db import OperationalError, connections
+
+# SQLSTATE of "canceling statement due to lock timeout"
+LOCK_NOT_AVAILABLE = '55P03'
+
+
+def is_lock_timeout(error):
+    return getattr(error.__cause__, 'sqlstate', None) == LOCK_NOT_AVAILABLE
+
+
+class Command(MigrateCommand):
+    help = (
+        MigrateCommand.help + ' On PostgreSQL, lock_timeout and statement_timeout are set first, and a migration '
+        'that gives up waiting for a lock is retried instead of stalling every query behind it. Atomic migrations '
+        'are rolled back first; non-atomic ones run again from their first operation (see check_migrations).'
+    )
+
+    def add_arguments(self, parser):
+        super().add_arguments(parser)
+        parser.add_argument('--lock-timeout', default=settings.MIGRATION_LOCK_TIMEOUT,
+                            help='PostgreSQL lock_timeout while migrating (default: %(default)s)')
+        parser.add_argument('--statement-timeout', default=settings.MIGRATION_STATEMENT_TIMEOUT,
+                            help='PostgreSQL statement_timeout while migrating (default: %(default)s)')
+        parser.add_argument('--lock-retries', type=int, default=settings.MIGRATION_LOCK_RETRIES,
+                            help='Retries after a lock timeout, with exponential backoff (default: %(default)s)')
+
+    def handle(self, *args, **options):
+        connection = connections[options['database']]
+        if connection.vendor != 'postgresql':
+            return super().handle(*args, **options)
+        for attempt in range(options['lock_retries'] + 1):
+            with connection.cursor() as cursor:
+                # Session-level settings, so they also cover non-atomic migrations
+                cursor.execute(
+                    "SELECT set_config('lock_timeout', %s, false), set_config('statement_timeout', %s, false)",
+                    [options['lock_timeout'], options['statement_timeout']],
+                )
+            try:
+                return super().handle(*args, **options)
+            except OperationalError as error:
+                if not is_lock_timeout(error) or attempt == options['lock_retries']:
+                    raise
+                delay = 2 ** attempt
+                self.stderr.write(self.style.WARNING(f'Lock timeout ({error}), retrying in {delay}s'))
+                time.sleep(delay)
@@ -0,0 +1,51 @@
+from django.core.management.base import BaseCommand
+
+from core.models import QueryFingerprint, SlowQuery
+
+ORDERINGS = {
+    'total': '-total_time',
+    'max': '-max_time',
+    'calls': '-calls',
+}
+
+
+class Command(BaseCommand):
+    help = 'Show the most expensive query fingerprints and recent slow query samples (core.querystats)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--order', choices=ORDERINGS, default='total',
+                            help='Sort fingerprints by total time, max time or calls (default: %(default)s)')
+        parser.add_argument('--limit', type=int, default=20, help='Rows to show (default: %(default)s)')
+        parser.add_argument('--slow', action='store_true', help='Show recent slow samples with their plans')
+        parser.add_argument('--reset', action='store_true', help='Delete all collected statistics and samples')
+
+    def handle(self, *args, **options):
+        if options['reset']:
+            QueryFingerprint.objects.all().delete()
+            SlowQuery.objects.all().delete()
+            self.stdout.write(self.style.SUCCESS('Query statistics reset'))
+            return
+        if options['slow']:
+            self.show_samples(options['limit'])
+        else:
+            self.show_fingerprints(options['order'], options['limit'])
+
+    def show_fingerprints(self, order, limit):
+        rows = QueryFingerprint.objects.order_by(ORDERINGS[order])[:limit]
+        self.stdout.write(f'{"fingerprint":<16} {"calls":>10} {"total s":>10} {"mean ms":>9} {"max ms":>9}  SQL')
+        for row in rows:
+            self.stdout.write(
+                f'{row.fingerprint:<16} {row.calls:>10} {row.total_time:>10.2f} '
+                f'{row.mean_time * 1000:>9.1f} {row.max_time * 1000:>9.1f}  {row.sql[:100]}'
+            )
+
+    def show_samples(self, limit):
+        for sample in SlowQuery.objects.all()[:limit]:
+            self.stdout.write(self.style.WARNING(
+                f'{sample.created:%Y-%m-%d %H:%M:%S} {sample.duration * 1000:.1f} ms '
+                f'{sample.view or "-"} [{sample.fingerprint}]'
+            ))
+            self.stdout.write(sample.sql)
+            if sample.plan:
+                self.stdout.write(sample.plan)
+            self.stdout.write('')
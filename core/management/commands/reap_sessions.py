@@ -0,0 +1,34 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from core.sessions import DEFAULT_BATCH_SIZE, delete_expired_batches
+
+
+class Command(BaseCommand):
+    help = 'Delete expired sessions in small batches within a time budget (run from a systemd timer)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE,
+                            help='Rows deleted per batch (default: %(default)s)')
+        parser.add_argument('--time-budget', type=float, default=60.0,
+                            help='Stop starting new batches after this many seconds (default: %(default)s)')
+        parser.add_argument('--pause', type=float, default=0.05,
+                            help='Seconds to sleep between batches to spread out I/O (default: %(default)s)')
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        total = batches = 0
+        for deleted, seconds in delete_expired_batches(options['batch_size']):
+            batches += 1
+            total += deleted
+            self.stdout.write(f'Batch {batches}: deleted {deleted} sessions in {seconds * 1000:.1f} ms')
+            # Stop early if another batch of the same duration would overrun the budget
+            if time.monotonic() - started + seconds + options['pause'] > options['time_budget']:
+                self.stdout.write(self.style.WARNING('Time budget exhausted, remaining sessions left for the next run'))
+                break
+            time.sleep(options['pause'])
+        elapsed = time.monotonic() - started
+        self.stdout.write(self.style.SUCCESS(
+            f'Deleted {total} expired sessions in {batches} batches ({elapsed:.2f} s)'
+        ))
@@ -0,0 +1,222 @@
+"""
+Per-worker memory telemetry, recycling and tracemalloc snapshots.
+
+Gunicorn's ``post_request`` hook (``gunicorn.conf.py``) calls ``check`` after
+every request. At most every ``MEMORY_SAMPLE_INTERVAL`` seconds it reads the
+worker's RSS from /proc and the number of blocks Python's allocator has
+handed out. It logs both with their growth since the worker's first sample,
+and sets per-pid gauges in ``core.metrics``. RSS growing while the Python
+block count stays flat points at C extensions or allocator fragmentation.
+Both growing means Python objects are kept alive, and a tracemalloc diff
+shows where they are allocated.
+
+A worker whose RSS is above ``MEMORY_RSS_LIMIT_MB`` is recycled the way
+Gunicorn's ``max_requests`` does it: it finishes the current request and
+exits, and the master starts a fresh one.
+
+The superuser-only "Worker memory" admin page (``RequestProfileAdmin.memory_view``)
+lists each worker's last sample, read from ``METRICS_DIR``. It only reports:
+a request reaches whichever worker is free, so it cannot start or stop
+tracing in a chosen one.
+
+Snapshots are taken with ``kill -USR2 <worker pid>`` (installed by the
+``post_worker_init`` hook). The first one starts tracemalloc; each later one
+logs the growth since the previous snapshot, summed by module. Tracing slows
+the worker and uses memory itself until it exits, so end it with
+``kill -TERM <worker pid>``: the worker finishes its requests and the master
+starts a fresh one.
+"""
+import json
+import logging
+import os
+import signal
+import sys
+import threading
+import time
+import tracemalloc
+from collections import defaultdict
+from functools import lru_cache
+from pathlib import Path
+
+from django.conf import settings
+
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+MB = 1024 * 1024
+TRACE_FRAMES = 1
+TOP_MODULES = 25
+MODULE_DEPTH = 2
+
+_sampler = None
+_trace_lock = threading.Lock()
+_previous_snapshot = None
+
+
+def read_rss():
+    """Resident set size of this process in bytes (the peak where /proc is unavailable)."""
+    try:
+        with open('/proc/self/statm') as statm:
+            return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except OSError:
+        import resource
+
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def read_usage():
+    return {'rss': read_rss(), 'python_blocks': sys.getallocatedblocks()}
+
+
+class Sampler:
+    """Remembers a worker's first sample, so each later one reports the growth since start-up."""
+
+    def __init__(self):
+        self.pid = os.getpid()
+        self.baseline = None
+        self.sampled_at = float('-inf')
+
+    def due(self, now, interval):
+        return interval > 0 and now - self.sampled_at >= interval
+
+    def sample(self, now):
+        usage = read_usage()
+        self.baseline = self.baseline or usage
+        self.sampled_at = now
+        return usage
+
+
+def get_sampler():
+    """Return this process's sampler, starting a new one after fork."""
+    global _sampler
+    if _sampler is None or _sampler.pid != os.getpid():
+        _sampler = Sampler()
+    return _sampler
+
+
+def check():
+    """Sample this worker when due; return True when it is over ``MEMORY_RSS_LIMIT_MB`` and should exit."""
+    sampler = get_sampler()
+    now = time.monotonic()
+    if not sampler.due(now, settings.MEMORY_SAMPLE_INTERVAL):
+        return False
+    usage = sampler.sample(now)
+    logger.info(
+        'worker %d: rss %.1f MB (%+.1f MB since start), python blocks %d (%+d)',
+        sampler.pid, usage['rss'] / MB, (usage['rss'] - sampler.baseline['rss']) / MB,
+        usage['python_blocks'], usage['python_blocks'] - sampler.baseline['python_blocks'],
+    )
+    labels = (('pid', str(sampler.pid)),)
+    metrics.set_gauge('django_worker_rss_bytes', labels, usage['rss'])
+    metrics.set_gauge('django_worker_python_blocks', labels, usage['python_blocks'])
+    limit = settings.MEMORY_RSS_LIMIT_MB * MB
+    if limit and usage['rss'] > limit:
+        logger.warning('worker %d: rss %.1f MB is over MEMORY_RSS_LIMIT_MB, recycling it',
+                       sampler.pid, usage['rss'] / MB)
+        metrics.inc('django_worker_memory_recycles_total')
+        return True
+    return False
+
+
+def worker_samples(directory=None):
+    """Return ``{pid: {'rss': ..., 'python_blocks': ...}}`` from each live worker's last sample."""
+    directory = directory or settings.METRICS_DIR
+    if not directory:
+        return {}
+    gauges = {'django_worker_rss_bytes': 'rss', 'django_worker_python_blocks': 'python_blocks'}
+    workers = defaultdict(dict)
+    # Only live workers have a <pid>.db file; the master folds dead ones into the archive without their gauges
+    for path in sorted(Path(directory).glob('*.db')):
+        for key, value, _ in metrics.read_file(path):
+            name, labels = json.loads(key)
+            if name in gauges:
+                workers[int(dict(labels)['pid'])][gauges[name]] = int(value)
+    return dict(workers)
+
+
+@lru_cache(maxsize=4096)
+def module_name(filename, depth=MODULE_DEPTH):
+    """Turn a source path into its dotted module name, cut to ``depth`` parts (e.g. ``django.template``)."""
+    for root in sorted({path.rstrip(os.sep) for path in sys.path if path}, key=len, reverse=True):
+        if filename.startswith(root + os.sep):
+            parts = filename[len(root) + 1:].removesuffix('.py').split(os.sep)
+            if parts[-1] == '__init__':
+                parts.pop()
+            return '.'.join(parts[:depth])
+    return filename
+
+
+def take_snapshot():
+    return tracemalloc.take_snapshot().filter_traces((
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+        tracemalloc.Filter(False, '<unknown>'),
+    ))
+
+
+def group_by_module(statistics, depth=MODULE_DEPTH):
+    """Sum ``StatisticDiff``s per module; return ``(module, size, size_diff, count_diff)`` by growth."""
+    totals = defaultdict(lambda: [0, 0, 0])
+    for stat in statistics:
+        total = totals[module_name(stat.traceback[0].filename, depth)]
+        total[0] += stat.size
+        total[1] += stat.size_diff
+        total[2] += stat.count_diff
+    return sorted(((module, *total) for module, total in totals.items()), key=lambda row: row[2], reverse=True)
+
+
+def snapshot(limit=TOP_MODULES, blocking=True):
+    """
+    Start tracemalloc, or diff a new snapshot against the previous one; return the report lines.
+
+    Without ``blocking``, return None instead of waiting while another snapshot is being taken.
+    """
+    global _previous_snapshot
+    if not _trace_lock.acquire(blocking):
+        return None
+    try:
+        pid = os.getpid()
+        if not tracemalloc.is_tracing() or _previous_snapshot is None:
+            tracemalloc.start(TRACE_FRAMES)
+            _previous_snapshot = take_snapshot()
+            return [f'worker {pid}: tracemalloc started, take another snapshot to see what grew']
+        current = take_snapshot()
+        rows = group_by_module(current.compare_to(_previous_snapshot, 'filename'))
+        _previous_snapshot = current
+    finally:
+        _trace_lock.release()
+    traced, peak = tracemalloc.get_traced_memory()
+    lines = [
+        f'worker {pid}: rss {read_rss() / MB:.1f} MB, traced {traced / MB:.1f} MB (peak {peak / MB:.1f} MB)',
+        f'{"growth":>12} {"size":>12} {"blocks":>9}  module',
+    ]
+    lines += [
+        f'{size_diff / 1024:+9.1f} KiB {size / 1024:8.1f} KiB {count_diff:+9d}  {module}'
+        for module, size, size_diff, count_diff in rows[:limit]
+    ]
+    return lines
+
+
+def stop():
+    global _previous_snapshot
+    with _trace_lock:
+        tracemalloc.stop()
+        _previous_snapshot = None
+
+
+def log_snapshot(signum=None, frame=None):
+    # A signal handler runs between two bytecodes of the interrupted code, which may hold the (non-reentrant)
+    # lock in snapshot() or stop(), so it must not wait for it
+    lines = snapshot(blocking=False)
+    if lines is None:
+        logger.warning('worker %d: a snapshot is already being taken, send SIGUSR2 again later', os.getpid())
+        return
+    for line in lines:
+        logger.info(line)
+
+
+def install_signal_handler():
+    """Take (and log) a snapshot on SIGUSR2, which Gunicorn workers otherwise do not handle."""
+    signal.signal(signal.SIGUSR2, log_snapshot)
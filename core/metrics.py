@@ -0,0 +1,302 @@
+"""
+Multiprocess request metrics in the Prometheus text format.
+
+Each worker process writes to its own memory-mapped file in ``METRICS_DIR``
+(``<pid>.db``). Recording a sample is a dict lookup and an in-place float
+update in shared memory, with no locks and no system calls. ``/metrics``
+(served by ``core.middleware.MetricsMiddleware``) sums the files of all
+workers. Gunicorn's ``child_exit`` hook in ``gunicorn.conf.py`` calls
+``mark_process_dead``, which folds a dead worker's file into ``archive.db``
+(written only by the gunicorn master) so counters never go backwards.
+"""
+import json
+import mmap
+import os
+import struct
+import threading
+import time
+from collections import defaultdict
+from functools import lru_cache
+from pathlib import Path
+
+from django.conf import settings
+
+INITIAL_SIZE = 64 * 1024
+USED = struct.Struct('I')
+KEY_LENGTH = struct.Struct('I')
+VALUE = struct.Struct('d')
+# The first 8 bytes hold the number of bytes in use, entries start 8-byte aligned
+HEADER_SIZE = 8
+ARCHIVE = 'archive.db'
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, float('inf'))
+
+METRICS = {
+    # name: (type, help)
+    'django_http_requests_total': ('counter', 'Requests by view, method and status code.'),
+    'django_http_request_duration_seconds': ('histogram', 'Request latency by view.'),
+    'django_db_queries_total': ('counter', 'Database queries by view.'),
+    'django_db_query_duration_seconds_total': ('counter', 'Time spent in database queries by view.'),
+    'django_cache_gets_total': ('counter', 'Cache lookups by cache backend and result (hit or miss).'),
+    'django_worker_rss_bytes': ('gauge', 'Resident memory of each worker at its last sample (core.memory).'),
+    'django_worker_python_blocks': ('gauge', 'Memory blocks allocated by Python in each worker at its last sample.'),
+    'django_worker_memory_recycles_total': ('counter', 'Workers recycled for exceeding MEMORY_RSS_LIMIT_MB.'),
+}
+
+
+def read_entries(data):
+    """Yield ``(key, value, value offset)`` for each entry in a metrics file's bytes."""
+    used = min(USED.unpack_from(data, 0)[0], len(data))
+    pos = HEADER_SIZE
+    while pos + KEY_LENGTH.size <= used:
+        (length,) = KEY_LENGTH.unpack_from(data, pos)
+        key = bytes(data[pos + KEY_LENGTH.size:pos + KEY_LENGTH.size + length]).decode()
+        pos += KEY_LENGTH.size + length
+        pos += -pos % 8
+        if pos + VALUE.size > used:
+            return
+        yield key, VALUE.unpack_from(data, pos)[0], pos
+        pos += VALUE.size
+
+
+class MmapStore:
+    """
+    A growable file of ``(key, float)`` entries mapped into memory.
+
+    There must be exactly one writing process per file. Readers in other
+    processes see an entry once the header's used size covers it, which is
+    updated only after the entry has been written.
+    """
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.file = open(self.path, 'a+b')
+        size = os.fstat(self.file.fileno()).st_size
+        if size < INITIAL_SIZE:
+            self.file.truncate(INITIAL_SIZE)
+            size = INITIAL_SIZE
+        self.capacity = size
+        self.map = mmap.mmap(self.file.fileno(), self.capacity)
+        self.used = USED.unpack_from(self.map, 0)[0] or HEADER_SIZE
+        USED.pack_into(self.map, 0, self.used)
+        self.positions = {key: pos for key, _, pos in read_entries(self.map)}
+
+    def inc(self, key, amount=1.0):
+        pos = self.positions.get(key)
+        if pos is None:
+            pos = self.add(key)
+        VALUE.pack_into(self.map, pos, VALUE.unpack_from(self.map, pos)[0] + amount)
+
+    def set(self, key, value):
+        pos = self.positions.get(key)
+        if pos is None:
+            pos = self.add(key)
+        VALUE.pack_into(self.map, pos, value)
+
+    def add(self, key):
+        encoded = key.encode()
+        size = KEY_LENGTH.size + len(encoded)
+        size += -size % 8
+        while self.used + size + VALUE.size > self.capacity:
+            self.capacity *= 2
+            self.file.truncate(self.capacity)
+            self.map.close()
+            self.map = mmap.mmap(self.file.fileno(), self.capacity)
+        KEY_LENGTH.pack_into(self.map, self.used, len(encoded))
+        self.map[self.used + KEY_LENGTH.size:self.used + KEY_LENGTH.size + len(encoded)] = encoded
+        pos = self.used + size
+        VALUE.pack_into(self.map, pos, 0.0)
+        self.used = pos + VALUE.size
+        USED.pack_into(self.map, 0, self.used)
+        self.positions[key] = pos
+        return pos
+
+    def close(self):
+        self.map.close()
+        self.file.close()
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_store():
+    """Return this process's store, opening it after start-up or fork, or None when disabled."""
+    global _store
+    directory = settings.METRICS_DIR
+    if not directory:
+        return None
+    pid = os.getpid()
+    if _store is None or _store.owner != (pid, directory):
+        with _store_lock:
+            if _store is None or _store.owner != (pid, directory):
+                store = MmapStore(Path(directory) / f'{pid}.db')
+                store.owner = (pid, directory)
+                _store = store
+    return _store
+
+
+@lru_cache(maxsize=4096)
+def sample_key(name, labels):
+    return json.dumps([name, labels])
+
+
+def inc(name, labels=(), amount=1.0):
+    """Increment a counter sample. ``labels`` is a tuple of ``(name, value)`` pairs."""
+    store = get_store()
+    if store is not None:
+        store.inc(sample_key(name, labels), amount)
+
+
+def set_gauge(name, labels, value):
+    """Set a gauge sample; label it with the pid, since dead workers' gauges are dropped, not archived."""
+    store = get_store()
+    if store is not None:
+        store.set(sample_key(name, labels), value)
+
+
+def observe(name, labels, value):
+    """Record ``value`` in a histogram (buckets are stored uncumulated and summed on export)."""
+    store = get_store()
+    if store is None:
+        return
+    bucket = next(bound for bound in LATENCY_BUCKETS if value <= bound)
+    store.inc(sample_key(f'{name}_bucket', (*labels, ('le', bucket))))
+    store.inc(sample_key(f'{name}_sum', labels), value)
+    store.inc(sample_key(f'{name}_count', labels))
+
+
+class QueryTimer:
+    """``connection.execute_wrapper`` that counts queries and their total time."""
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.count += 1
+            self.duration += time.perf_counter() - started
+
+
+def record_request(request, response, duration, queries):
+    match = getattr(request, 'resolver_match', None)
+    # Unresolved paths share one label so scanners cannot create unbounded series
+    view = match.view_name if match else '<unresolved>'
+    inc('django_http_requests_total', (('method', request.method), ('status', str(response.status_code)),
+                                       ('view', view)))
+    observe('django_http_request_duration_seconds', (('view', view),), duration)
+    if queries.count:
+        inc('django_db_queries_total', (('view', view),), queries.count)
+        inc('django_db_query_duration_seconds_total', (('view', view),), queries.duration)
+
+
+_MISSING = object()
+
+
+def instrument_cache_backend(backend_class):
+    """Count hits and misses of ``get``/``get_many`` on a cache backend class (once per class)."""
+    if getattr(backend_class, '_metrics_instrumented', False):
+        return
+    original_get, original_get_many = backend_class.get, backend_class.get_many
+    backend = backend_class.__name__
+
+    def get(self, key, default=None, version=None):
+        value = original_get(self, key, _MISSING, version)
+        hit = value is not _MISSING
+        inc('django_cache_gets_total', (('backend', backend), ('result', 'hit' if hit else 'miss')))
+        return value if hit else default
+
+    def get_many(self, keys, version=None):
+        keys = list(keys)
+        values = original_get_many(self, keys, version)
+        if values:
+            inc('django_cache_gets_total', (('backend', backend), ('result', 'hit')), len(values))
+        if len(keys) > len(values):
+            inc('django_cache_gets_total', (('backend', backend), ('result', 'miss')), len(keys) - len(values))
+        return values
+
+    backend_class.get, backend_class.get_many = get, get_many
+    backend_class._metrics_instrumented = True
+
+
+def read_file(path):
+    try:
+        data = Path(path).read_bytes()
+    except FileNotFoundError:  # a worker exited between listing and reading
+        return []
+    return list(read_entries(data)) if len(data) >= HEADER_SIZE else []
+
+
+def mark_process_dead(pid, directory=None):
+    """Fold a dead worker's samples into the archive file and remove its file (gunicorn master only)."""
+    directory = Path(directory or settings.METRICS_DIR)
+    path = directory / f'{pid}.db'
+    if not path.exists():
+        return
+    archive = MmapStore(directory / ARCHIVE)
+    try:
+        for key, value, _ in read_file(path):
+            if METRICS.get(json.loads(key)[0], ('counter',))[0] != 'gauge':
+                archive.inc(key, value)
+    finally:
+        archive.close()
+    path.unlink(missing_ok=True)
+
+
+def format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    escaped = (
+        (name, str(value).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n'))
+        for name, value in labels
+    )
+    return '{' + ','.join(f'{name}="{value}"' for name, value in escaped) + '}'
+
+
+def collect(directory=None):
+    """Sum the samples of every worker file (and the archive) and render them for Prometheus."""
+    directory = Path(directory or settings.METRICS_DIR)
+    totals = defaultdict(float)
+    for path in directory.glob('*.db'):
+        for key, value, _ in read_file(path):
+            totals[key] += value
+    samples = defaultdict(list)
+    for key, value in totals.items():
+        name, labels = json.loads(key)
+        samples[name].append((tuple(map(tuple, labels)), value))
+    lines = []
+    for family, (metric_type, help_text) in METRICS.items():
+        if metric_type == 'histogram':
+            family_lines = list(histogram_lines(family, samples))
+        else:
+            family_lines = [f'{family}{format_labels(labels)} {format_value(value)}'
+                            for labels, value in sorted(samples[family])]
+        if family_lines:
+            lines += [f'# HELP {family} {help_text}', f'# TYPE {family} {metric_type}', *family_lines]
+    return '\n'.join(lines) + '\n'
+
+
+def histogram_lines(family, samples):
+    buckets = defaultdict(dict)
+    for labels, value in samples[f'{family}_bucket']:
+        *base, (_, bound) = labels
+        buckets[tuple(base)][bound] = value
+    sums = dict(samples[f'{family}_sum'])
+    counts = dict(samples[f'{family}_count'])
+    for labels in sorted(counts):
+        cumulative = 0.0
+        for bound in LATENCY_BUCKETS:
+            cumulative += buckets[labels].get(bound, 0.0)
+            yield f'{family}_bucket{format_labels((*labels, ("le", format_value(bound))))} {format_value(cumulative)}'
+        yield f'{family}_sum{format_labels(labels)} {format_value(sums.get(labels, 0.0))}'
+        yield f'{family}_count{format_labels(labels)} {format_value(counts[labels])}'
@@ -0,0 +1,271 @@
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.exceptions import MiddlewareNotUsed
+from django.http import HttpResponse, HttpResponseForbidden, JsonResponse
+from django.urls import Resolver404, resolve
+from django.utils.cache import add_never_cache_headers, patch_vary_headers
+
+from . import compression, health, metrics, profiling, querystats, ratelimit, serviceworker, sites, streaming, unpoly
+from .views import rate_limited
+
+
+class RateLimitMiddleware:
+    """
+    Reject over-limit requests before the session or database are touched.
+
+    Limits are configured per URL name and HTTP method in ``RATELIMITS``.
+    Keep this middleware above SessionMiddleware in ``MIDDLEWARE``.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.enabled = settings.RATELIMIT_ENABLED
+        self.rules = {
+            route: {method.upper(): ratelimit.parse_rates(rates) for method, rates in methods.items()}
+            for route, methods in settings.RATELIMITS.items()
+        }
+
+    def __call__(self, request):
+        if self.enabled and self.rules:
+            response = self.check(request)
+            if response is not None:
+                return response
+        return self.get_response(request)
+
+    def check(self, request):
+        try:
+            route = resolve(request.path_info).view_name
+        except Resolver404:
+            return None
+        methods = self.rules.get(route)
+        if not methods:
+            return None
+        rates = methods.get(request.method, []) + methods.get('*', [])
+        if not rates:
+            return None
+        decision = ratelimit.check(request, route, rates)
+        if decision.allowed:
+            return None
+        response = rate_limited(request)
+        response['Retry-After'] = str(decision.retry_after)
+        return response
+
+
+class SiteMiddleware:
+    """
+    Set ``request.site`` to the Site for the request's Host header.
+
+    Sites are cached per process (see ``core.sites``), so this is normally a
+    dict lookup. Unknown hosts get the ``DEFAULT_SITE_ID`` site.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        request.site = sites.get_site(request)
+        return self.get_response(request)
+
+
+class ServiceWorkerMiddleware:
+    """
+    Mark responses of ``public_page`` views the service worker may cache (see core.serviceworker).
+
+    Only anonymous responses that set no cookie and use no CSRF token are
+    marked. Place it above SessionMiddleware, CsrfViewMiddleware and
+    MessageMiddleware so it sees the cookies they set.
+    Disabled by ``SERVICE_WORKER_ENABLED``.
+    """
+
+    def __init__(self, get_response):
+        if not settings.SERVICE_WORKER_ENABLED:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        response = self.get_response(request)
+        if getattr(request, 'service_worker_cacheable', False) and serviceworker.is_shareable(request, response):
+            response.headers[serviceworker.CACHE_HEADER] = 'public'
+        return response
+
+
+class UnpolyMiddleware:
+    """
+    Trim full-page responses down to ``<main>`` for Unpoly main-target requests.
+
+    Sets ``up_main_only`` in the context of unrendered TemplateResponses, which
+    base.html uses to skip the sidebar, header, footer and asset tags, and adds
+    the ``Vary`` header so HTTP caches keep the variants apart.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        response = self.get_response(request)
+        if request.method in unpoly.UNSAFE_METHODS and 'X-Up-Version' in request.headers:
+            response.setdefault('X-Up-Expire-Cache', '*')
+        return response
+
+    def process_template_response(self, request, response):
+        patch_vary_headers(response, ('X-Up-Target', 'X-Up-Fail-Target'))
+        if unpoly.is_main_target(unpoly.get_target(request, response)):
+            response.context_data = {**(response.context_data or {}), 'up_main_only': True}
+        return response
+
+
+class HealthCheckMiddleware:
+    """
+    Answer ``/healthz`` (liveness) and ``/readyz`` (readiness) without running the rest of the stack.
+
+    Keep this first in ``MIDDLEWARE`` so probes skip HTTPS redirects, sessions,
+    CSRF, allauth and ``ATOMIC_REQUESTS``. The Host header is not validated.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if request.path_info == '/healthz':
+            response = HttpResponse('ok', content_type='text/plain')
+        elif request.path_info == '/readyz':
+            ready, checks = health.readiness()
+            response = JsonResponse({'status': 'ok' if ready else 'unavailable', 'checks': checks},
+                                    status=200 if ready else 503)
+        else:
+            return self.get_response(request)
+        add_never_cache_headers(response)
+        return response
+
+
+class MetricsMiddleware:
+    """
+    Record request latency, status codes, query counts and cache hits, and serve ``/metrics``.
+
+    Disabled unless ``METRICS_DIR`` is set. Place it directly below
+    HealthCheckMiddleware so probes are not counted and everything else is.
+    ``/metrics`` is only served to ``METRICS_ALLOWED_IPS``.
+    """
+
+    def __init__(self, get_response):
+        if not settings.METRICS_DIR:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.allowed_ips = set(settings.METRICS_ALLOWED_IPS)
+        for alias in settings.CACHES:
+            metrics.instrument_cache_backend(type(caches[alias]))
+
+    def __call__(self, request):
+        if request.path_info == '/metrics':
+            return self.serve(request)
+        queries = metrics.QueryTimer()
+        started = time.perf_counter()
+        with streaming.execute_wrapper(request, queries):
+            response = self.get_response(request)
+        if getattr(response, 'early_flush', False):
+            # The body renders as it is sent (core.streaming), so count its queries and time too
+            response.streaming_content = self.record_after(response.streaming_content, request, response,
+                                                           started, queries)
+        else:
+            metrics.record_request(request, response, time.perf_counter() - started, queries)
+        return response
+
+    def record_after(self, content, request, response, started, queries):
+        try:
+            yield from content
+        finally:
+            metrics.record_request(request, response, time.perf_counter() - started, queries)
+
+    def serve(self, request):
+        if ratelimit.get_client_ip(request) not in self.allowed_ips:
+            return HttpResponseForbidden()
+        response = HttpResponse(metrics.collect(), content_type='text/plain; version=0.0.4; charset=utf-8')
+        add_never_cache_headers(response)
+        return response
+
+
+class ProfilerMiddleware:
+    """
+    Profile requests that carry a staff profiling token (see core.profiling).
+
+    Place it directly below QueryStatsMiddleware so the profile covers the
+    rest of the stack. Other requests only pay for the token lookup.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        token = profiling.get_token(request)
+        if token is None:
+            return self.get_response(request)
+        user_id = profiling.token_user_id(token)
+        if user_id is None:
+            return self.get_response(request)
+        return profiling.profile_request(self.get_response, request, user_id)
+
+
+class QueryStatsMiddleware:
+    """
+    Fingerprint and time every query of a request, sampling slow ones (see core.querystats).
+
+    Enabled by ``QUERYSTATS_ENABLED`` (on by default when ``DEBUG`` is off).
+    """
+
+    def __init__(self, get_response):
+        if not settings.QUERYSTATS_ENABLED:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        with streaming.execute_wrapper(request, querystats.QueryRecorder(request)):
+            return self.get_response(request)
+
+
+class CompressionMiddleware:
+    """
+    Compress dynamic responses with the best of brotli, zstd and gzip the client accepts.
+
+    See ``core.compression`` for the levels and the BREACH padding of pages that
+    use the CSRF token. Place it right below WhiteNoiseMiddleware (static files
+    are compressed ahead of time) and above everything that sets ETags.
+    Disabled by ``COMPRESSION_ENABLED``.
+    """
+
+    def __init__(self, get_response):
+        if not settings.COMPRESSION_ENABLED:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.encoders = compression.available_encoders()
+
+    def __call__(self, request):
+        response = self.get_response(request)
+        if not compression.is_compressible(response, settings.COMPRESSION_MIN_SIZE):
+            return response
+        patch_vary_headers(response, ('Accept-Encoding',))
+        # get_token() sets this flag when the page contains a CSRF token (CsrfViewMiddleware resets it to False)
+        padded = 'CSRF_COOKIE_NEEDS_UPDATE' in request.META
+        encoder_class = compression.negotiate(request.headers.get('Accept-Encoding', ''), self.encoders, padded)
+        if encoder_class is None:
+            return response
+        encoder = encoder_class(
+            settings.COMPRESSION_LEVELS[encoder_class.name],
+            compression.padding_size(settings.COMPRESSION_MAX_PADDING) if padded else 0,
+        )
+        if response.streaming:
+            if response.is_async:
+                response.streaming_content = compression.acompress_sequence(encoder, response.streaming_content)
+            else:
+                response.streaming_content = compression.compress_sequence(encoder, response.streaming_content)
+            del response.headers['Content-Length']
+        else:
+            response.content = compression.compress(encoder, response.content)
+            response.headers['Content-Length'] = str(len(response.content))
+        # The compressed bytes differ from those a strong ETag was computed for
+        etag = response.get('ETag')
+        if etag and etag.startswith('"'):
+            response.headers['ETag'] = 'W/' + etag
+        response.headers['Content-Encoding'] = encoder_class.name
+        return response
@@ -0,0 +1,248 @@
+"""
+Static checks for migration operations that lock busy PostgreSQL tables.
+
+Most schema changes take an ACCESS EXCLUSIVE lock on their table. While one
+waits for that lock, every later query on the table (each login reads
+``users_customuser``) queues behind it, and while it holds the lock, rewrites,
+index builds and full-table validations stall the site. ``check_migrations``
+reports such operations before ``migrate`` runs and points at the online
+alternatives in ``core.operations``.
+
+A migration with ``atomic = False`` is only recorded as applied once all its
+operations have run, so when ``migrate`` retries it after a lock timeout, the
+operations before the one that timed out run again. Such migrations should
+hold only operations that can run twice (``core.operations``' concurrent
+index operations, backfills and validation); anything else is reported.
+
+Operations on tables created in the same migration are not reported, since
+those tables are empty. A migration can acknowledge reviewed findings with a
+``check_migrations_ignore = {'<code>', ...}`` class attribute.
+"""
+import re
+from dataclasses import dataclass
+
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.db.migrations import operations
+from django.db.migrations.loader import MigrationLoader
+from django.db.models import CheckConstraint, UniqueConstraint
+
+from . import operations as online
+
+INFO, WARNING, ERROR = 'info', 'warning', 'error'
+LEVELS = {INFO: 0, WARNING: 1, ERROR: 2}
+
+VARCHAR = re.compile(r'^varchar\((\d+)\)$')
+
+# Operations that a retried non-atomic migration can run again, and those that do not touch the database
+RETRY_SAFE = (
+    online.AddIndexConcurrently, online.RemoveIndexConcurrently, online.BatchedBackfill, online.ValidateConstraint,
+)
+STATE_ONLY = (operations.AlterModelOptions, operations.AlterModelManagers)
+
+
+@dataclass(frozen=True)
+class Finding:
+    migration: str
+    operation: str
+    code: str
+    level: str
+    message: str
+    hint: str = ''
+
+
+def type_change_is_safe(old_type, new_type):
+    """Widening a varchar, or turning it into text, only changes the catalog in PostgreSQL."""
+    old, new = VARCHAR.match(old_type or ''), VARCHAR.match(new_type or '')
+    if old and new:
+        return int(new[1]) >= int(old[1])
+    return bool(old) and new_type == 'text'
+
+
+def needs_non_atomic(operation):
+    """Concurrent index operations (ours or django.contrib.postgres's) and batched backfills."""
+    return isinstance(operation, online.BatchedBackfill) or type(operation).__name__.endswith('Concurrently')
+
+
+def not_retry_safe(migration):
+    """Return the operations of a non-atomic migration that fail or repeat their work when it runs again."""
+    if migration.atomic or not any(needs_non_atomic(operation) for operation in migration.operations):
+        return []
+    schema = [operation for operation in migration.operations if not isinstance(operation, STATE_ONLY)]
+    # A single statement that fails leaves nothing behind to run twice
+    if len(schema) < 2:
+        return []
+    return [operation for operation in schema if not isinstance(operation, RETRY_SAFE)]
+
+
+def is_indexed(field):
+    return (field.db_index or field.unique) and not field.primary_key
+
+
+def is_foreign_key(field):
+    return field.many_to_one and field.db_constraint
+
+
+def check_field_added(field, name):
+    if field.many_to_many:
+        return
+    if not field.null and not field.has_db_default():
+        yield (
+            'not-null', WARNING,
+            f'Adds NOT NULL column "{name}"; the table is locked while every row gets the default.',
+            'Add it with null=True, fill it with BatchedBackfill, and validate NOT NULL with AddConstraintNotValid.',
+        )
+    if is_indexed(field):
+        yield (
+            'index', ERROR,
+            f'Builds an index on "{name}" while writes to the table are blocked.',
+            'Add the field without db_index/unique and create the index with AddIndexConcurrently.',
+        )
+    if is_foreign_key(field):
+        yield (
+            'foreign-key', WARNING,
+            f'Adds a foreign key on "{name}" that validates every row while locking both tables.',
+            'Use db_constraint=False, then add the constraint NOT VALID with RunSQL and validate it later.',
+        )
+
+
+def check_field_altered(old, new, name, connection):
+    old_type = old.db_parameters(connection)['type']
+    new_type = new.db_parameters(connection)['type']
+    if old_type != new_type and not type_change_is_safe(old_type, new_type):
+        yield (
+            'type-change', ERROR,
+            f'Changes "{name}" from {old_type} to {new_type}, rewriting the table under an exclusive lock.',
+            'Add a new column, backfill it with BatchedBackfill, switch the code over, then drop the old column.',
+        )
+    if old.null and not new.null:
+        yield (
+            'not-null', ERROR,
+            f'Makes "{name}" NOT NULL, which scans the whole table under an exclusive lock.',
+            f'First add CheckConstraint(condition=Q({name}__isnull=False)) with AddConstraintNotValid and '
+            'ValidateConstraint; PostgreSQL then skips the scan.',
+        )
+    if is_indexed(new) and not is_indexed(old):
+        yield (
+            'index', ERROR,
+            f'Builds an index on "{name}" while writes to the table are blocked.',
+            'Create the index with AddIndexConcurrently instead of db_index/unique.',
+        )
+    if is_foreign_key(new) and not is_foreign_key(old):
+        yield (
+            'foreign-key', WARNING,
+            f'Adds a foreign key constraint on "{name}" that validates every row while locking both tables.',
+            'Add the constraint NOT VALID with RunSQL and validate it in a later migration.',
+        )
+
+
+def check_operation(operation, state, app_label, connection):
+    """Yield ``(code, level, message, hint)`` for one operation, given the state before it."""
+    if isinstance(operation, online.AddConstraintNotValid | online.ValidateConstraint) or needs_non_atomic(operation):
+        return
+    if isinstance(operation, operations.AddIndex):
+        yield (
+            'index', ERROR, f'Builds index {operation.index.name} while writes to the table are blocked.',
+            'Use core.operations.AddIndexConcurrently in a migration with atomic = False.',
+        )
+    elif isinstance(operation, operations.RemoveIndex):
+        yield (
+            'index', WARNING, f'Drops index {operation.name} under an exclusive lock.',
+            'Use core.operations.RemoveIndexConcurrently in a migration with atomic = False.',
+        )
+    elif isinstance(operation, operations.AddField):
+        yield from check_field_added(operation.field, operation.name)
+    elif isinstance(operation, operations.AlterField):
+        model_state = state.models[app_label, operation.model_name_lower]
+        yield from check_field_altered(model_state.fields[operation.name], operation.field, operation.name, connection)
+    elif isinstance(operation, operations.AddConstraint):
+        if isinstance(operation.constraint, CheckConstraint):
+            yield (
+                'constraint', ERROR,
+                f'Adds constraint {operation.constraint.name}, checking every row under an exclusive lock.',
+                'Use AddConstraintNotValid, then ValidateConstraint (ideally in a later migration).',
+            )
+        elif isinstance(operation.constraint, UniqueConstraint):
+            yield (
+                'index', ERROR,
+                f'Adds unique constraint {operation.constraint.name}, building its index under an exclusive lock.',
+                'Build a unique index with RunSQL("CREATE UNIQUE INDEX CONCURRENTLY ...") and attach it '
+                'with ADD CONSTRAINT ... USING INDEX.',
+            )
+    elif isinstance(operation, operations.AlterUniqueTogether | operations.AlterIndexTogether):
+        if operation.option_value:
+            yield (
+                'index', ERROR, 'Builds indexes for unique/index_together under an exclusive lock.',
+                'Replace them with indexes created by AddIndexConcurrently.',
+            )
+    elif isinstance(operation, operations.RenameField | operations.RenameModel | operations.AlterModelTable):
+        yield (
+            'rename', WARNING, 'Renames a column or table that the running code still uses during the deploy.',
+            'Add the new name, copy the data, deploy the code, then remove the old name.',
+        )
+    elif isinstance(operation, operations.RemoveField | operations.DeleteModel):
+        yield (
+            'remove', WARNING, 'Removes a column or table that the running code may still select.',
+            'Deploy code that no longer uses it first, then remove it in a later release.',
+        )
+    elif isinstance(operation, operations.RunSQL | operations.RunPython):
+        yield (
+            'unchecked', INFO, 'Runs custom SQL or Python, which cannot be checked statically.',
+            'Keep it short, or batch large updates with BatchedBackfill.',
+        )
+
+
+def check_migration(migration, state, connection):
+    """Return the Findings for ``migration``, given the project state before it."""
+    label = f'{migration.app_label}.{migration.name}'
+    ignored = set(getattr(migration, 'check_migrations_ignore', ()))
+    state = state.clone()
+    created = set()
+    findings = []
+    repeated = not_retry_safe(migration)
+    for operation in migration.operations:
+        if operation in repeated and 'retry' not in ignored:
+            findings.append(Finding(
+                label, operation.describe(), 'retry', ERROR,
+                'Runs outside a transaction next to concurrent operations; when migrate retries the migration '
+                'after a lock timeout, it runs again (e.g. ADD COLUMN fails because the column exists).',
+                'Move it into a separate, atomic migration and keep only the concurrent operations and '
+                'backfills in the one with atomic = False.',
+            ))
+        model_name = getattr(operation, 'model_name_lower', None) or getattr(operation, 'name_lower', None)
+        if isinstance(operation, operations.CreateModel):
+            created.add(operation.name_lower)
+        elif model_name not in created:
+            if migration.atomic and needs_non_atomic(operation):
+                findings.append(Finding(
+                    label, operation.describe(), 'atomic', ERROR,
+                    f'{operation.__class__.__name__} cannot run inside the migration transaction.',
+                    'Set atomic = False on the migration.',
+                ))
+            for code, level, message, hint in check_operation(operation, state, migration.app_label, connection):
+                if code not in ignored:
+                    findings.append(Finding(label, operation.describe(), code, level, message, hint))
+        operation.state_forwards(migration.app_label, state)
+    return findings
+
+
+def check_migrations(app_labels=None, include_applied=False, database=DEFAULT_DB_ALIAS):
+    """
+    Check migrations in plan order and return their Findings.
+
+    Only migrations not yet applied to ``database`` are checked, unless
+    ``include_applied`` is set (which needs no database connection).
+    """
+    connection = connections[database]
+    loader = MigrationLoader(None if include_applied else connection, ignore_no_migrations=True)
+    applied = loader.applied_migrations or {}
+    plan, seen = [], set()
+    for leaf in loader.graph.leaf_nodes():
+        for key in loader.graph.forwards_plan(leaf):
+            if key not in seen and key not in applied and (not app_labels or key[0] in app_labels):
+                seen.add(key)
+                plan.append(key)
+    findings = []
+    for key in plan:
+        state = loader.project_state(key, at_end=False)
+        findings.extend(check_migration(loader.graph.nodes[key], state, connection))
+    return findings
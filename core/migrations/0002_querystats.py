@@ -0,0 +1,46 @@
+# Generated by Django 6.0.1 on 2026-10-18 23:51
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='QueryFingerprint',
+            fields=[
+                ('fingerprint', models.CharField(max_length=16, primary_key=True, serialize=False, verbose_name='fingerprint')),
+                ('sql', models.TextField(verbose_name='normalised SQL')),
+                ('calls', models.BigIntegerField(default=0, verbose_name='calls')),
+                ('total_time', models.FloatField(default=0.0, verbose_name='total time (s)')),
+                ('max_time', models.FloatField(default=0.0, verbose_name='max time (s)')),
+                ('last_seen', models.DateTimeField(verbose_name='last seen')),
+            ],
+            options={
+                'verbose_name': 'query fingerprint',
+                'verbose_name_plural': 'query fingerprints',
+                'ordering': ['-total_time'],
+            },
+        ),
+        migrations.CreateModel(
+            name='SlowQuery',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('fingerprint', models.CharField(db_index=True, max_length=16, verbose_name='fingerprint')),
+                ('sql', models.TextField(verbose_name='SQL')),
+                ('duration', models.FloatField(verbose_name='duration (s)')),
+                ('view', models.CharField(blank=True, max_length=200, verbose_name='view')),
+                ('plan', models.TextField(blank=True, verbose_name='plan')),
+                ('created', models.DateTimeField(auto_now_add=True, db_index=True, verbose_name='created')),
+            ],
+            options={
+                'verbose_name': 'slow query',
+                'verbose_name_plural': 'slow queries',
+                'ordering': ['-created'],
+            },
+        ),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 6.0.1 on 2026-10-19 11:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0002_querystats'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RequestProfile',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created', models.DateTimeField(db_index=True, verbose_name='created')),
+                ('method', models.CharField(max_length=10, verbose_name='method')),
+                ('path', models.CharField(max_length=500, verbose_name='path')),
+                ('view', models.CharField(blank=True, max_length=200, verbose_name='view')),
+                ('status', models.PositiveSmallIntegerField(verbose_name='status')),
+                ('duration', models.FloatField(verbose_name='duration (s)')),
+                ('samples', models.PositiveIntegerField(verbose_name='samples')),
+                ('user_id', models.BigIntegerField(blank=True, null=True, verbose_name='requested by (user id)')),
+                ('file', models.CharField(max_length=200, verbose_name='file')),
+                ('size', models.PositiveIntegerField(verbose_name='size (bytes)')),
+            ],
+            options={
+                'verbose_name': 'request profile',
+                'verbose_name_plural': 'request profiles',
+                'ordering': ['-created'],
+            },
+        ),
+    ]
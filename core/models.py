@@ -1,3 +1,101 @@
+from django.contrib.sessions.base_session import AbstractBaseSession
 from django.db import models
+from django.utils.translation import gettext_lazy as _
 
-# Create your models here.
+
+class Session(AbstractBaseSession):
+    """
+    Database session used by the ``core.sessions`` engine.
+
+    Adds the authenticated user's id so a user's sessions can be listed or
+    ended without decoding every row. ``expire_date`` keeps the inherited
+    index, which the batched reaper (``reap_sessions``) walks.
+    """
+
+    user_id = models.BigIntegerField(_("user id"), null=True, blank=True, db_index=True)
+
+    @classmethod
+    def get_session_store_class(cls):
+        from .sessions import SessionStore
+        return SessionStore
+
+    class Meta(AbstractBaseSession.Meta):
+        db_table = 'core_session'
+
+
+class QueryFingerprint(models.Model):
+    """
+    Running totals for one normalised SQL statement, summed over all workers.
+
+    Rows are upserted by the ``core.querystats`` background thread; the
+    fingerprint is a hash of the normalised SQL.
+    """
+
+    fingerprint = models.CharField(_("fingerprint"), max_length=16, primary_key=True)
+    sql = models.TextField(_("normalised SQL"))
+    calls = models.BigIntegerField(_("calls"), default=0)
+    total_time = models.FloatField(_("total time (s)"), default=0.0)
+    max_time = models.FloatField(_("max time (s)"), default=0.0)
+    last_seen = models.DateTimeField(_("last seen"))
+
+    class Meta:
+        ordering = ['-total_time']
+        verbose_name = _("query fingerprint")
+        verbose_name_plural = _("query fingerprints")
+
+    def __str__(self):
+        return self.fingerprint
+
+    @property
+    def mean_time(self):
+        return self.total_time / self.calls if self.calls else 0.0
+
+
+class SlowQuery(models.Model):
+    """
+    A sampled query that exceeded ``QUERYSTATS_SLOW_MS``, with its EXPLAIN plan.
+
+    Only the SQL with placeholders is stored, never the parameters.
+    """
+
+    fingerprint = models.CharField(_("fingerprint"), max_length=16, db_index=True)
+    sql = models.TextField(_("SQL"))
+    duration = models.FloatField(_("duration (s)"))
+    view = models.CharField(_("view"), max_length=200, blank=True)
+    plan = models.TextField(_("plan"), blank=True)
+    created = models.DateTimeField(_("created"), auto_now_add=True, db_index=True)
+
+    class Meta:
+        ordering = ['-created']
+        verbose_name = _("slow query")
+        verbose_name_plural = _("slow queries")
+
+    def __str__(self):
+        return f'{self.fingerprint} ({self.duration * 1000:.0f} ms)'
+
+
+class RequestProfile(models.Model):
+    """
+    A sampled profile of one request, taken on demand by staff (see core.profiling).
+
+    The stacks are in ``file`` under ``PROFILE_DIR``, in the collapsed format.
+    """
+
+    created = models.DateTimeField(_("created"), db_index=True)
+    method = models.CharField(_("method"), max_length=10)
+    path = models.CharField(_("path"), max_length=500)
+    view = models.CharField(_("view"), max_length=200, blank=True)
+    status = models.PositiveSmallIntegerField(_("status"))
+    duration = models.FloatField(_("duration (s)"))
+    samples = models.PositiveIntegerField(_("samples"))
+    user_id = models.BigIntegerField(_("requested by (user id)"), null=True, blank=True)
+    file = models.CharField(_("file"), max_length=200)
+    size = models.PositiveIntegerField(_("size (bytes)"))
+
+    class Meta:
+        ordering = ['-created']
+        verbose_name = _("request profile")
+        verbose_name_plural = _("request profiles")
+
+    def __str__(self):
+        return f'{self.method} {self.path} ({self.duration * 1000:.0f} ms)'
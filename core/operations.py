@@ -0,0 +1,238 @@
+"""
+Online schema-change operations for busy PostgreSQL tables.
+
+Use them on large, hot tables such as ``users_customuser`` and
+``core_session``, in migrations marked ``atomic = False``:
+
+* ``AddIndexConcurrently`` / ``RemoveIndexConcurrently`` build or drop an
+  index without blocking writes;
+* ``AddConstraintNotValid`` adds a check constraint that only new rows must
+  satisfy, and ``ValidateConstraint`` (ideally in a later migration) checks
+  the existing rows while reads and writes continue;
+* ``BatchedBackfill`` fills a column in short transactions of ``batch_size`` rows.
+
+On other databases (SQLite in development) they behave like the plain
+operations. ``manage.py check_migrations`` suggests them.
+"""
+import time
+
+from django.db import NotSupportedError, transaction
+from django.db.migrations.operations import AddConstraint, AddIndex, RemoveIndex
+from django.db.migrations.operations.base import Operation
+from django.db.models import CheckConstraint
+
+
+def is_postgresql(schema_editor):
+    return schema_editor.connection.vendor == 'postgresql'
+
+
+def ensure_not_in_transaction(schema_editor, operation):
+    if schema_editor.connection.in_atomic_block:
+        raise NotSupportedError(
+            f"The {operation.__class__.__name__} operation cannot be executed inside a transaction "
+            "(set atomic = False on the migration)."
+        )
+
+
+def index_is_valid(schema_editor, name):
+    """Return True for a usable index, False for one left INVALID by a failed concurrent build, else None."""
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT i.indisvalid FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid "
+            "WHERE c.relname = %s AND pg_catalog.pg_table_is_visible(c.oid)",
+            [name],
+        )
+        row = cursor.fetchone()
+    return row[0] if row else None
+
+
+class AddIndexConcurrently(AddIndex):
+    """
+    Create an index with CREATE INDEX CONCURRENTLY.
+
+    Safe to retry: a valid index of the same name is kept, and an invalid one
+    left behind by a cancelled build (e.g. after ``lock_timeout``) is dropped
+    and built again.
+    """
+
+    atomic = False
+
+    def describe(self):
+        return f"Concurrently create index {self.index.name} on {self.model_name}"
+
+    def database_forwards(self, app_label, schema_editor, from_state, to_state):
+        if not is_postgresql(schema_editor):
+            return super().database_forwards(app_label, schema_editor, from_state, to_state)
+        ensure_not_in_transaction(schema_editor, self)
+        model = to_state.apps.get_model(app_label, self.model_name)
+        if not self.allow_migrate_model(schema_editor.connection.alias, model):
+            return
+        valid = index_is_valid(schema_editor, self.index.name)
+        if valid:
+            return
+        if valid is False:
+            schema_editor.remove_index(model, self.index, concurrently=True)
+        schema_editor.add_index(model, self.index, concurrently=True)
+
+    def database_backwards(self, app_label, schema_editor, from_state, to_state):
+        if not is_postgresql(schema_editor):
+            return super().database_backwards(app_label, schema_editor, from_state, to_state)
+        ensure_not_in_transaction(schema_editor, self)
+        model = from_state.apps.get_model(app_label, self.model_name)
+        if self.allow_migrate_model(schema_editor.connection.alias, model):
+            schema_editor.remove_index(model, self.index, concurrently=True)
+
+
+class RemoveIndexConcurrently(RemoveIndex):
+    """Drop an index with DROP INDEX CONCURRENTLY IF EXISTS."""
+
+    atomic = False
+
+    def describe(self):
+        return f"Concurrently remove index {self.name} from {self.model_name}"
+
+    def database_forwards(self, app_label, schema_editor, from_state, to_state):
+        if not is_postgresql(schema_editor):
+            return super().database_forwards(app_label, schema_editor, from_state, to_state)
+        ensure_not_in_transaction(schema_editor, self)
+        model = from_state.apps.get_model(app_label, self.model_name)
+        if self.allow_migrate_model(schema_editor.connection.alias, model):
+            index = from_state.models[app_label, self.model_name_lower].get_index_by_name(self.name)
+            schema_editor.remove_index(model, index, concurrently=True)
+
+    def database_backwards(self, app_label, schema_editor, from_state, to_state):
+        if not is_postgresql(schema_editor):
+            return super().database_backwards(app_label, schema_editor, from_state, to_state)
+        ensure_not_in_transaction(schema_editor, self)
+        model = to_state.apps.get_model(app_label, self.model_name)
+        if self.allow_migrate_model(schema_editor.connection.alias, model):
+            index = to_state.models[app_label, self.model_name_lower].get_index_by_name(self.name)
+            schema_editor.add_index(model, index, concurrently=True)
+
+
+class AddConstraintNotValid(AddConstraint):
+    """
+    Add a CheckConstraint as NOT VALID: enforced for new and updated rows only.
+
+    Adding it takes a brief lock without scanning the table; follow it with
+    ``ValidateConstraint`` to check the existing rows.
+    """
+
+    def __init__(self, model_name, constraint):
+        if not isinstance(constraint, CheckConstraint):
+            raise ValueError("AddConstraintNotValid only supports CheckConstraint.")
+        super().__init__(model_name, constraint)
+
+    def describe(self):
+        return f"Create constraint {self.constraint.name} on {self.model_name} (NOT VALID)"
+
+    def database_forwards(self, app_label, schema_editor, from_state, to_state):
+        if not is_postgresql(schema_editor):
+            return super().database_forwards(app_label, schema_editor, from_state, to_state)
+        model = to_state.apps.get_model(app_label, self.model_name)
+        if self.allow_migrate_model(schema_editor.connection.alias, model):
+            schema_editor.execute(f"{self.constraint.create_sql(model, schema_editor)} NOT VALID")
+
+
+class ValidateConstraint(Operation):
+    """
+    Check existing rows against a NOT VALID constraint.
+
+    Runs under a SHARE UPDATE EXCLUSIVE lock, so reads and writes continue.
+    A no-op outside PostgreSQL, where constraints are always validated.
+    """
+
+    reduces_to_sql = True
+    reversible = True
+
+    def __init__(self, model_name, name):
+        self.model_name = model_name
+        self.name = name
+
+    def deconstruct(self):
+        return self.__class__.__name__, [], {'model_name': self.model_name, 'name': self.name}
+
+    def state_forwards(self, app_label, state):
+        pass
+
+    def database_forwards(self, app_label, schema_editor, from_state, to_state):
+        if not is_postgresql(schema_editor):
+            return
+        model = to_state.apps.get_model(app_label, self.model_name)
+        if self.allow_migrate_model(schema_editor.connection.alias, model):
+            quote = schema_editor.quote_name
+            schema_editor.execute(
+                f"ALTER TABLE {quote(model._meta.db_table)} VALIDATE CONSTRAINT {quote(self.name)}"
+            )
+
+    def database_backwards(self, app_label, schema_editor, from_state, to_state):
+        pass
+
+    def describe(self):
+        return f"Validate constraint {self.name} on {self.model_name}"
+
+    @property
+    def migration_name_fragment(self):
+        return f"validate_{self.model_name.lower()}_{self.name.lower()}"
+
+
+class BatchedBackfill(Operation):
+    """
+    Set ``field_name`` to ``value`` where it is NULL, ``batch_size`` rows per transaction.
+
+    ``value`` is a literal or an expression such as ``F('first_name')``. Rows
+    are walked in primary key order, so each batch is a short, indexed UPDATE
+    and the row locks are released between batches. Reversing is a no-op.
+    """
+
+    reduces_to_sql = False
+    reversible = True
+    atomic = False
+
+    def __init__(self, model_name, field_name, value, batch_size=1000, pause=0.0):
+        self.model_name = model_name
+        self.field_name = field_name
+        self.value = value
+        self.batch_size = batch_size
+        self.pause = pause
+
+    def deconstruct(self):
+        kwargs = {'model_name': self.model_name, 'field_name': self.field_name, 'value': self.value}
+        if self.batch_size != 1000:
+            kwargs['batch_size'] = self.batch_size
+        if self.pause:
+            kwargs['pause'] = self.pause
+        return self.__class__.__name__, [], kwargs
+
+    def state_forwards(self, app_label, state):
+        pass
+
+    def database_forwards(self, app_label, schema_editor, from_state, to_state):
+        if is_postgresql(schema_editor):
+            ensure_not_in_transaction(schema_editor, self)
+        alias = schema_editor.connection.alias
+        model = to_state.apps.get_model(app_label, self.model_name)
+        if not self.allow_migrate_model(alias, model):
+            return
+        rows = model._base_manager.using(alias).filter(**{f'{self.field_name}__isnull': True}).order_by('pk')
+        last_pk = None
+        while True:
+            batch = rows if last_pk is None else rows.filter(pk__gt=last_pk)
+            with transaction.atomic(using=alias):
+                pks = list(batch.values_list('pk', flat=True)[:self.batch_size])
+                if not pks:
+                    return
+                model._base_manager.using(alias).filter(pk__in=pks).update(**{self.field_name: self.value})
+            last_pk = pks[-1]
+            if self.pause:
+                time.sleep(self.pause)
+
+    def database_backwards(self, app_label, schema_editor, from_state, to_state):
+        pass
+
+    def describe(self):
+        return f"Backfill {self.model_name}.{self.field_name} in batches of {self.batch_size}"
+
+    @property
+    def migration_name_fragment(self):
+        return f"backfill_{self.model_name.lower()}_{self.field_name.lower()}"
@@ -0,0 +1,151 @@
+"""
+On-demand sampling profiles of single production requests, for staff.
+
+A request carrying a profiling token, in the ``X-Profile`` header or the
+``_profile`` query parameter, runs with a sampler thread beside it. Every
+``INTERVAL`` seconds the sampler records the request thread's stack. Staff get
+tokens from the admin's "Request profiles" page; a token names its user, who
+must still be active staff, and expires after ``PROFILE_TOKEN_MAX_AGE``.
+The stacks are written to ``PROFILE_DIR`` in the collapsed format
+(``module:function;module:function count`` per line) that speedscope and
+flamegraph.pl open directly, and listed as ``RequestProfile`` rows. The
+oldest are deleted once the files exceed ``PROFILE_MAX_BYTES``.
+
+Requests without a token only pay ``ProfilerMiddleware``'s check of one
+header and the raw query string. Python switches threads every 5 ms by
+default, so CPU-bound stretches are sampled about that often, while waits
+on the database or network are sampled every ``INTERVAL``.
+"""
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from pathlib import Path
+
+from django.conf import settings
+from django.core import signing
+from django.utils import timezone
+from django.utils.text import slugify
+
+TOKEN_SALT = 'core.profiling'
+QUERY_PARAMETER = '_profile'
+INTERVAL = 0.001
+
+
+class StackSampler(threading.Thread):
+    """Counts the collapsed stacks of one thread until stopped."""
+
+    def __init__(self, thread_id, interval=INTERVAL):
+        super().__init__(name='profiler', daemon=True)
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self.finished = threading.Event()
+
+    def run(self):
+        while not self.finished.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            names = []
+            while frame is not None:
+                names.append(f"{frame.f_globals.get('__name__', '?')}:{frame.f_code.co_qualname}")
+                frame = frame.f_back
+            if names:
+                self.stacks[';'.join(reversed(names))] += 1
+
+    def stop(self):
+        self.finished.set()
+        self.join()
+        return self.stacks
+
+
+def make_token(user):
+    return signing.dumps(user.pk, salt=TOKEN_SALT, compress=True)
+
+
+def get_token(request):
+    """Return the profiling token of ``request``, or None; cheap enough for every request."""
+    token = request.META.get('HTTP_X_PROFILE')
+    if token is None and f'{QUERY_PARAMETER}=' in request.META.get('QUERY_STRING', ''):
+        token = request.GET.get(QUERY_PARAMETER)
+    return token
+
+
+def token_user_id(token):
+    """Return the id of the active staff user ``token`` was issued to, or None."""
+    from django.contrib.auth import get_user_model
+
+    try:
+        user_id = signing.loads(token, salt=TOKEN_SALT, max_age=settings.PROFILE_TOKEN_MAX_AGE)
+    except signing.BadSignature:
+        return None
+    if not get_user_model().objects.filter(pk=user_id, is_staff=True, is_active=True).exists():
+        return None
+    return user_id
+
+
+def collapse(stacks):
+    return ''.join(f'{stack} {count}\n' for stack, count in stacks.most_common())
+
+
+def save_profile(request, response, stacks, duration, user_id):
+    """Write the stacks to PROFILE_DIR, record a RequestProfile and enforce PROFILE_MAX_BYTES."""
+    from .models import RequestProfile
+
+    match = getattr(request, 'resolver_match', None)
+    view = match.view_name if match else ''
+    created = timezone.now()
+    directory = Path(settings.PROFILE_DIR)
+    directory.mkdir(parents=True, exist_ok=True)
+    name = f"{created:%Y%m%d-%H%M%S-%f}-{request.method.lower()}-{slugify(view or 'unresolved')}.txt"
+    query = request.GET.copy()
+    query.pop(QUERY_PARAMETER, None)  # keep tokens out of the admin
+    full_path = f'{request.path}?{query.urlencode()}' if query else request.path
+    content = collapse(stacks).encode()
+    (directory / name).write_bytes(content)
+    profile = RequestProfile.objects.create(
+        created=created, method=request.method, path=full_path[:500], view=view,
+        status=response.status_code, duration=duration, samples=sum(stacks.values()), user_id=user_id,
+        file=name, size=len(content),
+    )
+    prune()
+    return profile
+
+
+def prune(max_bytes=None):
+    """Delete the oldest profiles beyond ``PROFILE_MAX_BYTES`` of files; return how many."""
+    from .models import RequestProfile
+
+    max_bytes = settings.PROFILE_MAX_BYTES if max_bytes is None else max_bytes
+    kept = 0
+    expired = []
+    for pk, size in RequestProfile.objects.order_by('-created').values_list('pk', 'size'):
+        kept += size
+        if kept > max_bytes:
+            expired.append(pk)
+    if expired:
+        # post_delete (core.signals) removes the files
+        RequestProfile.objects.filter(pk__in=expired).delete()
+    return len(expired)
+
+
+def delete_file(name):
+    try:
+        os.remove(Path(settings.PROFILE_DIR) / name)
+    except FileNotFoundError:
+        pass
+
+
+def profile_request(get_response, request, user_id):
+    sampler = StackSampler(threading.get_ident())
+    # Rendered in full before the response leaves (see core.streaming), so the profile covers the body
+    request.profiling = True
+    started = time.perf_counter()
+    sampler.start()
+    try:
+        response = get_response(request)
+    finally:
+        stacks = sampler.stop()
+    profile = save_profile(request, response, stacks, time.perf_counter() - started, user_id)
+    response['X-Profile-Id'] = str(profile.pk)
+    return response
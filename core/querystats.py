@@ -0,0 +1,204 @@
+"""
+Production slow-query sampler.
+
+``QueryStatsMiddleware`` installs a ``connection.execute_wrapper`` around each
+request. Every query is reduced to a fingerprint (literals, placeholders and
+savepoint names replaced, value lists collapsed) and counted in a bounded
+per-process table of calls, total and max time. Queries slower than
+``QUERYSTATS_SLOW_MS`` are sampled at most once per fingerprint every
+``QUERYSTATS_SAMPLE_SECONDS``, and their EXPLAIN plans are captured on a
+background thread with its own connection, off the request path. The same
+thread adds the per-process counters to ``QueryFingerprint`` rows every
+``QUERYSTATS_FLUSH_SECONDS`` so ``manage.py querystats`` and the admin see
+every worker.
+"""
+import hashlib
+import logging
+import re
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+
+from django.conf import settings
+from django.db import DatabaseError, IntegrityError, connections, transaction
+from django.db.models import F, Value
+from django.db.models.functions import Greatest
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+NORMALISE = [
+    (re.compile(r'((?:RELEASE |ROLLBACK TO )?SAVEPOINT) "[^"]*"', re.IGNORECASE), r'\1 ?'),
+    (re.compile(r"'(?:[^']|'')*'"), '?'),
+    (re.compile(r'%s|\b\d+(?:\.\d+)?\b'), '?'),
+    (re.compile(r'\(\s*\?(?:\s*,\s*\?)*\s*\)'), '(...)'),
+    (re.compile(r'\(\.\.\.\)(?:\s*,\s*\(\.\.\.\))+'), '(...)'),
+    (re.compile(r'\s+'), ' '),
+]
+
+_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='querystats')
+
+
+@lru_cache(maxsize=2048)
+def fingerprint(sql):
+    """Return ``(digest, normalised SQL)`` for a statement."""
+    normalised = sql
+    for pattern, replacement in NORMALISE:
+        normalised = pattern.sub(replacement, normalised)
+    normalised = normalised.strip()
+    return hashlib.sha1(normalised.encode()).hexdigest()[:16], normalised
+
+
+class QueryStats:
+    """
+    Per-process ``digest -> [sql, calls, total, max]`` table holding at most ``max_size`` entries.
+
+    When full, the least recently seen fingerprint (and its unflushed counts)
+    is dropped.
+    """
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.entries = OrderedDict()
+        self.sampled = {}
+        self.lock = threading.Lock()
+        self.flushed_at = time.monotonic()
+
+    def record(self, digest, sql, duration):
+        with self.lock:
+            entry = self.entries.get(digest)
+            if entry is None:
+                if len(self.entries) >= self.max_size:
+                    self.entries.popitem(last=False)
+                entry = self.entries[digest] = [sql, 0, 0.0, 0.0]
+            else:
+                self.entries.move_to_end(digest)
+            entry[1] += 1
+            entry[2] += duration
+            entry[3] = max(entry[3], duration)
+
+    def should_sample(self, digest, now, interval):
+        """Return True at most once per ``interval`` seconds for each fingerprint."""
+        with self.lock:
+            if now - self.sampled.get(digest, float('-inf')) < interval:
+                return False
+            if len(self.sampled) >= self.max_size:
+                self.sampled.clear()
+            self.sampled[digest] = now
+            return True
+
+    def should_flush(self, now, interval):
+        with self.lock:
+            if now - self.flushed_at < interval:
+                return False
+            self.flushed_at = now
+            return True
+
+    def drain(self):
+        """Return the collected entries and start a new period."""
+        with self.lock:
+            entries, self.entries = self.entries, OrderedDict()
+        return entries
+
+
+_stats = None
+
+
+def get_stats():
+    global _stats
+    if _stats is None:
+        _stats = QueryStats(settings.QUERYSTATS_MAX_FINGERPRINTS)
+    return _stats
+
+
+def submit(func, *args):
+    """Run ``func`` on the background thread, logging (never raising) its errors."""
+    def run():
+        try:
+            func(*args)
+        except Exception:
+            logger.exception("Query stats task %s failed", func.__name__)
+        finally:
+            connections['default'].close_if_unusable_or_obsolete()
+
+    _executor.submit(run)
+
+
+class QueryRecorder:
+    """``connection.execute_wrapper`` that feeds every query of one request into the stats."""
+
+    def __init__(self, request):
+        self.request = request
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            record(sql, params, many, time.perf_counter() - started, self.request)
+
+
+def record(sql, params, many, duration, request=None):
+    stats = get_stats()
+    digest, normalised = fingerprint(sql)
+    stats.record(digest, normalised, duration)
+    now = time.monotonic()
+    if (
+        duration * 1000 >= settings.QUERYSTATS_SLOW_MS
+        and not many
+        and stats.should_sample(digest, now, settings.QUERYSTATS_SAMPLE_SECONDS)
+    ):
+        match = getattr(request, 'resolver_match', None)
+        submit(capture, digest, sql, params, duration, match.view_name if match else '')
+    if stats.should_flush(now, settings.QUERYSTATS_FLUSH_SECONDS):
+        submit(flush, stats.drain())
+
+
+def explain(sql, params):
+    """Return the plan of a SELECT (never executed: Postgres runs EXPLAIN without ANALYZE)."""
+    if not sql.lstrip()[:6].upper() == 'SELECT':
+        return ''
+    connection = connections['default']
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute(f'{connection.ops.explain_query_prefix()} {sql}', params)
+            return '\n'.join(' '.join(str(column) for column in row) for row in cursor.fetchall())
+    except DatabaseError as error:
+        return f'EXPLAIN failed: {error}'
+
+
+def capture(digest, sql, params, duration, view):
+    """Store a slow query sample with its plan and prune samples beyond ``QUERYSTATS_MAX_SAMPLES``."""
+    from .models import SlowQuery
+
+    SlowQuery.objects.create(
+        fingerprint=digest, sql=sql, duration=duration, view=view[:200], plan=explain(sql, params),
+    )
+    stale = SlowQuery.objects.order_by('-created').values_list('pk', flat=True)[settings.QUERYSTATS_MAX_SAMPLES:]
+    SlowQuery.objects.filter(pk__in=list(stale)).delete()
+
+
+def flush(entries):
+    """Add drained per-process counters to the shared ``QueryFingerprint`` rows."""
+    from .models import QueryFingerprint
+
+    now = timezone.now()
+    with transaction.atomic():
+        for digest, (sql, calls, total, longest) in entries.items():
+            updates = dict(
+                calls=F('calls') + calls,
+                total_time=F('total_time') + total,
+                max_time=Greatest('max_time', Value(longest)),
+                last_seen=now,
+            )
+            if QueryFingerprint.objects.filter(pk=digest).update(**updates):
+                continue
+            try:
+                with transaction.atomic():
+                    QueryFingerprint.objects.create(
+                        fingerprint=digest, sql=sql, calls=calls, total_time=total, max_time=longest, last_seen=now,
+                    )
+            except IntegrityError:  # another worker created it first
+                QueryFingerprint.objects.filter(pk=digest).update(**updates)
@@ -0,0 +1,177 @@
+"""
+Rate limiting shared by every gunicorn worker.
+
+Counters live in the cache configured by ``RATELIMIT_CACHE_ALIAS``. Point
+``CACHE_URL`` at Redis or Memcached in production so that all workers (and
+allauth's own rate limits) see the same counters. Rates use allauth's
+``"<amount>/<period>/<per>"`` notation, e.g. ``"10/m/ip"`` or ``"5/h/user"``.
+"""
+import hashlib
+import ipaddress
+import logging
+import math
+import time
+from dataclasses import dataclass
+
+from django.conf import settings
+from django.core.cache import caches
+
+logger = logging.getLogger(__name__)
+
+PERIODS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+KEY_SOURCES = ('ip', 'user', 'route')
+
+# The token bucket keeps (tokens, timestamp) in one cache entry, so updates
+# are serialised with a short-lived lock taken through the atomic cache.add().
+LOCK_TIMEOUT = 1
+LOCK_ATTEMPTS = 5
+LOCK_BACKOFF = 0.002
+
+
+@dataclass(frozen=True)
+class Rate:
+    amount: int
+    period: int
+    per: str
+
+
+@dataclass(frozen=True)
+class Decision:
+    allowed: bool
+    retry_after: int = 0
+
+
+def parse_rate(rate):
+    """Parse a single ``"<amount>/<period>/<per>"`` string into a Rate."""
+    parts = rate.strip().split('/')
+    if len(parts) == 2:
+        parts.append('ip')
+    if len(parts) != 3:
+        raise ValueError(f"Invalid rate: {rate!r}")
+    amount, period, per = parts
+    unit = period[-1:]
+    if unit not in PERIODS:
+        raise ValueError(f"Invalid rate period: {rate!r}")
+    if per not in KEY_SOURCES:
+        raise ValueError(f"Invalid rate key: {rate!r}")
+    multiplier = int(period[:-1]) if period[:-1] else 1
+    return Rate(int(amount), multiplier * PERIODS[unit], per)
+
+
+def parse_rates(rates):
+    """Parse a comma-separated list of rates."""
+    return [parse_rate(rate) for rate in rates.split(',') if rate.strip()]
+
+
+def get_client_ip(request):
+    """
+    Return the client IP, preferring the header set by nginx.
+
+    Only ``ALLAUTH_TRUSTED_CLIENT_IP_HEADER`` is honoured; X-Forwarded-For is
+    client controlled and ignored.
+    """
+    header = getattr(settings, 'ALLAUTH_TRUSTED_CLIENT_IP_HEADER', None)
+    value = ''
+    if header:
+        value = request.META.get('HTTP_' + header.upper().replace('-', '_'), '')
+    value = value.split(',')[0].strip() or request.META.get('REMOTE_ADDR', '')
+    try:
+        return str(ipaddress.ip_address(value))
+    except ValueError:
+        return 'unknown'
+
+
+def get_identity(request, per):
+    """
+    Return the identity a rate is counted against.
+
+    Limits are checked before SessionMiddleware runs, so ``user`` is keyed by
+    a hash of the session cookie rather than a database lookup. Requests
+    without a session cookie fall back to the client IP.
+    """
+    if per == 'route':
+        return 'all'
+    if per == 'user':
+        session_key = request.COOKIES.get(settings.SESSION_COOKIE_NAME)
+        if session_key:
+            return 's-' + hashlib.sha256(session_key.encode()).hexdigest()[:32]
+    return get_client_ip(request)
+
+
+def sliding_window(cache, key, rate, now=None):
+    """
+    Sliding-window counter built from two fixed windows.
+
+    The previous window's count is weighted by how much of it still overlaps
+    the sliding window. Only atomic add()/incr() calls touch the cache.
+    """
+    now = time.time() if now is None else now
+    window = int(now // rate.period)
+    elapsed = now - window * rate.period
+    current_key = f'{key}:{window}'
+    previous = cache.get(f'{key}:{window - 1}', 0)
+    if not cache.add(current_key, 1, rate.period * 2):
+        try:
+            current = cache.incr(current_key)
+        except ValueError:
+            # The entry expired between add() and incr().
+            cache.add(current_key, 1, rate.period * 2)
+            current = 1
+    else:
+        current = 1
+    weighted = previous * (rate.period - elapsed) / rate.period + current
+    if weighted <= rate.amount:
+        return Decision(True)
+    return Decision(False, max(1, math.ceil(rate.period - elapsed)))
+
+
+def token_bucket(cache, key, rate, now=None):
+    """
+    Token bucket holding ``rate.amount`` tokens, refilled evenly over the period.
+
+    Fails open when the bucket lock cannot be taken, so a stalled cache never
+    takes the site down with it.
+    """
+    lock_key = f'{key}:lock'
+    for _ in range(LOCK_ATTEMPTS):
+        if cache.add(lock_key, 1, LOCK_TIMEOUT):
+            break
+        time.sleep(LOCK_BACKOFF)
+    else:
+        logger.warning("Rate limit lock contention on %s, allowing request", key)
+        return Decision(True)
+    try:
+        now = time.time() if now is None else now
+        refill = rate.amount / rate.period
+        tokens, updated = cache.get(key, (float(rate.amount), now))
+        tokens = min(float(rate.amount), tokens + (now - updated) * refill)
+        if tokens < 1:
+            cache.set(key, (tokens, now), rate.period)
+            return Decision(False, max(1, math.ceil((1 - tokens) / refill)))
+        cache.set(key, (tokens - 1, now), rate.period)
+        return Decision(True)
+    finally:
+        cache.delete(lock_key)
+
+
+ALGORITHMS = {
+    'sliding_window': sliding_window,
+    'token_bucket': token_bucket,
+}
+
+
+def check(request, route, rates, algorithm=None):
+    """
+    Consume one hit from every rate configured for ``route``.
+
+    Returns the first Decision that rejects the request, or an allowing one.
+    """
+    cache = caches[settings.RATELIMIT_CACHE_ALIAS]
+    consume = ALGORITHMS[algorithm or settings.RATELIMIT_ALGORITHM]
+    for rate in rates:
+        identity = get_identity(request, rate.per)
+        key = f'rl:{route}:{request.method}:{rate.amount}/{rate.period}:{rate.per}:{identity}'
+        decision = consume(cache, key, rate)
+        if not decision.allowed:
+            return decision
+    return Decision(True)
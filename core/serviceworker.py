@@ -0,0 +1,93 @@
+"""
+Service worker (``/sw.js``) that caches the app shell for repeat visits.
+
+The script is rendered from ``core/service_worker.js``. It is served from the
+site root rather than ``STATIC_URL``, so its scope covers every page. It uses
+three caches:
+
+* The hashed files in the static manifest that match ``SERVICE_WORKER_PRECACHE``
+  are precached on install and then served cache-first; their names change
+  with their content.
+* Assets from ``SERVICE_WORKER_CDN_ORIGINS`` (Bootstrap, Unpoly, icons; all
+  versioned URLs) are cached on first use and then served cache-first.
+* Pages are stale-while-revalidate. This covers full navigations, and Unpoly
+  requests keyed by their target. The worker only stores responses carrying
+  ``X-Service-Worker-Cache: public``. ``ServiceWorkerMiddleware`` adds that
+  header only to ``public_page`` views answered to an anonymous visitor,
+  when no cookie is set and no CSRF token is used. Any other response for a
+  cached URL removes it from the cache. Every same-origin POST (sign-in,
+  sign-out, any form) and every navigation under the allauth URLs clears
+  the page cache.
+
+The cache names include a version derived from the manifest hash and the
+templates (``core.conditional.template_version``), so each deploy installs
+a new worker that drops the old caches. With ``SERVICE_WORKER_ENABLED`` off,
+``/sw.js`` becomes a worker that deletes its caches and unregisters itself.
+"""
+import hashlib
+import json
+from fnmatch import fnmatch
+from functools import cache, wraps
+
+from django.conf import settings
+from django.contrib.staticfiles.storage import staticfiles_storage
+from django.template.loader import render_to_string
+from django.urls import reverse
+
+from .conditional import template_version
+
+CACHE_HEADER = 'X-Service-Worker-Cache'
+
+
+def precache_urls(storage=staticfiles_storage, patterns=None):
+    """Return the URLs of the hashed static files to precache and the manifest's hash."""
+    patterns = settings.SERVICE_WORKER_PRECACHE if patterns is None else patterns
+    # Unhashed files (no manifest, e.g. in development) would go stale in the cache, so none are precached
+    hashed_files = getattr(storage, 'hashed_files', None) or {}
+    urls = [
+        storage.url(name) for name in sorted(hashed_files)
+        if any(fnmatch(name, pattern) for pattern in patterns)
+    ]
+    return urls, getattr(storage, 'manifest_hash', '')
+
+
+@cache
+def render_script():
+    """Render ``/sw.js`` once per process; the manifest only changes with a deploy, which restarts the workers."""
+    if not settings.SERVICE_WORKER_ENABLED:
+        return render_to_string('core/service_worker.js', {'enabled': False})
+    urls, manifest_hash = precache_urls()
+    version = hashlib.sha1(f'{manifest_hash}:{template_version()}:{urls}'.encode()).hexdigest()[:12]
+    login_url = reverse('account_login')
+    return render_to_string('core/service_worker.js', {
+        'enabled': True,
+        'version': version,
+        'precache': json.dumps(urls),
+        'cdn_origins': json.dumps(settings.SERVICE_WORKER_CDN_ORIGINS),
+        'cache_header': CACHE_HEADER,
+        # allauth's URL prefix (e.g. /accounts/): pages there sign users in and out
+        'accounts_url': '/' + login_url.strip('/').split('/')[0] + '/',
+    })
+
+
+def public_page(view_func):
+    """Let the service worker cache this view's responses to anonymous visitors (see ServiceWorkerMiddleware)."""
+    @wraps(view_func)
+    def wrapper(request, *args, **kwargs):
+        request.service_worker_cacheable = True
+        return view_func(request, *args, **kwargs)
+
+    return wrapper
+
+
+def is_shareable(request, response):
+    """Whether a response is the same for every anonymous visitor and may be cached by the service worker."""
+    return (
+        request.method == 'GET'
+        and response.status_code == 200
+        and not response.cookies
+        and 'private' not in response.get('Cache-Control', '')
+        # The page used the CSRF token, e.g. in a form
+        and 'CSRF_COOKIE_NEEDS_UPDATE' not in request.META
+        and not request.user.is_authenticated
+    )
@@ -0,0 +1,62 @@
+"""
+Session engine storing sessions in ``core.models.Session``.
+
+Enable with ``SESSION_ENGINE = 'core.sessions'``. Expired rows are removed by
+``manage.py reap_sessions`` in small batches instead of the single large
+DELETE issued by Django's ``clearsessions``.
+"""
+import time
+
+from django.contrib.auth import SESSION_KEY
+from django.contrib.sessions.backends.db import SessionStore as DBStore
+from django.utils import timezone
+
+DEFAULT_BATCH_SIZE = 1000
+
+
+def delete_expired_batches(batch_size=DEFAULT_BATCH_SIZE):
+    """
+    Delete expired sessions ``batch_size`` rows at a time.
+
+    Yields ``(rows_deleted, seconds)`` after each batch so callers can report
+    progress or stop when their time budget runs out. Each batch is a short
+    primary-key DELETE, so locks are held only briefly.
+    """
+    from .models import Session
+
+    cutoff = timezone.now()
+    while True:
+        started = time.monotonic()
+        keys = list(
+            Session.objects.filter(expire_date__lt=cutoff)
+            .values_list('session_key', flat=True)[:batch_size]
+        )
+        if not keys:
+            return
+        deleted, _ = Session.objects.filter(session_key__in=keys).delete()
+        yield deleted, time.monotonic() - started
+
+
+class SessionStore(DBStore):
+
+    @classmethod
+    def get_model_class(cls):
+        from .models import Session
+        return Session
+
+    def create_model_instance(self, data):
+        obj = super().create_model_instance(data)
+        user_id = data.get(SESSION_KEY)
+        obj.user_id = int(user_id) if user_id is not None else None
+        return obj
+
+    async def acreate_model_instance(self, data):
+        obj = await super().acreate_model_instance(data)
+        user_id = data.get(SESSION_KEY)
+        obj.user_id = int(user_id) if user_id is not None else None
+        return obj
+
+    @classmethod
+    def clear_expired(cls):
+        for _ in delete_expired_batches():
+            pass
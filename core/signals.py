@@ -0,0 +1,20 @@
+from django.contrib.sites.models import Site
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .models import RequestProfile
+from .profiling import delete_file
+from .sites import invalidate
+
+
+@receiver(post_save, sender=Site)
+@receiver(post_delete, sender=Site)
+def invalidate_sites(sender, instance, **kwargs):
+    """Drop every worker's cached Sites after a Site changes"""
+    invalidate()
+
+
+@receiver(post_delete, sender=RequestProfile)
+def delete_profile_file(sender, instance, **kwargs):
+    """Remove a deleted profile's stacks from PROFILE_DIR"""
+    delete_file(instance.file)
@@ -0,0 +1,127 @@
+"""
+Per-request Site resolution from the Host header.
+
+``get_site()`` stores the Site for each host in Django's process-level
+``SITE_CACHE``, under the same key ``get_current_site(request)`` uses, so
+allauth and the admin answer from memory too. Hosts without a Site row fall
+back to ``DEFAULT_SITE_ID`` (leave ``SITE_ID`` unset, or every request is
+pinned to that one site).
+
+Django clears ``SITE_CACHE`` only in the process that saved a Site. A version
+number in the shared cache carries the invalidation to the other workers,
+which check it at most every ``SITE_CACHE_CHECK_INTERVAL`` seconds.
+"""
+import time
+
+from django.conf import settings
+from django.contrib.sites.models import SITE_CACHE, Site
+from django.core.cache import caches
+from django.db import transaction
+from django.db.models import Q
+from django.http.request import split_domain_port
+
+VERSION_KEY = 'sites:version'
+
+_seen_version = None
+_checked_at = float('-inf')
+
+
+def get_cache():
+    return caches[settings.SITE_CACHE_ALIAS]
+
+
+def bump_version():
+    cache = get_cache()
+    cache.add(VERSION_KEY, 0, None)
+    try:
+        cache.incr(VERSION_KEY)
+    except ValueError:
+        # Evicted between add() and incr(); any change to the value invalidates
+        cache.set(VERSION_KEY, 1, None)
+
+
+def invalidate():
+    """Drop cached Sites in this process now and in the other workers on their next check."""
+    SITE_CACHE.clear()
+    bump_version()
+    # Bump again after commit, so entries cached from the old rows in the meantime are dropped too
+    transaction.on_commit(bump_version)
+
+
+def check_version():
+    """Clear ``SITE_CACHE`` if another process changed a Site since the last check."""
+    global _seen_version, _checked_at
+    now = time.monotonic()
+    if now - _checked_at < settings.SITE_CACHE_CHECK_INTERVAL:
+        return
+    _checked_at = now
+    version = get_cache().get(VERSION_KEY, 0)
+    if version != _seen_version:
+        SITE_CACHE.clear()
+        _seen_version = version
+
+
+def lookup(host):
+    """Return the Site for ``host`` (with or without its port), else the default Site."""
+    domain, _ = split_domain_port(host)
+    matches = Site.objects.filter(Q(domain__iexact=host) | Q(domain__iexact=domain))
+    sites = {site.domain.lower(): site for site in matches}
+    site = sites.get(host.lower()) or sites.get(domain)
+    if site is None:
+        site = Site.objects.get(pk=settings.DEFAULT_SITE_ID)
+    return site
+
+
+def get_site(request=None):
+    """Return the Site for ``request``'s host, or the default Site without a request."""
+    check_version()
+    key = request.get_host() if request is not None else settings.DEFAULT_SITE_ID
+    try:
+        return SITE_CACHE[key]
+    except KeyError:
+        pass
+    site = lookup(key) if request is not None else Site.objects.get(pk=key)
+    SITE_CACHE[key] = site
+    return site
+
+
+@transaction.atomic
+def sync_sites(entries, prune=False):
+    """
+    Create or update Sites from ``entries`` (dicts with ``domain``, ``name`` and optional ``id``).
+
+    Entries with an ``id`` update that existing Site (so a domain can be
+    renamed), the rest are matched by domain or created. With ``prune``, Sites
+    not listed are deleted, except the default one. Returns
+    ``(created, updated, deleted)`` counts.
+    """
+    existing = list(Site.objects.select_for_update())
+    by_id = {site.pk: site for site in existing}
+    by_domain = {site.domain.lower(): site for site in existing}
+    to_create, to_update, kept = [], [], set()
+    for entry in entries:
+        domain, name = entry['domain'].strip(), entry['name'].strip()
+        if 'id' in entry:
+            if entry['id'] not in by_id:
+                raise ValueError(f"Unknown site id {entry['id']} for {domain}")
+            site = by_id[entry['id']]
+        else:
+            site = by_domain.get(domain.lower())
+        if site is None:
+            to_create.append(Site(domain=domain, name=name))
+            continue
+        kept.add(site.pk)
+        if (site.domain, site.name) != (domain, name):
+            site.domain, site.name = domain, name
+            to_update.append(site)
+    # Updates go first, so a new site can take a domain an existing one was renamed away from
+    Site.objects.bulk_update(to_update, ['domain', 'name'])
+    created = Site.objects.bulk_create(to_create)
+    deleted = 0
+    if prune:
+        kept.update([settings.DEFAULT_SITE_ID, *(site.pk for site in created)])
+        _, counts = Site.objects.exclude(pk__in=kept).delete()
+        deleted = counts.get('sites.Site', 0)
+    # bulk_create()/bulk_update() send no signals
+    invalidate()
+    return len(to_create), len(to_update), deleted
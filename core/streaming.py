@@ -0,0 +1,110 @@
+"""
+Early flush: send the ``<head>`` of base.html before the rest of the page is rendered.
+
+A TemplateResponse is only sent once its whole template has rendered, so the
+browser learns about the stylesheets and scripts after every lazy queryset in
+the page has run. ``early_flush`` streams the page in two chunks instead: the
+head with its asset tags (rendered with ``early_flush_head``), then the title
+and body (``early_flush_body``). The browser downloads the assets while the
+body renders.
+
+The view itself still runs first, so redirects, error statuses, 304s and
+Unpoly fragment responses are returned as usual and never streamed. Flash
+messages and the CSRF token are read before streaming starts, since
+MessageMiddleware and CsrfViewMiddleware finish before the body renders. An
+exception in the body can no longer change the status; it aborts the
+connection, so no cache keeps a half page.
+
+The body also renders after the middleware has returned, outside the
+``connection.execute_wrapper`` blocks of MetricsMiddleware and
+QueryStatsMiddleware. They install their wrappers with ``execute_wrapper()``
+below, which records them on the request so the body's lazy queries run
+through them too. MetricsMiddleware records streamed pages once the body has
+rendered, so their duration covers the whole page rather than the time to
+the head, and includes handing the head to the server.
+"""
+from contextlib import ExitStack, contextmanager
+from functools import wraps
+
+from django.conf import settings
+from django.contrib.messages import get_messages
+from django.db import connection
+from django.http import StreamingHttpResponse
+from django.middleware.csrf import get_token
+from django.template.response import TemplateResponse
+
+
+@contextmanager
+def execute_wrapper(request, wrapper):
+    """``connection.execute_wrapper(wrapper)`` that also covers the body of an early-flushed response."""
+    request.early_flush_wrappers = [*getattr(request, 'early_flush_wrappers', []), wrapper]
+    with connection.execute_wrapper(wrapper):
+        yield
+
+
+class EarlyFlushTemplateResponse(TemplateResponse):
+    """TemplateResponse whose render() returns a two-chunk StreamingHttpResponse when it can."""
+
+    def can_stream(self):
+        names = [self.template_name] if isinstance(self.template_name, str) else self.template_name
+        return (
+            settings.EARLY_FLUSH_ENABLED
+            and self.status_code == 200
+            and not self._post_render_callbacks
+            # Partials (template#name) have no head, and Unpoly only uses a response once it is complete
+            and all(isinstance(name, str) and '#' not in name for name in names)
+            and 'X-Up-Target' not in self._request.headers
+            and not getattr(self._request, 'profiling', False)
+        )
+
+    def render(self):
+        if self._is_rendered or not self.can_stream():
+            return super().render()
+        template = self.resolve_template(self.template_name)
+        context = self.resolve_context(self.context_data) or {}
+        context['messages'] = list(get_messages(self._request))
+        get_token(self._request)
+        head = template.render({**context, 'early_flush_head': True}, self._request)
+        if '</html>' in head:
+            # The template does not extend base.html, so it rendered as a whole page
+            self.content = head
+            return self
+        response = StreamingHttpResponse(
+            self.stream_body(head, template, context), status=self.status_code, headers=self.headers,
+        )
+        response.cookies = self.cookies
+        response.early_flush = True
+        # Let nginx pass the head on without waiting for the body
+        response['X-Accel-Buffering'] = 'no'
+        return response
+
+    def stream_body(self, head, template, context):
+        yield head
+        # Rendered (not yielded) inside the wrappers, so they are not left installed while the generator waits
+        with ExitStack() as stack:
+            for wrapper in getattr(self._request, 'early_flush_wrappers', ()):
+                stack.enter_context(connection.execute_wrapper(wrapper))
+            body = template.render({**context, 'early_flush_body': True}, self._request)
+        yield body
+
+
+def early_flush(view_func):
+    """
+    Stream the view's full-page GET responses head first (see module docstring).
+
+    Put it outside ``fragments`` and inside ``conditional_page``, so partials
+    are recognised and 304s are answered before the view runs.
+    """
+    @wraps(view_func)
+    def wrapper(request, *args, **kwargs):
+        response = view_func(request, *args, **kwargs)
+        if request.method != 'GET' or type(response) is not TemplateResponse:
+            return response
+        streamed = EarlyFlushTemplateResponse(
+            request, response.template_name, response.context_data, status=response.status_code,
+            using=response.using, headers=response.headers,
+        )
+        streamed.cookies = response.cookies
+        return streamed
+
+    return wrapper
@@ -0,0 +1,179 @@
+"""
+Template rendering benchmarks for the layout, the allauth element overrides and the email templates.
+
+Each case renders one template through the context processors, as a view
+would. The context is realistic: an anonymous or signed-in user, flash
+messages, bound forms with errors, or the variables allauth passes to its
+emails. Contexts are built once, outside the timing (forms are validated
+there, so their database queries are not measured). The user and Site are
+unsaved objects, so a render that starts querying shows up as slower rather
+than failing.
+
+``measure`` reports renders per second (the best of several rounds) and the
+peak memory tracemalloc sees during one render. ``compare`` flags cases
+slower or allocating more than a baseline by more than a tolerance. See
+``manage.py bench_templates``.
+"""
+import time
+import tracemalloc
+from dataclasses import dataclass
+from datetime import datetime, timezone
+
+from allauth.account.forms import AddEmailForm, LoginForm
+from allauth.account.models import EmailAddress
+from django.contrib.auth.models import AnonymousUser
+from django.contrib.messages import constants
+from django.contrib.messages.storage.cookie import CookieStorage
+from django.contrib.sites.models import Site
+from django.template.loader import get_template
+from django.test import RequestFactory
+from django.urls import resolve
+
+from users.forms import UserProfileForm
+from users.models import CustomUser
+
+
+@dataclass
+class Case:
+    name: str
+    template: str
+    path: str = '/'
+    user: bool = False
+    messages: bool = False
+    context: callable = None
+
+
+def bench_user():
+    return CustomUser(pk=1, username='ada', email='ada@example.com', first_name='Ada', last_name='Lovelace',
+                      display_name='Ada')
+
+
+def profile_context(user, request):
+    return {'form': UserProfileForm(instance=user)}
+
+
+def profile_errors_context(user, request):
+    form = UserProfileForm({'first_name': 'A' * 200, 'email': 'not-an-email'}, instance=user)
+    form.is_valid()
+    return {'form': form}
+
+
+def email_context(user, request):
+    addresses = [
+        EmailAddress(pk=1, user=user, email='ada@example.com', primary=True, verified=True),
+        EmailAddress(pk=2, user=user, email='ada@work.example.com', primary=False, verified=False),
+    ]
+    return {
+        'emailaddresses': addresses,
+        'emailaddress_radios': [
+            {'id': f'email_radio_{n}', 'checked': address.primary, 'emailaddress': address}
+            for n, address in enumerate(addresses, 1)
+        ],
+        'form': AddEmailForm(user=user),
+        'can_add_email': True,
+    }
+
+
+def login_errors_context(user, request):
+    form = LoginForm({'login': '', 'password': ''}, request=request)
+    form.is_valid()
+    return {'form': form}
+
+
+def notification_context(user, request):
+    return {
+        'user': user, 'ip': '203.0.113.7', 'user_agent': 'Mozilla/5.0 (X11; Linux x86_64) Firefox/131.0',
+        'timestamp': datetime(2026, 10, 19, 12, 0, tzinfo=timezone.utc),
+    }
+
+
+def confirmation_context(user, request):
+    return {
+        'user': user, 'activate_url': 'https://example.com/accounts/confirm-email/MQ:1tq7Xs:abc/', 'key': 'MQ:1tq7Xs:abc',
+    }
+
+
+CASES = [
+    Case('base/anonymous', 'core/index.html'),
+    Case('base/authenticated', 'core/index.html', user=True),
+    Case('base/messages', 'core/index.html', user=True, messages=True),
+    Case('sidebar/authenticated', 'includes/sidebar.html', user=True),
+    Case('profile/form', 'users/profile.html', '/users/profile/', user=True, context=profile_context),
+    Case('profile/form-errors', 'users/profile.html', '/users/profile/', user=True, messages=True,
+         context=profile_errors_context),
+    Case('profile/partial', 'users/profile.html#delete-account', '/users/profile/', user=True),
+    Case('account/email', 'account/email.html', '/accounts/email/', user=True, context=email_context),
+    Case('account/login-errors', 'account/login.html', '/accounts/login/', context=login_errors_context),
+    Case('email/password-changed', 'account/email/password_changed_message.html', context=notification_context),
+    Case('email/confirmation', 'account/email/email_confirmation_signup_message.html', context=confirmation_context),
+]
+
+
+def build(case):
+    """Return ``(template, context, request)`` for a case."""
+    request = RequestFactory().get(case.path)
+    request.resolver_match = resolve(case.path)
+    request.site = Site(pk=1, domain='example.com', name='Example')
+    request.user = bench_user() if case.user else AnonymousUser()
+    request._messages = CookieStorage(request)
+    if case.messages:
+        request._messages.add(constants.SUCCESS, 'Your profile has been updated successfully.')
+        request._messages.add(constants.WARNING, 'Please confirm your email address.')
+        request._messages.add(constants.ERROR, 'Something went wrong.')
+    context = case.context(request.user, request) if case.context else {}
+    return get_template(case.template), context, request
+
+
+def render(template, context, request):
+    if request._messages.used:
+        # The messages context processor iterates them once per render
+        request._messages.used = False
+    return template.render(context, request)
+
+
+def measure(case, min_time=0.2, rounds=5):
+    """Return ``{'ops': renders per second, 'peak_kib': peak memory of one render, 'bytes': output size}``."""
+    template, context, request = build(case)
+    output = render(template, context, request)
+    iterations = 1
+    while True:
+        started = time.perf_counter()
+        for _ in range(iterations):
+            render(template, context, request)
+        elapsed = time.perf_counter() - started
+        if elapsed >= min_time / rounds:
+            break
+        iterations *= 2
+    best = elapsed
+    for _ in range(rounds - 1):
+        started = time.perf_counter()
+        for _ in range(iterations):
+            render(template, context, request)
+        best = min(best, time.perf_counter() - started)
+    tracing = tracemalloc.is_tracing()
+    if not tracing:
+        tracemalloc.start()
+    tracemalloc.reset_peak()
+    baseline = tracemalloc.get_traced_memory()[0]
+    render(template, context, request)
+    peak = tracemalloc.get_traced_memory()[1] - baseline
+    if not tracing:
+        tracemalloc.stop()
+    return {'ops': iterations / best, 'peak_kib': peak / 1024, 'bytes': len(output.encode())}
+
+
+def compare(results, baseline, tolerance):
+    """Return ``{case: [problems]}`` for cases slower or allocating more than ``baseline`` beyond ``tolerance``."""
+    regressions = {}
+    for name, result in results.items():
+        before = baseline.get(name)
+        if not before:
+            continue
+        problems = []
+        if result['ops'] < before['ops'] / (1 + tolerance):
+            problems.append(f"{before['ops'] / result['ops'] - 1:.0%} slower")
+        if result['peak_kib'] > before['peak_kib'] * (1 + tolerance):
+            problems.append(f"{result['peak_kib'] / before['peak_kib'] - 1:.0%} more memory")
+        if problems:
+            regressions[name] = problems
+    return regressions
@@ -1,3 +1,1190 @@
-from django.test import TestCase
+import asyncio
+import gzip
+import json
+import os
+import tempfile
+import time
+import zlib
+from datetime import timedelta
+from io import StringIO
+from unittest import mock
 
-# Create your tests here.
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser
+from django.contrib.sites.models import SITE_CACHE, Site
+from django.core import mail
+from django.core.cache import cache
+from django.core.mail import EmailMessage, get_connection
+from django.http import HttpResponse, StreamingHttpResponse
+from django.core.management import CommandError, call_command
+from django.db import connection, migrations, models
+from django.db.migrations.loader import MigrationLoader
+from django.test import RequestFactory, SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext, isolate_apps
+from django.urls import reverse
+from django.utils import timezone
+
+from core import checks as performance_checks
+from core import compression, events, health, memory, metrics, profiling, querystats, ratelimit, serviceworker, sites
+from core import templatebench
+from core import operations as online
+from core.migration_checks import check_migration
+from core.fake_mailgun import FakeMailgunServer
+from core.middleware import CompressionMiddleware
+from core.models import QueryFingerprint, RequestProfile, Session, SlowQuery
+from core.sessions import SessionStore, delete_expired_batches
+from users.models import CustomUser
+
+"""
+Static storage is overridden for the same reason as in users/tests.py: the
+Whitenoise manifest does not exist when the test suite runs.
+"""
+
+TEST_STORAGES = {
+    "default": {"BACKEND": "django.core.files.storage.FileSystemStorage"},
+    "staticfiles": {"BACKEND": "django.contrib.staticfiles.storage.StaticFilesStorage"},
+}
+
+
+def count_users(request):
+    """Context processor that runs a query on every render, including the body of an early-flushed page"""
+    return {'user_count': CustomUser.objects.count()}
+
+
+class RateParsingTests(SimpleTestCase):
+    """
+    Test suite for parsing allauth-style rate strings.
+    """
+
+    def test_parse_rate_with_key(self):
+        self.assertEqual(ratelimit.parse_rate('10/m/user'), ratelimit.Rate(10, 60, 'user'))
+
+    def test_parse_rate_defaults_to_ip(self):
+        self.assertEqual(ratelimit.parse_rate('5/2h'), ratelimit.Rate(5, 7200, 'ip'))
+
+    def test_parse_rates_list(self):
+        self.assertEqual(len(ratelimit.parse_rates('5/h/user, 30/h/ip')), 2)
+
+    def test_parse_rate_rejects_unknown_key(self):
+        with self.assertRaises(ValueError):
+            ratelimit.parse_rate('5/m/email')
+
+
+class RateLimitAlgorithmTests(SimpleTestCase):
+    """
+    Test suite for the sliding window and token bucket algorithms.
+    """
+
+    def setUp(self):
+        cache.clear()
+
+    def test_sliding_window_blocks_after_limit(self):
+        rate = ratelimit.Rate(3, 60, 'ip')
+        results = [ratelimit.sliding_window(cache, 'k', rate, now=120.0).allowed for _ in range(4)]
+        self.assertEqual(results, [True, True, True, False])
+
+    def test_sliding_window_weights_previous_window(self):
+        rate = ratelimit.Rate(2, 60, 'ip')
+        for _ in range(2):
+            ratelimit.sliding_window(cache, 'k', rate, now=110.0)
+        # Half of the previous window still overlaps, so one of its hits counts.
+        self.assertTrue(ratelimit.sliding_window(cache, 'k', rate, now=150.0).allowed)
+        self.assertFalse(ratelimit.sliding_window(cache, 'k', rate, now=150.0).allowed)
+
+    def test_token_bucket_refills_over_time(self):
+        rate = ratelimit.Rate(2, 60, 'ip')
+        self.assertTrue(ratelimit.token_bucket(cache, 'k', rate, now=0.0).allowed)
+        self.assertTrue(ratelimit.token_bucket(cache, 'k', rate, now=0.0).allowed)
+        decision = ratelimit.token_bucket(cache, 'k', rate, now=1.0)
+        self.assertFalse(decision.allowed)
+        self.assertEqual(decision.retry_after, 29)
+        self.assertTrue(ratelimit.token_bucket(cache, 'k', rate, now=31.0).allowed)
+
+
+@override_settings(STORAGES=TEST_STORAGES)
+class RateLimitMiddlewareTests(TestCase):
+    """
+    Test suite for RateLimitMiddleware rejecting requests with the 429 page.
+    """
+
+    def setUp(self):
+        cache.clear()
+
+    @override_settings(RATELIMITS={'core:home': {'GET': '2/m/ip'}})
+    def test_over_limit_renders_429(self):
+        for _ in range(2):
+            self.assertEqual(self.client.get(reverse('core:home')).status_code, 200)
+        response = self.client.get(reverse('core:home'))
+        self.assertEqual(response.status_code, 429)
+        self.assertTemplateUsed(response, '429.html')
+        self.assertIn('Retry-After', response)
+
+    @override_settings(RATELIMITS={'core:home': {'GET': '1/m/ip'}})
+    def test_trusted_client_ip_header_is_honoured(self):
+        self.client.get(reverse('core:home'), HTTP_X_REAL_IP='10.0.0.1')
+        response = self.client.get(reverse('core:home'), HTTP_X_REAL_IP='10.0.0.2')
+        self.assertEqual(response.status_code, 200)
+        response = self.client.get(reverse('core:home'), HTTP_X_REAL_IP='10.0.0.1')
+        self.assertEqual(response.status_code, 429)
+
+    @override_settings(RATELIMITS={'core:home': {'POST': '1/m/ip'}})
+    def test_other_methods_are_not_limited(self):
+        for _ in range(3):
+            self.assertEqual(self.client.get(reverse('core:home')).status_code, 200)
+
+    @override_settings(RATELIMITS={'core:home': {'GET': '1/m/ip'}}, RATELIMIT_ENABLED=False)
+    def test_disabled(self):
+        for _ in range(3):
+            self.assertEqual(self.client.get(reverse('core:home')).status_code, 200)
+
+
+@override_settings(STORAGES=TEST_STORAGES)
+class HealthCheckTests(TestCase):
+    """
+    Test suite for the /healthz and /readyz probes.
+    """
+
+    def test_healthz_skips_the_stack(self):
+        with self.assertNumQueries(0):
+            response = self.client.get('/healthz', HTTP_HOST='not-allowed.example')
+        self.assertEqual(response.content, b'ok')
+        self.assertNotIn('Set-Cookie', response)
+        self.assertIn('no-store', response['Cache-Control'])
+
+    def test_readyz_reports_checks(self):
+        health.readiness(force=True)
+        response = self.client.get('/readyz')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['checks'], {'database': 'ok'})
+
+    def test_readyz_failure_returns_503(self):
+        with mock.patch.object(health, 'get_checks', lambda: {'database': lambda: 1 / 0}):
+            ready, checks = health.readiness(force=True)
+        self.assertFalse(ready)
+        self.assertEqual(checks['database'], 'error: ZeroDivisionError')
+        self.assertEqual(self.client.get('/readyz').status_code, 503)
+        health.readiness(force=True)
+
+    @override_settings(HEALTHCHECK_TIMEOUT=0.01)
+    def test_readyz_times_out(self):
+        with mock.patch.object(health, 'get_checks', lambda: {'database': lambda: time.sleep(0.1)}):
+            self.assertEqual(health.readiness(force=True)[1], {'database': 'timeout'})
+        health.readiness(force=True)
+
+    def test_readiness_is_cached(self):
+        health.readiness(force=True)
+        with mock.patch.object(health, 'run_check') as run_check:
+            health.readiness()
+        run_check.assert_not_called()
+
+
+@override_settings(STORAGES=TEST_STORAGES)
+class MetricsTests(TestCase):
+    """
+    Test suite for the memory-mapped multiprocess metrics and /metrics.
+    """
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+        override = override_settings(METRICS_DIR=self.directory)
+        override.enable()
+        self.addCleanup(override.disable)
+
+    def test_store_round_trip_and_growth(self):
+        store = metrics.MmapStore(os.path.join(self.directory, '1.db'))
+        for i in range(3000):
+            store.inc(f'key-{i}', 2.5)
+        store.inc('key-0')
+        store.close()
+        entries = {key: value for key, value, _ in metrics.read_file(os.path.join(self.directory, '1.db'))}
+        self.assertEqual(len(entries), 3000)
+        self.assertEqual(entries['key-0'], 3.5)
+
+    def test_requests_are_recorded(self):
+        self.client.get(reverse('core:home'))
+        self.client.get('/no-such-page/')
+        output = metrics.collect()
+        self.assertIn('django_http_requests_total{method="GET",status="200",view="core:home"} 1', output)
+        self.assertIn('view="<unresolved>"', output)
+        self.assertIn('django_http_request_duration_seconds_bucket{view="core:home",le="+Inf"} 1', output)
+        self.assertIn('django_http_request_duration_seconds_count{view="core:home"} 1', output)
+
+    def test_workers_are_summed_and_dead_workers_archived(self):
+        for pid in (101, 102):
+            store = metrics.MmapStore(os.path.join(self.directory, f'{pid}.db'))
+            store.inc(metrics.sample_key('django_db_queries_total', (('view', 'v'),)), 2)
+            store.close()
+        metrics.mark_process_dead(101, self.directory)
+        self.assertFalse(os.path.exists(os.path.join(self.directory, '101.db')))
+        self.assertIn('django_db_queries_total{view="v"} 4', metrics.collect())
+
+    def test_cache_hits_and_misses(self):
+        self.client.get(reverse('core:home'))  # loads the middleware, which instruments the cache
+        cache.set('present', 1)
+        cache.get('present')
+        cache.get('absent')
+        output = metrics.collect()
+        self.assertIn('django_cache_gets_total{backend="LocMemCache",result="hit"}', output)
+        self.assertIn('django_cache_gets_total{backend="LocMemCache",result="miss"}', output)
+
+    def test_metrics_endpoint_is_restricted(self):
+        self.assertEqual(self.client.get('/metrics', REMOTE_ADDR='10.1.2.3').status_code, 403)
+        response = self.client.get('/metrics')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['Content-Type'].startswith('text/plain'))
+
+
+class FingerprintTests(SimpleTestCase):
+    """
+    Test suite for SQL normalisation in the slow query sampler.
+    """
+
+    def test_literals_and_placeholders_are_normalised(self):
+        first = querystats.fingerprint("SELECT * FROM t WHERE a = 'x' AND b = 10 AND c = %s")
+        second = querystats.fingerprint("SELECT *  FROM t WHERE a = 'it''s' AND b = 2.5 AND c = %s")
+        self.assertEqual(first, second)
+        self.assertEqual(first[1], 'SELECT * FROM t WHERE a = ? AND b = ? AND c = ?')
+
+    def test_in_lists_and_savepoints_collapse(self):
+        self.assertEqual(
+            querystats.fingerprint('SELECT 1 FROM t WHERE id IN (%s, %s, %s)')[0],
+            querystats.fingerprint('SELECT 1 FROM t WHERE id IN (%s)')[0],
+        )
+        self.assertEqual(querystats.fingerprint('SAVEPOINT "s1234_x5"')[1], 'SAVEPOINT ?')
+        self.assertEqual(
+            querystats.fingerprint('INSERT INTO t (a, b) VALUES (%s, %s), (%s, %s)')[1],
+            'INSERT INTO t (a, b) VALUES (...)',
+        )
+
+    def test_stats_are_bounded(self):
+        stats = querystats.QueryStats(max_size=2)
+        for digest in ('a', 'b', 'a', 'c'):
+            stats.record(digest, digest, 0.5)
+        entries = stats.drain()
+        self.assertEqual(list(entries), ['a', 'c'])
+        self.assertEqual(entries['a'][1:], [2, 1.0, 0.5])
+
+
+@override_settings(STORAGES=TEST_STORAGES, QUERYSTATS_ENABLED=True, QUERYSTATS_SLOW_MS=0)
+class QueryStatsTests(TestCase):
+    """
+    Test suite for the query stats middleware, EXPLAIN capture, flushing and reporting.
+    """
+
+    def setUp(self):
+        querystats._stats = None
+        # Run background tasks inline so they use the test transaction
+        patcher = mock.patch.object(querystats, 'submit', lambda func, *args: func(*args))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.user = CustomUser.objects.create_superuser(username='admin', email='admin@example.com',
+                                                        password='password123')
+
+    def test_slow_queries_are_sampled_with_plan(self):
+        self.client.force_login(self.user)
+        self.client.get(reverse('users:user_profile'))
+        sample = SlowQuery.objects.filter(sql__contains='users_customuser').first()
+        self.assertIsNotNone(sample)
+        self.assertEqual(sample.view, 'users:user_profile')
+        self.assertTrue(sample.plan)
+
+    @override_settings(QUERYSTATS_FLUSH_SECONDS=0)
+    def test_counters_are_flushed_and_summed(self):
+        querystats.flush({'abc': ['SELECT ?', 2, 0.3, 0.2]})
+        querystats.flush({'abc': ['SELECT ?', 1, 0.5, 0.5]})
+        row = QueryFingerprint.objects.get(pk='abc')
+        self.assertEqual((row.calls, row.max_time), (3, 0.5))
+        self.assertAlmostEqual(row.total_time, 0.8)
+
+    def test_command_and_admin_page(self):
+        querystats.flush({'abc': ['SELECT ?', 2, 0.3, 0.2]})
+        out = StringIO()
+        call_command('querystats', stdout=out)
+        self.assertIn('abc', out.getvalue())
+        self.assertEqual(self.client.get(reverse('admin:core_queryfingerprint_changelist')).status_code, 302)
+        self.client.force_login(self.user)
+        self.assertContains(self.client.get(reverse('admin:core_queryfingerprint_changelist')), 'SELECT ?')
+
+
+@override_settings(STORAGES=TEST_STORAGES)
+class UnpolyMiddlewareTests(TestCase):
+    """
+    Test suite for trimming full pages on Unpoly main-target requests.
+    """
+
+    def test_main_target_skips_layout(self):
+        response = self.client.get(reverse('core:home'), HTTP_X_UP_TARGET='main')
+        self.assertContains(response, '<main id="content"')
+        self.assertContains(response, 'id="django-messages"')
+        self.assertNotContains(response, 'id="sidebar"')
+        self.assertNotContains(response, 'bootstrap.min.css')
+
+    def test_main_target_with_hungry_elements_skips_layout(self):
+        """Test the combined target Unpoly sends when up-hungry elements join a navigation"""
+        response = self.client.get(reverse('core:home'), HTTP_X_UP_TARGET=':main, #django-messages')
+        self.assertContains(response, 'id="django-messages"')
+        self.assertNotContains(response, 'id="sidebar"')
+        response = self.client.get(reverse('core:home'), HTTP_X_UP_TARGET=':main, #sidebar')
+        self.assertContains(response, 'id="sidebar"')
+
+    def test_regular_request_renders_layout(self):
+        response = self.client.get(reverse('core:home'))
+        self.assertContains(response, 'id="sidebar"')
+        self.assertIn('X-Up-Target', response['Vary'])
+
+    def test_unsafe_unpoly_requests_expire_cache(self):
+        response = self.client.post(reverse('core:home'), HTTP_X_UP_VERSION='3.14.1')
+        self.assertEqual(response['X-Up-Expire-Cache'], '*')
+
+
+@override_settings(STORAGES=TEST_STORAGES)
+class SessionStoreTests(TestCase):
+    """
+    Test suite for the core.sessions engine and the batched session reaper.
+    """
+
+    def create_sessions(self, count, expired):
+        offset = timedelta(hours=-1 if expired else 1)
+        Session.objects.bulk_create(
+            Session(session_key=f'{"x" if expired else "v"}{i:031d}', session_data='',
+                    expire_date=timezone.now() + offset)
+            for i in range(count)
+        )
+
+    def test_login_records_user_id(self):
+        user = CustomUser.objects.create_user(username='testuser', email='test@example.com', password='password123')
+        self.client.force_login(user)
+        session = Session.objects.get(session_key=self.client.session.session_key)
+        self.assertEqual(session.user_id, user.pk)
+
+    def test_anonymous_session_has_no_user_id(self):
+        store = SessionStore()
+        store['foo'] = 'bar'
+        store.save()
+        self.assertIsNone(Session.objects.get(session_key=store.session_key).user_id)
+
+    def test_delete_expired_batches(self):
+        self.create_sessions(5, expired=True)
+        self.create_sessions(2, expired=False)
+        batches = list(delete_expired_batches(batch_size=2))
+        self.assertEqual([deleted for deleted, _ in batches], [2, 2, 1])
+        self.assertEqual(Session.objects.count(), 2)
+
+    def test_reap_sessions_command_reports_batches(self):
+        self.create_sessions(3, expired=True)
+        out = StringIO()
+        call_command('reap_sessions', batch_size=2, pause=0, stdout=out)
+        self.assertIn('Batch 1: deleted 2 sessions', out.getvalue())
+        self.assertIn('Deleted 3 expired sessions in 2 batches', out.getvalue())
+        self.assertFalse(Session.objects.exists())
+
+    def test_reap_sessions_command_respects_time_budget(self):
+        self.create_sessions(3, expired=True)
+        call_command('reap_sessions', batch_size=1, pause=0, time_budget=0, stdout=StringIO())
+        self.assertEqual(Session.objects.count(), 2)
+
+
+class MailgunBatchBackendTests(SimpleTestCase):
+    """
+    Test suite for the batching Mailgun backend, run against the fake Mailgun server.
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.server = FakeMailgunServer().start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+        super().tearDownClass()
+
+    def setUp(self):
+        self.server.reset()
+        self.server.failure_rate = 0.0
+
+    def get_connection(self, **kwargs):
+        return get_connection(
+            'core.email.MailgunBatchBackend', api_key='test', sender_domain='example.com',
+            api_url=self.server.api_url, retry_backoff=0, **kwargs
+        )
+
+    def notices(self, count, subject='Notice'):
+        return [EmailMessage(subject, 'Body', 'noreply@example.com', [f'user{i}@example.com']) for i in range(count)]
+
+    def test_identical_messages_are_batched(self):
+        messages = self.notices(5)
+        self.assertEqual(self.get_connection().send_messages(messages), 5)
+        self.assertEqual(self.server.requests, 1)
+        self.assertEqual(self.server.recipients, 5)
+        self.assertEqual(messages[0].anymail_status.status, {'queued'})
+
+    def test_batches_are_chunked(self):
+        self.get_connection(batch_size=2).send_messages(self.notices(5))
+        self.assertEqual(self.server.requests, 3)
+
+    def test_different_messages_are_sent_separately(self):
+        messages = self.notices(2) + self.notices(1, subject='Other')
+        messages.append(EmailMessage('Notice', 'Body', 'noreply@example.com', ['a@example.com'], cc=['b@example.com']))
+        self.assertEqual(self.get_connection().send_messages(messages), 4)
+        self.assertEqual(self.server.requests, 3)
+
+    def test_failed_batch_is_retried_per_recipient(self):
+        self.server.failure_rate = 1.0
+        connection = self.get_connection(retries=1, fail_silently=True)
+        self.assertEqual(connection.send_messages(self.notices(3)), 0)
+        # One batch request, then two attempts for each of the three recipients
+        self.assertEqual(self.server.failures, 7)
+
+    def test_session_is_shared_between_connections(self):
+        first, second = self.get_connection(), self.get_connection()
+        first.open()
+        second.open()
+        self.assertIs(first.session, second.session)
+
+
+@override_settings(STORAGES=TEST_STORAGES, ALLOWED_HOSTS=['testserver', 'brand.example', 'other.example'])
+class SiteTests(TestCase):
+    """
+    Test suite for Host-based Site resolution, its cache and init_site syncing.
+    """
+
+    def setUp(self):
+        cache.clear()
+        SITE_CACHE.clear()
+        self.addCleanup(SITE_CACHE.clear)  # entries may refer to rows rolled back after the test
+        self.brand = Site.objects.create(domain='brand.example', name='Brand')
+
+    def test_site_is_resolved_from_host(self):
+        """Test that each host gets its own site and branding, and unknown hosts the default site"""
+        response = self.client.get(reverse('core:home'), headers={'host': 'brand.example'})
+        self.assertEqual(response.wsgi_request.site, self.brand)
+        self.assertContains(response, '<span class="fs-5 fw-semibold">Brand</span>', html=True)
+        response = self.client.get(reverse('core:home'), headers={'host': 'other.example'})
+        self.assertEqual(response.wsgi_request.site.pk, 1)
+
+    def test_site_is_cached_per_host(self):
+        """Test that repeat requests resolve the site without a query"""
+        self.client.get(reverse('core:home'), headers={'host': 'brand.example:8000'})
+        request = mock.Mock(get_host=mock.Mock(return_value='brand.example:8000'))
+        with self.assertNumQueries(0):
+            self.assertEqual(sites.get_site(request), self.brand)
+
+    def test_other_workers_drop_cached_sites_after_a_change(self):
+        """Test that a Site saved elsewhere bumps the shared version and clears the cache"""
+        request = mock.Mock(get_host=mock.Mock(return_value='brand.example'))
+        sites.get_site(request)
+        sites.bump_version()  # another worker saved a Site
+        with mock.patch.object(sites, '_checked_at', float('-inf')):
+            with self.assertNumQueries(1):
+                sites.get_site(request)
+
+    def test_email_subject_uses_site_name(self):
+        """Test that allauth email subjects are prefixed with the current site's name"""
+        CustomUser.objects.create_user(username='u', email='user@example.com', password='password123')
+        self.client.post(reverse('account_reset_password'), {'email': 'user@example.com'},
+                         headers={'host': 'brand.example'})
+        self.assertTrue(mail.outbox[0].subject.startswith('Brand: '))
+
+    def test_init_site_syncs_config_file(self):
+        """Test that init_site --config creates, updates and prunes sites in one go"""
+        Site.objects.create(domain='stale.example', name='Stale')
+        with tempfile.NamedTemporaryFile('w', suffix='.toml', delete=False) as config:
+            config.write(
+                '[[sites]]\nid = 1\ndomain = "main.example"\nname = "Main"\n\n'
+                '[[sites]]\ndomain = "brand.example"\nname = "Brand Two"\n\n'
+                '[[sites]]\ndomain = "new.example"\nname = "New"\n'
+            )
+        self.addCleanup(os.unlink, config.name)
+        out = StringIO()
+        call_command('init_site', config=config.name, prune=True, stdout=out)
+        self.assertIn('1 created, 2 updated, 1 deleted', out.getvalue())
+        self.assertEqual(
+            dict(Site.objects.values_list('domain', 'name')),
+            {'main.example': 'Main', 'brand.example': 'Brand Two', 'new.example': 'New'},
+        )
+
+
+@override_settings(STORAGES=TEST_STORAGES)
+class MigrationCheckTests(TestCase):
+    """
+    Test suite for the blocking-migration checker and the online operations.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        loader = MigrationLoader(None)
+        cls.state = loader.project_state(('users', '0006_customuser_avatar'))
+
+    def codes(self, *operations, atomic=True, ignore=()):
+        migration = migrations.Migration('0099_check', 'users')
+        migration.operations = list(operations)
+        migration.atomic = atomic
+        if ignore:
+            migration.check_migrations_ignore = set(ignore)
+        return [finding.code for finding in check_migration(migration, self.state, connection)]
+
+    def test_blocking_operations_are_reported(self):
+        """Test that index builds, type changes, NOT NULL and constraint validation are flagged"""
+        index = models.Index(fields=['display_name'], name='users_display_name_idx')
+        self.assertEqual(self.codes(migrations.AddIndex('customuser', index)), ['index'])
+        self.assertEqual(self.codes(migrations.AlterField(
+            'customuser', 'display_name', models.CharField(max_length=100, null=False, blank=True, default=''),
+        )), ['not-null'])
+        self.assertEqual(self.codes(migrations.AlterField(
+            'customuser', 'display_name', models.IntegerField(null=True),
+        )), ['type-change'])
+        self.assertEqual(self.codes(migrations.AddConstraint('customuser', models.CheckConstraint(
+            condition=models.Q(display_name__isnull=False), name='display_name_not_null',
+        ))), ['constraint'])
+        self.assertEqual(self.codes(migrations.AddField(
+            'customuser', 'nickname', models.CharField(max_length=20, null=True, db_index=True),
+        )), ['index'])
+
+    def test_safe_operations_pass(self):
+        """Test that metadata-only changes, new tables and online operations are not flagged"""
+        self.assertEqual(self.codes(
+            migrations.AddField('customuser', 'nickname', models.CharField(max_length=20, null=True)),
+            migrations.AlterField('customuser', 'display_name', models.CharField(max_length=200, null=True)),
+            online.AddConstraintNotValid('customuser', models.CheckConstraint(
+                condition=models.Q(display_name__isnull=False), name='display_name_not_null',
+            )),
+            online.ValidateConstraint('customuser', 'display_name_not_null'),
+        ), [])
+        self.assertEqual(self.codes(
+            migrations.CreateModel('Badge', [('id', models.BigAutoField(primary_key=True))]),
+            migrations.AddIndex('badge', models.Index(fields=['id'], name='badge_idx')),
+        ), [])
+        concurrent = online.AddIndexConcurrently(
+            'customuser', models.Index(fields=['display_name'], name='users_display_name_idx'),
+        )
+        self.assertEqual(self.codes(concurrent, atomic=False), [])
+        self.assertEqual(self.codes(concurrent), ['atomic'])
+
+    def test_non_atomic_migrations_hold_only_retry_safe_operations(self):
+        """Test that schema changes next to concurrent operations in a non-atomic migration are flagged"""
+        field = migrations.AddField('customuser', 'nickname', models.CharField(max_length=20, null=True))
+        concurrent = online.AddIndexConcurrently(
+            'customuser', models.Index(fields=['display_name'], name='users_display_name_idx'),
+        )
+        backfill = online.BatchedBackfill('customuser', 'display_name', models.F('first_name'))
+        self.assertEqual(self.codes(field, concurrent, atomic=False), ['retry'])
+        self.assertEqual(self.codes(concurrent, backfill, atomic=False), [])
+        self.assertEqual(self.codes(field, concurrent, atomic=False, ignore={'retry'}), [])
+
+    def test_findings_can_be_acknowledged(self):
+        """Test that check_migrations_ignore silences reviewed findings"""
+        index = models.Index(fields=['display_name'], name='users_display_name_idx')
+        self.assertEqual(self.codes(migrations.AddIndex('customuser', index), ignore={'index'}), [])
+
+    def test_command_on_project_migrations(self):
+        """Test that the project's own migrations have no blocking operations and errors fail the command"""
+        out = StringIO()
+        call_command('check_migrations', 'users', include_applied=True, stdout=out)
+        self.assertIn('users.0005_customuser_updated_at', out.getvalue())
+        with self.assertRaises(CommandError):
+            call_command('check_migrations', 'users', include_applied=True, fail_level='warning', stdout=StringIO())
+
+    def test_batched_backfill(self):
+        """Test that the backfill walks every NULL row in primary key batches"""
+        for index in range(5):
+            CustomUser.objects.create_user(username=f'user{index}', email=f'user{index}@example.com',
+                                           first_name=f'First{index}')
+        CustomUser.objects.filter(username='user2').update(display_name='Kept')
+        operation = online.BatchedBackfill('customuser', 'display_name', models.F('first_name'), batch_size=2)
+        with CaptureQueriesContext(connection) as queries:
+            operation.database_forwards('users', mock.Mock(connection=connection), self.state, self.state)
+        updates = [query['sql'] for query in queries if query['sql'].startswith('UPDATE')]
+        self.assertEqual(len(updates), 2)  # four NULL rows in batches of two
+        self.assertEqual(
+            list(CustomUser.objects.order_by('pk').values_list('display_name', flat=True)),
+            ['First0', 'First1', 'Kept', 'First3', 'First4'],
+        )
+
+    def test_not_valid_constraint_must_be_a_check(self):
+        """Test that only check constraints can be added NOT VALID"""
+        with self.assertRaises(ValueError):
+            online.AddConstraintNotValid('customuser', models.UniqueConstraint(fields=['email'], name='unique_email'))
+
+
+@override_settings(STORAGES=TEST_STORAGES, EVENTS_ENABLED=True, EVENTS_BROADCAST='core.events.LocalBroadcast')
+class EventsTests(TestCase):
+    """
+    Test suite for the Server-Sent Events stream and its fan-out hub.
+    """
+
+    def setUp(self):
+        self.hub = events.Hub(events.LocalBroadcast())
+        for target, value in [('get_hub', lambda: self.hub), ('close_old_connections', lambda: None)]:
+            # close_old_connections() would end the test transaction, as Django's test client knows
+            patcher = mock.patch.object(events, target, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.user = CustomUser.objects.create_user(username='reader', email='reader@example.com', password='pw')
+        self.client.force_login(self.user)
+        self.cookie = f'{settings.SESSION_COOKIE_NAME}={self.client.cookies[settings.SESSION_COOKIE_NAME].value}'
+
+    def scope(self, cookie=''):
+        return {
+            'type': 'http', 'method': 'GET', 'path': '/events/', 'query_string': b'', 'root_path': '',
+            'headers': [(b'host', b'testserver'), (b'cookie', cookie.encode())],
+            'server': ('testserver', 80), 'client': ('127.0.0.1', 50000),
+        }
+
+    async def open_stream(self, scope):
+        """Start the app on ``scope``; returns (task, sent messages, disconnect event)."""
+        sent, disconnected = [], asyncio.Event()
+
+        async def receive():
+            await disconnected.wait()
+            return {'type': 'http.disconnect'}
+
+        async def send(message):
+            sent.append(message)
+
+        task = asyncio.ensure_future(events.application(scope, receive, send))
+        return task, sent, disconnected
+
+    async def wait_for(self, condition):
+        for _ in range(1000):
+            if condition():
+                return
+            await asyncio.sleep(0.001)
+        self.fail('condition not met')
+
+    async def test_anonymous_requests_are_refused(self):
+        """Test that /events/ is routed to the stream and refuses requests without a signed-in user"""
+        from project.asgi import application
+
+        sent = []
+
+        async def send(message):
+            sent.append(message)
+
+        await application(self.scope(), None, send)
+        self.assertEqual(sent[0]['status'], 403)
+
+    async def test_stream_delivers_events_to_the_user(self):
+        """Test that a broadcast event reaches the user's stream and the hub forgets it on disconnect"""
+        task, sent, disconnected = await self.open_stream(self.scope(self.cookie))
+        await self.wait_for(lambda: self.user.pk in self.hub.subscribers)
+        self.assertEqual(sent[0]['status'], 200)
+        self.assertIn((b'content-type', b'text/event-stream'), sent[0]['headers'])
+
+        events.LocalBroadcast().publish({'users': [self.user.pk + 1], 'event': 'account', 'data': {}})
+        events.LocalBroadcast().publish({'users': [self.user.pk], 'event': 'account', 'data': {'reason': 'x'}})
+        await self.wait_for(lambda: len(sent) == 3)
+        self.assertEqual(sent[2]['body'], b'event: account\ndata: {"reason": "x"}\n\n')
+
+        disconnected.set()
+        await task
+        self.assertEqual(self.hub.subscribers, {})
+        self.assertEqual(self.hub.connections, 0)
+
+    @override_settings(EVENTS_HEARTBEAT=0.01)
+    async def test_idle_stream_sends_heartbeats(self):
+        """Test that idle streams send comments so proxies keep them open"""
+        task, sent, disconnected = await self.open_stream(self.scope(self.cookie))
+        await self.wait_for(lambda: len(sent) >= 3)
+        disconnected.set()
+        await task
+        self.assertEqual(sent[2]['body'], b': ping\n\n')
+
+    async def test_full_queues_drop_events(self):
+        """Test that a stream that falls behind loses events instead of buffering without bound"""
+        with self.hub.subscribe(self.user.pk) as queue:
+            for _ in range(events.QUEUE_SIZE + 5):
+                self.hub.deliver({'users': [self.user.pk], 'event': 'account', 'data': None})
+            self.assertEqual(queue.qsize(), events.QUEUE_SIZE)
+
+    def test_publish_waits_for_commit(self):
+        """Test that events are broadcast after commit, in messages small enough for NOTIFY"""
+        broadcast = mock.Mock()
+        with mock.patch.object(events, 'get_broadcast', return_value=broadcast):
+            with self.captureOnCommitCallbacks(execute=True):
+                events.publish(range(events.USERS_PER_MESSAGE + 1), 'account')
+                broadcast.publish.assert_not_called()
+        self.assertEqual([len(call.args[0]['users']) for call in broadcast.publish.call_args_list],
+                         [events.USERS_PER_MESSAGE, 1])
+
+    def test_streams_are_opt_in(self):
+        """Test that pages only open a stream, and events are only published, with EVENTS_ENABLED"""
+        self.assertContains(self.client.get(reverse('core:home')), "new EventSource('/events/')")
+        broadcast = mock.Mock()
+        with self.settings(EVENTS_ENABLED=False), mock.patch.object(events, 'get_broadcast', return_value=broadcast):
+            self.assertNotContains(self.client.get(reverse('core:home')), 'EventSource')
+            with self.captureOnCommitCallbacks(execute=True):
+                events.publish([self.user.pk], 'account')
+        broadcast.publish.assert_not_called()
+
+
+@override_settings(STORAGES=TEST_STORAGES, COMPRESSION_MIN_SIZE=200)
+class CompressionTests(TestCase):
+    """
+    Test suite for negotiated response compression and its BREACH padding.
+    """
+
+    def middleware(self, response):
+        return CompressionMiddleware(lambda request: response)
+
+    def test_pages_are_gzipped(self):
+        """Test that HTML pages are compressed and marked for caches"""
+        response = self.client.get(reverse('core:home'), HTTP_ACCEPT_ENCODING='gzip, deflate')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertIn('Accept-Encoding', response['Vary'])
+        self.assertEqual(int(response['Content-Length']), len(response.content))
+        self.assertTrue(gzip.decompress(response.content).rstrip().endswith(b'</html>'))
+
+    def test_pages_with_csrf_token_are_padded(self):
+        """Test that pages using the CSRF token get a random-length gzip file name"""
+        response = self.client.get(reverse('account_login'), HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertTrue(response.content[3] & 0x08)  # FNAME
+        self.assertIn(b'csrfmiddlewaretoken', gzip.decompress(response.content))
+
+    def test_negotiation(self):
+        """Test that q-values win, ties follow server preference, and padded pages skip brotli"""
+        encoders = [compression.BrotliEncoder, compression.ZstdEncoder, compression.GzipEncoder]
+        self.assertIs(compression.negotiate('gzip, deflate, br, zstd', encoders), compression.BrotliEncoder)
+        self.assertIs(compression.negotiate('br;q=0.5, gzip', encoders), compression.GzipEncoder)
+        self.assertIs(compression.negotiate('br, zstd', encoders, padded=True), compression.ZstdEncoder)
+        self.assertIs(compression.negotiate('*', encoders[1:]), compression.ZstdEncoder)
+        self.assertIsNone(compression.negotiate('gzip;q=0, identity', encoders))
+        self.assertIsNone(compression.negotiate('', encoders))
+
+    def test_streaming_responses_are_flushed_per_chunk(self):
+        """Test that each streamed chunk can be decoded as soon as it arrives"""
+        chunks = [b'<p>%d</p>' % i * 100 for i in range(3)]
+        response = StreamingHttpResponse(iter(chunks), content_type='text/html')
+        request = RequestFactory().get('/', HTTP_ACCEPT_ENCODING='gzip')
+        response = self.middleware(response)(request)
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        decoder = zlib.decompressobj(31)
+        decoded = [decoder.decompress(chunk) for chunk in response.streaming_content]
+        self.assertEqual(decoded[:3], chunks)
+        self.assertTrue(decoder.eof)
+
+    def test_etag_is_weakened(self):
+        """Test that a strong ETag becomes weak once the bytes change"""
+        response = HttpResponse(b'x' * 1000, content_type='text/html')
+        response['ETag'] = '"abc"'
+        response = self.middleware(response)(RequestFactory().get('/', HTTP_ACCEPT_ENCODING='gzip'))
+        self.assertEqual(response['ETag'], 'W/"abc"')
+
+    def test_small_encoded_and_binary_responses_are_left_alone(self):
+        """Test that small bodies, already encoded bodies and non-text types are not compressed"""
+        request = RequestFactory().get('/', HTTP_ACCEPT_ENCODING='gzip')
+        for response in [
+            HttpResponse(b'short', content_type='text/html'),
+            HttpResponse(b'x' * 1000, content_type='application/zip'),
+        ]:
+            self.assertFalse(self.middleware(response)(request).has_header('Content-Encoding'))
+        encoded = HttpResponse(b'x' * 1000, content_type='text/html', headers={'Content-Encoding': 'br'})
+        self.assertEqual(self.middleware(encoded)(request).content, b'x' * 1000)
+
+
+@override_settings(STORAGES=TEST_STORAGES, EARLY_FLUSH_ENABLED=True)
+class EarlyFlushTests(TestCase):
+    """
+    Test suite for streaming base.html's head before the page body.
+    """
+
+    def setUp(self):
+        self.user = CustomUser.objects.create_user(username='flush', email='flush@example.com', password='pw')
+        self.client.force_login(self.user)
+        self.url = reverse('users:user_profile')
+
+    def test_head_is_sent_before_the_body(self):
+        """Test that the first chunk carries the asset tags and the second the rest of the page"""
+        response = self.client.get(self.url)
+        self.assertTrue(response.streaming)
+        self.assertEqual(response['X-Accel-Buffering'], 'no')
+        head, body = list(response.streaming_content)
+        self.assertIn(b'bootstrap.min.css', head)
+        self.assertNotIn(b'<title>', head)
+        self.assertIn(b'<title>', body)
+        page = head + body
+        self.assertEqual(page.count(b'<!DOCTYPE html>'), 1)
+        self.assertEqual(page.count(b'</html>'), 1)
+
+    def test_messages_are_shown_once(self):
+        """Test that messages are consumed before the response leaves MessageMiddleware"""
+        self.client.post(self.url, {'first_name': 'Ada', 'email': 'flush@example.com'})
+        self.assertIn(b'updated successfully', b''.join(self.client.get(self.url).streaming_content))
+        self.assertNotIn(b'updated successfully', b''.join(self.client.get(self.url).streaming_content))
+
+    def test_csrf_cookie_is_set(self):
+        """Test that the CSRF cookie for the body's forms is set although the body renders later"""
+        response = self.client.get(self.url)
+        self.assertIn(settings.CSRF_COOKIE_NAME, response.cookies)
+        token = response.cookies[settings.CSRF_COOKIE_NAME].value
+        self.assertTrue(token)
+
+    def test_redirects_fragments_and_disabled_mode_are_not_streamed(self):
+        """Test that only full-page 200 responses are streamed"""
+        response = self.client.post(self.url, {'first_name': 'Ada', 'email': 'flush@example.com'})
+        self.assertEqual(response.status_code, 302)
+        self.assertFalse(self.client.get(self.url, HTTP_X_UP_TARGET='#content').streaming)
+        with self.settings(EARLY_FLUSH_ENABLED=False):
+            self.assertFalse(self.client.get(self.url).streaming)
+
+    def test_body_queries_are_recorded(self):
+        """Test that queries run while the body streams reach the metrics and the query stats"""
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        recorded = []
+        templates = [
+            {**config, 'OPTIONS': {**config['OPTIONS'], 'context_processors': [
+                *config['OPTIONS'].get('context_processors', []), 'core.tests.count_users',
+            ]}}
+            for config in settings.TEMPLATES
+        ]
+        with self.settings(METRICS_DIR=directory.name, QUERYSTATS_ENABLED=True, TEMPLATES=templates), \
+                mock.patch.object(querystats, 'record', lambda sql, *args, **kwargs: recorded.append(sql)):
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(self.url)
+                head = next(response.streaming_content)
+                with CaptureQueriesContext(connection) as body_queries:
+                    body = b''.join(response.streaming_content)
+            output = metrics.collect()
+        self.assertIn(b'<title>', head + body)
+        self.assertTrue(body_queries.captured_queries)
+        self.assertEqual(len(recorded), len(queries))
+        self.assertIn(f'django_db_queries_total{{view="users:user_profile"}} {len(queries)}', output)
+        self.assertIn('django_http_requests_total{method="GET",status="200",view="users:user_profile"} 1', output)
+
+
+@override_settings(STORAGES=TEST_STORAGES, MEMORY_SAMPLE_INTERVAL=60, MEMORY_RSS_LIMIT_MB=0)
+class MemoryTests(TestCase):
+    """
+    Test suite for per-worker memory sampling, recycling and tracemalloc snapshots.
+    """
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+        override = override_settings(METRICS_DIR=self.directory)
+        override.enable()
+        self.addCleanup(override.disable)
+        patcher = mock.patch.object(memory, '_sampler', None)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(memory.stop)
+
+    def test_samples_are_logged_and_exported_once_per_interval(self):
+        """Test that a due sample logs and sets the per-pid gauges, and the next request does not sample"""
+        with self.assertLogs('core.memory', 'INFO') as logs:
+            self.assertFalse(memory.check())
+            self.assertFalse(memory.check())
+        self.assertEqual(len(logs.output), 1)
+        self.assertIn('since start', logs.output[0])
+        output = metrics.collect()
+        self.assertIn(f'django_worker_rss_bytes{{pid="{os.getpid()}"}}', output)
+        self.assertIn('# TYPE django_worker_python_blocks gauge', output)
+
+    def test_worker_over_the_limit_is_recycled(self):
+        """Test that check() asks for recycling above MEMORY_RSS_LIMIT_MB and counts it"""
+        with self.settings(MEMORY_RSS_LIMIT_MB=1), self.assertLogs('core.memory', 'WARNING'):
+            self.assertTrue(memory.check())
+        self.assertIn('django_worker_memory_recycles_total 1', metrics.collect())
+
+    def test_dead_workers_gauges_are_dropped(self):
+        """Test that archiving a dead worker keeps its counters but not its gauges"""
+        store = metrics.MmapStore(os.path.join(self.directory, '101.db'))
+        store.set(metrics.sample_key('django_worker_rss_bytes', (('pid', '101'),)), 1e6)
+        store.inc(metrics.sample_key('django_worker_memory_recycles_total', ()))
+        store.close()
+        metrics.mark_process_dead(101, self.directory)
+        output = metrics.collect()
+        self.assertNotIn('django_worker_rss_bytes', output)
+        self.assertIn('django_worker_memory_recycles_total 1', output)
+
+    def test_snapshot_diff_is_grouped_by_module(self):
+        """Test that the second snapshot reports growth summed per module"""
+        self.assertIn('tracemalloc started', memory.snapshot()[0])
+        self.retained = [str(n) * 100 for n in range(2000)]
+        report = '\n'.join(memory.snapshot())
+        self.assertIn('core.tests', report)
+        self.assertEqual(memory.module_name(os.path.join(os.path.dirname(memory.__file__), '__init__.py')), 'core')
+
+    def test_signal_handler_does_not_wait_for_a_snapshot_in_progress(self):
+        """Test that SIGUSR2 during a snapshot or stop() skips instead of deadlocking on the trace lock"""
+        with memory._trace_lock, self.assertLogs('core.memory', 'WARNING') as logs:
+            memory.log_snapshot()
+        self.assertIn('already being taken', logs.output[0])
+        self.assertFalse(memory.tracemalloc.is_tracing())
+
+    def test_memory_page_is_superuser_only(self):
+        """Test that only superusers may view the page, which lists every worker and cannot start tracing"""
+        url = reverse('admin:core_requestprofile_memory')
+        self.assertEqual(self.client.get(url).status_code, 302)
+        staff = CustomUser.objects.create_user(username='staff', email='staff@example.com', password='pw',
+                                               is_staff=True)
+        self.client.force_login(staff)
+        self.assertEqual(self.client.get(url).status_code, 403)
+        store = metrics.MmapStore(os.path.join(self.directory, '101.db'))
+        store.set(metrics.sample_key('django_worker_rss_bytes', (('pid', '101'),)), 50 * memory.MB)
+        store.set(metrics.sample_key('django_worker_python_blocks', (('pid', '101'),)), 12345)
+        store.close()
+        superuser = CustomUser.objects.create_superuser('root', 'root@example.com', 'pw')
+        self.client.force_login(superuser)
+        self.assertContains(self.client.get(reverse('admin:core_requestprofile_changelist')), url)
+        response = self.client.get(url)
+        self.assertContains(response, '12345')
+        self.assertContains(response, f'{os.getpid()} (this request)')
+        self.assertEqual(self.client.post(url, {'action': 'snapshot'}).status_code, 405)
+        self.assertFalse(memory.tracemalloc.is_tracing())
+
+
+@override_settings(STORAGES=TEST_STORAGES)
+class ProfilingTests(TestCase):
+    """
+    Test suite for on-demand request profiles.
+    """
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+        override = override_settings(PROFILE_DIR=self.directory)
+        override.enable()
+        self.addCleanup(override.disable)
+        self.staff = CustomUser.objects.create_user(username='staff', email='staff@example.com', password='pw',
+                                                    is_staff=True, is_superuser=True)
+        self.token = profiling.make_token(self.staff)
+
+    def test_requests_without_a_token_are_not_profiled(self):
+        response = self.client.get(reverse('core:home'))
+        self.assertNotIn('X-Profile-Id', response)
+        self.assertFalse(RequestProfile.objects.exists())
+
+    def test_token_in_header_or_query_string_profiles_the_request(self):
+        """Test that a staff token stores collapsed stacks and names the profile in a header"""
+        response = self.client.get(reverse('core:home'), HTTP_X_PROFILE=self.token)
+        profile = RequestProfile.objects.get(pk=response['X-Profile-Id'])
+        self.assertEqual((profile.method, profile.view, profile.status), ('GET', 'core:home', 200))
+        content = open(os.path.join(self.directory, profile.file)).read()
+        self.assertEqual(len(content.encode()), profile.size)
+        for line in content.splitlines():
+            stack, count = line.rsplit(' ', 1)
+            self.assertIn(':', stack)
+            self.assertGreater(int(count), 0)
+        self.client.get(reverse('core:home'), {'_profile': self.token, 'page': '2'})
+        self.assertEqual(RequestProfile.objects.first().path, '/?page=2')
+
+    def test_forged_and_non_staff_tokens_are_ignored(self):
+        user = CustomUser.objects.create_user(username='plain', email='plain@example.com', password='pw')
+        for token in (profiling.make_token(user), self.token + 'x'):
+            response = self.client.get(reverse('core:home'), HTTP_X_PROFILE=token)
+            self.assertNotIn('X-Profile-Id', response)
+        with self.settings(PROFILE_TOKEN_MAX_AGE=-1):
+            self.assertNotIn('X-Profile-Id', self.client.get(reverse('core:home'), HTTP_X_PROFILE=self.token))
+        self.assertFalse(RequestProfile.objects.exists())
+
+    def test_oldest_profiles_are_pruned_with_their_files(self):
+        """Test that profiles beyond PROFILE_MAX_BYTES are deleted oldest first"""
+        for _ in range(3):
+            self.client.get(reverse('core:home'), HTTP_X_PROFILE=self.token)
+        newest = RequestProfile.objects.first()
+        oldest = RequestProfile.objects.last()
+        self.assertEqual(profiling.prune(max_bytes=newest.size), 2)
+        self.assertEqual(list(RequestProfile.objects.all()), [newest])
+        self.assertEqual(os.listdir(self.directory), [newest.file])
+        self.assertNotEqual(oldest.file, newest.file)
+
+    def test_admin_issues_tokens_and_downloads_profiles(self):
+        self.client.force_login(self.staff)
+        response = self.client.get(reverse('admin:core_requestprofile_token'))
+        token = response.context['token']
+        profile_id = self.client.get(reverse('core:home'), HTTP_X_PROFILE=token)['X-Profile-Id']
+        self.assertContains(self.client.get(reverse('admin:core_requestprofile_changelist')), 'core:home')
+        download = self.client.get(reverse('admin:core_requestprofile_download', args=[profile_id]))
+        self.assertIn('attachment', download['Content-Disposition'])
+
+
+@override_settings(STORAGES=TEST_STORAGES)
+class TemplateBenchTests(TestCase):
+    """
+    Test suite for the template rendering benchmarks.
+    """
+
+    def test_every_case_renders_its_context(self):
+        """Test that each case renders, without queries, what its context is about"""
+        expected = {
+            'base/messages': 'Something went wrong.',
+            'sidebar/authenticated': 'Sign Out',
+            'profile/form-errors': 'invalid-feedback',
+            'profile/partial': 'delete-confirmation',
+            'account/email': 'ada@work.example.com',
+            'account/login-errors': 'This field is required.',
+            'email/password-changed': '203.0.113.7',
+        }
+        for case in templatebench.CASES:
+            with self.subTest(case.name), self.assertNumQueries(0):
+                output = templatebench.render(*templatebench.build(case))
+                self.assertIn(expected.get(case.name, 'Example'), output)
+
+    def test_measure_and_compare(self):
+        """Test that results are positive and slowdowns or memory growth beyond the tolerance are flagged"""
+        result = templatebench.measure(templatebench.CASES[0], min_time=0.01, rounds=2)
+        self.assertGreater(result['ops'], 0)
+        self.assertGreater(result['peak_kib'], 0)
+        baseline = {'a': {'ops': 100, 'peak_kib': 10}, 'b': {'ops': 100, 'peak_kib': 10}}
+        results = {'a': {'ops': 95, 'peak_kib': 10.5}, 'b': {'ops': 50, 'peak_kib': 20}, 'new': result}
+        self.assertEqual(templatebench.compare(results, baseline, 0.10), {'b': ['100% slower', '100% more memory']})
+
+    def test_command_saves_and_checks_the_baseline(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'templates.json')
+            call_command('bench_templates', 'profile/partial', baseline=path, save=True, min_time=0.01,
+                         stdout=StringIO())
+            with open(path) as baseline:
+                saved = json.load(baseline)
+            saved['profile/partial']['ops'] *= 100
+            with open(path, 'w') as baseline:
+                json.dump(saved, baseline)
+            with self.assertRaisesMessage(CommandError, '1 case(s) regressed'):
+                call_command('bench_templates', 'profile/partial', baseline=path, min_time=0.01,
+                             stdout=StringIO(), stderr=StringIO())
+
+
+@override_settings(STORAGES=TEST_STORAGES, SERVICE_WORKER_ENABLED=True)
+class ServiceWorkerTests(TestCase):
+    """
+    Test suite for the service worker and the marking of cacheable pages.
+    """
+
+    def setUp(self):
+        serviceworker.render_script.cache_clear()
+        self.addCleanup(serviceworker.render_script.cache_clear)
+
+    def test_script_is_served_from_the_root(self):
+        """Test that /sw.js is revalidated on every check and registered by base.html"""
+        response = self.client.get('/sw.js')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'text/javascript; charset=utf-8')
+        self.assertIn('no-cache', response['Cache-Control'])
+        script = response.content.decode()
+        self.assertIn("const ACCOUNTS_URL = '/accounts/';", script)
+        self.assertIn('const PRECACHE = [];', script)  # no manifest in tests
+        self.assertIn("navigator.serviceWorker.register('/sw.js')", self.client.get('/').content.decode())
+
+    def test_precache_uses_the_hashed_manifest(self):
+        """Test that only hashed files matching SERVICE_WORKER_PRECACHE are precached"""
+        storage = mock.Mock(hashed_files={'css/main.css': 'css/main.1a2b.css', 'images/hero.png': 'x',
+                                          'admin/css/base.css': 'y'}, manifest_hash='abc')
+        storage.url.side_effect = lambda name: f'/static/{name}'
+        self.assertEqual(serviceworker.precache_urls(storage, ['css/*']), (['/static/css/main.css'], 'abc'))
+        self.assertEqual(serviceworker.precache_urls(object(), ['css/*']), ([], ''))
+
+    def test_only_anonymous_public_pages_are_marked(self):
+        """Test that the cache header is limited to public_page views seen by anonymous visitors"""
+        header = serviceworker.CACHE_HEADER
+        for url in ('/', reverse('core:privacy_policy'), reverse('core:terms_and_conditions')):
+            self.assertEqual(self.client.get(url)[header], 'public')
+        self.assertNotIn(header, self.client.get(reverse('account_login')))
+        user = CustomUser.objects.create_user(username='sw', email='sw@example.com', password='pw')
+        self.client.force_login(user)
+        self.assertNotIn(header, self.client.get('/'))
+
+    def test_cookies_and_csrf_tokens_are_not_shared(self):
+        """Test that responses setting a cookie or using the CSRF token are not cacheable"""
+        request = RequestFactory().get('/')
+        request.user = AnonymousUser()
+        self.assertTrue(serviceworker.is_shareable(request, HttpResponse()))
+        response = HttpResponse()
+        response.set_cookie('messages', '')
+        self.assertFalse(serviceworker.is_shareable(request, response))
+        request.META['CSRF_COOKIE_NEEDS_UPDATE'] = False
+        self.assertFalse(serviceworker.is_shareable(request, HttpResponse()))
+
+    def test_disabled_worker_unregisters_itself(self):
+        """Test that turning the worker off serves a script removing it, and nothing is marked"""
+        with self.settings(SERVICE_WORKER_ENABLED=False):
+            script = self.client.get('/sw.js').content.decode()
+            self.assertIn('self.registration.unregister()', script)
+            self.assertNotIn('PRECACHE', script)
+            response = self.client.get('/')
+        self.assertNotIn(serviceworker.CACHE_HEADER, response)
+        self.assertNotIn(b'serviceWorker', response.content)
+
+
+class PerformanceChecksTests(SimpleTestCase):
+    """
+    Test suite for the ``performance`` deploy checks.
+    """
+
+    def ids(self, check):
+        return [message.id for message in check(None)]
+
+    def test_checks_run_with_deploy(self):
+        """Test that the checks are registered under the performance tag, for --deploy only"""
+        from django.core.checks.registry import registry
+
+        self.assertIn(performance_checks.TAG, registry.tags_available(deployment_checks=True))
+        self.assertNotIn(performance_checks.TAG, registry.tags_available())
+
+    def test_settings_traps_are_flagged(self):
+        """Test the debug toolbar, DEBUG logging, per-request session saves and per-worker caches"""
+        with self.settings(INSTALLED_APPS=['debug_toolbar'], MIDDLEWARE=[]):
+            self.assertEqual(self.ids(performance_checks.check_debug_toolbar), ['core.W001'])
+        with self.settings(INSTALLED_APPS=[], MIDDLEWARE=[]):
+            self.assertEqual(self.ids(performance_checks.check_debug_toolbar), [])
+        logging = {'version': 1, 'root': {'level': 'INFO'}, 'loggers': {'django.db.backends': {'level': 'DEBUG'}}}
+        with self.settings(LOGGING=logging):
+            self.assertIn('django.db.backends', performance_checks.check_logging_levels(None)[0].msg)
+        with self.settings(SESSION_SAVE_EVERY_REQUEST=True):
+            self.assertEqual(self.ids(performance_checks.check_session_save_every_request), ['core.W003'])
+        caches = {'default': {'BACKEND': 'django.core.cache.backends.redis.RedisCache'},
+                  'local': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+        with self.settings(CACHES=caches):
+            self.assertEqual(self.ids(performance_checks.check_shared_cache), ['core.W004'])
+
+    def test_database_connections(self):
+        """Test ATOMIC_REQUESTS, CONN_MAX_AGE without a pool, with a pool, and forever without health checks"""
+        engine = 'django.db.backends.postgresql'
+        cases = [
+            ({'ATOMIC_REQUESTS': True, 'CONN_MAX_AGE': 60}, ['core.W005']),
+            ({'CONN_MAX_AGE': 0}, ['core.W006']),
+            ({'CONN_MAX_AGE': 0, 'OPTIONS': {'pool': True}}, []),
+            ({'CONN_MAX_AGE': 60, 'OPTIONS': {'pool': True}}, ['core.E001']),
+            ({'CONN_MAX_AGE': None}, ['core.W007']),
+            ({'CONN_MAX_AGE': None, 'CONN_HEALTH_CHECKS': True}, []),
+        ]
+        for config, expected in cases:
+            with self.subTest(config):
+                errors = performance_checks.check_database('default', {'ENGINE': engine, **config})
+                self.assertEqual([error.id for error in errors], expected)
+
+    @isolate_apps('core')
+    def test_unindexed_user_lookups(self):
+        """Test that index detection covers db_index, Meta.indexes and expression indexes"""
+        from django.db.models.functions import Upper
+
+        class Indexed(models.Model):
+            email = models.EmailField()
+            date_joined = models.DateTimeField(db_index=True)
+            last_seen = models.DateTimeField()
+
+            class Meta:
+                app_label = 'core'
+                indexes = [models.Index(Upper('email'), name='indexed_email_idx'),
+                           models.Index(fields=['-last_seen'], name='indexed_seen_idx')]
+
+        self.assertLessEqual({'id', 'email', 'date_joined', 'last_seen'}, performance_checks.indexed_fields(Indexed))
+        messages = [message.msg for message in performance_checks.check_user_indexes(None)]
+        self.assertTrue(any('CustomUser.email ' in message for message in messages))
+        self.assertFalse(any('last_seen' in message for message in messages))
+
+    def test_template_loaders(self):
+        """Test that loaders without the cached loader, or template debugging, are flagged"""
+        backend = 'django.template.backends.django.DjangoTemplates'
+        uncached = {'loaders': ['django.template.loaders.app_directories.Loader']}
+        cached = {'loaders': [(performance_checks.CACHED_LOADER, uncached['loaders'])]}
+        for options, expected in [({}, []), (cached, []), (uncached, ['core.W009']), ({'debug': True}, ['core.W010'])]:
+            with self.subTest(options), self.settings(TEMPLATES=[{'BACKEND': backend, 'OPTIONS': options}]):
+                self.assertEqual(self.ids(performance_checks.check_template_loaders), expected)
@@ -0,0 +1,84 @@
+"""
+Helpers for serving Unpoly fragment requests.
+
+Unpoly sends the selector it is about to update in ``X-Up-Target`` (or
+``X-Up-Fail-Target`` when the response is an error) and discards everything
+else in the response, so rendering the sidebar, header and footer is wasted
+work for those requests. The header lists every selector Unpoly will update,
+comma-separated, including ``up-hungry`` elements such as ``#django-messages``.
+"""
+from functools import wraps
+
+from django.http import Http404
+from django.template.response import TemplateResponse
+
+# Selectors Unpoly resolves to the <main id="content"> element in base.html
+MAIN_TARGETS = {'main', ':main', '#content', '[up-main]'}
+
+# up-hungry elements of base.html, added to every target; they are optional, so responses may omit them
+HUNGRY_TARGETS = {'#django-messages'}
+
+UNSAFE_METHODS = {'POST', 'PUT', 'PATCH', 'DELETE'}
+
+
+def get_target(request, response):
+    """Return the selector Unpoly will extract from ``response``, if any."""
+    if response.status_code >= 400:
+        return request.headers.get('X-Up-Fail-Target', '')
+    return request.headers.get('X-Up-Target', '')
+
+
+def split_target(target):
+    """Return the selectors of a comma-separated target, e.g. ``':main, #django-messages'``."""
+    return [selector.strip() for selector in target.split(',') if selector.strip()]
+
+
+def primary_selector(target):
+    """
+    Return the one selector of ``target`` besides the hungry elements, or ''.
+
+    Targets naming several fragments of their own are not narrowed down.
+    """
+    selectors = [selector for selector in split_target(target) if selector not in HUNGRY_TARGETS]
+    return selectors[0] if len(selectors) == 1 else ''
+
+
+def is_main_target(target):
+    """Whether Unpoly only updates ``<main>`` (and the hungry elements, rendered with it)."""
+    return primary_selector(target) in MAIN_TARGETS
+
+
+def fragments(partials, expire_cache=None):
+    """
+    Render only the ``{% partialdef %}`` block that Unpoly is targeting.
+
+    ``partials`` maps Unpoly target selectors to partial names in the view's
+    template, e.g. ``{'#delete-confirmation': 'delete-account'}``. A partial can
+    also be requested explicitly with ``?partial=<name>``. While the view runs,
+    ``request.up_fragment`` holds the partial name it is expected to render so
+    it can skip building context the fragment does not use. Responses that are
+    not TemplateResponses, or whose target is not mapped, are left as full pages.
+
+    ``expire_cache`` is sent as ``X-Up-Expire-Cache`` after unsafe requests.
+    """
+    names = set(partials.values())
+
+    def decorator(view_func):
+        @wraps(view_func)
+        def wrapper(request, *args, **kwargs):
+            requested = request.GET.get('partial')
+            if requested and requested not in names:
+                raise Http404(f"Unknown partial: {requested}")
+            request.up_fragment = requested or partials.get(primary_selector(request.headers.get('X-Up-Target', '')))
+            response = view_func(request, *args, **kwargs)
+            name = requested or partials.get(primary_selector(get_target(request, response)))
+            if name and isinstance(response, TemplateResponse) and isinstance(response.template_name, str):
+                response.template_name = f'{response.template_name.split("#")[0]}#{name}'
+            if expire_cache and request.method in UNSAFE_METHODS:
+                response['X-Up-Expire-Cache'] = expire_cache
+            return response
+
+        return wrapper
+
+    return decorator
+
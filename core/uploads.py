@@ -0,0 +1,22 @@
+from django.conf import settings
+from django.core.files.uploadhandler import SkipFile, TemporaryFileUploadHandler
+
+
+class LimitedTemporaryFileUploadHandler(TemporaryFileUploadHandler):
+    """
+    Stream every upload to a temporary file, never into memory.
+
+    A file that passes ``FILE_UPLOAD_MAX_SIZE`` is skipped: its temporary
+    file is deleted and the rest of it is read and discarded, so it is
+    missing from ``request.FILES``. Its field name is added to
+    ``request.oversized_uploads`` for forms to report (see
+    ``users.forms.UserProfileForm``).
+    """
+
+    def receive_data_chunk(self, raw_data, start):
+        if start + len(raw_data) > settings.FILE_UPLOAD_MAX_SIZE:
+            if not hasattr(self.request, 'oversized_uploads'):
+                self.request.oversized_uploads = set()
+            self.request.oversized_uploads.add(self.field_name)
+            raise SkipFile
+        return super().receive_data_chunk(raw_data, start)
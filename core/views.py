@@ -1,13 +1,69 @@
+import mimetypes
+from urllib.parse import quote
+
+from django.conf import settings
+from django.core.exceptions import SuspiciousFileOperation
+from django.http import Http404, HttpResponse
 from django.template.response import TemplateResponse
+from django.utils._os import safe_join
+from django.utils.cache import patch_cache_control
+from django.views.static import serve
+
+from . import serviceworker
+from .serviceworker import public_page
+
+# Media under these prefixes is named after its content and never changes
+IMMUTABLE_MEDIA_PREFIXES = ('avatars/',)
+# Media under these prefixes is private and only sent to its owner by a dedicated view
+PRIVATE_MEDIA_PREFIXES = ('exports/',)
 
 
+@public_page
 def home(request):
     return TemplateResponse(request, "core/index.html")
 
 
+@public_page
 def show_privacy_policy(request):
     return TemplateResponse(request, "core/privacy_policy.html")
 
 
+@public_page
 def show_terms_and_conditions(request):
     return TemplateResponse(request, "core/terms_conditions.html")
+
+
+def rate_limited(request, exception=None):
+    """Render the 429 page for both our rate limiter and allauth's."""
+    return TemplateResponse(request, "429.html", status=429).render()
+
+
+def service_worker(request):
+    """Serve the service worker (see core.serviceworker) from the root, so its scope is the whole site."""
+    response = HttpResponse(serviceworker.render_script(), content_type='text/javascript; charset=utf-8')
+    # Browsers check for a new worker on navigations; never let a stale copy delay a deploy's caches
+    patch_cache_control(response, no_cache=True, max_age=0)
+    return response
+
+
+def serve_media(request, path):
+    """
+    Serve an uploaded file: nginx sends it (X-Accel-Redirect) in production, Django in development.
+
+    Content-addressed files are cached by browsers for a year without revalidation.
+    """
+    try:
+        safe_join(settings.MEDIA_ROOT, path)
+    except SuspiciousFileOperation:
+        raise Http404
+    if path.startswith(PRIVATE_MEDIA_PREFIXES):
+        raise Http404
+    if settings.MEDIA_X_ACCEL_REDIRECT:
+        content_type, _ = mimetypes.guess_type(path)
+        response = HttpResponse(content_type=content_type or 'application/octet-stream')
+        response['X-Accel-Redirect'] = settings.MEDIA_X_ACCEL_PREFIX + quote(path)
+    else:
+        response = serve(request, path, document_root=settings.MEDIA_ROOT)
+    if path.startswith(IMMUTABLE_MEDIA_PREFIXES):
+        patch_cache_control(response, public=True, max_age=365 * 24 * 60 * 60, immutable=True)
+    return response
@@ -0,0 +1,42 @@
+"""
+Gunicorn settings loaded by the systemd service (``--config gunicorn.conf.py``).
+Command line options in setup_configs.sh take precedence over these.
+"""
+import os
+
+
+def child_exit(server, worker):
+    """Fold the exited worker's metrics file into the archive (see core.metrics)."""
+    if os.environ.get('METRICS_DIR'):
+        from core.metrics import mark_process_dead
+
+        mark_process_dead(worker.pid, os.environ['METRICS_DIR'])
+
+
+def worker_exit(server, worker):
+    """Write the exiting worker's buffered last_seen times (see users.activity)."""
+    try:
+        from users.activity import flush_now
+
+        flush_now()
+    except Exception:
+        server.log.exception("Flushing last_seen on worker exit failed")
+
+
+def post_worker_init(worker):
+    """Log a tracemalloc snapshot diff when the worker receives SIGUSR2 (see core.memory)."""
+    from core.memory import install_signal_handler
+
+    install_signal_handler()
+
+
+def post_request(worker, req, environ, resp):
+    """Sample the worker's memory, and recycle it above MEMORY_RSS_LIMIT_MB (see core.memory)."""
+    try:
+        from core.memory import check
+
+        if check():
+            # What max_requests does: finish this request, exit, and let the master fork a new worker
+            worker.alive = False
+    except Exception:
+        worker.log.exception("Sampling worker memory failed")
@@ -35,6 +35,7 @@ MAILGUN_DOMAIN=sandboxid.mailgun.org
 DEFAULT_FROM_EMAIL=admin@localhost
 SITE_DOMAIN=mydomain.com
 SITE_NAME=mydomain
+MEDIA_ROOT=/var/www/media/$PROJECT_NAME
 EOF
 
 sudo chown "$DEPLOY_USER:www-data" "$ENV_FILE"
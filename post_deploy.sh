@@ -4,6 +4,9 @@
 # Description: Post-deployment script for Django
 # Change log:
 # 2025-08-06: Parameterized project name and updated gunicorn services accordingly.
+# 2026-10-19: Sync every site from sites.toml when the project has one.
+# 2026-10-19: Check pending migrations for blocking operations; migrate runs with lock_timeout/statement_timeout.
+# 2026-10-19: Run Django's deploy checks, including the performance checks in core/checks.py.
 
 set -e # Exit immediately if a command exits with a non-zero status.
 
@@ -18,7 +21,16 @@ fi
 # Set Django environment for production
 export DJANGO_ENV=prod
 
+echo "--- Running Deploy Checks ---"
+# Security and performance (core/checks.py) findings; only errors stop the deploy
+uv run python manage.py check --deploy
+
+echo "--- Checking Migrations for Blocking Operations ---"
+# Fails the deploy before anything is applied; see core/migration_checks.py
+uv run python manage.py check_migrations users core
+
 echo "--- Running Database Migrations ---"
+# Uses MIGRATION_LOCK_TIMEOUT / MIGRATION_STATEMENT_TIMEOUT and retries on lock timeouts (core migrate command)
 uv run python manage.py migrate --noinput
 
 echo "--- Collecting Static Files ---"
@@ -28,6 +40,9 @@ uv run python manage.py collectstatic --noinput --ignore="vendor/*"
 
 echo "--- Initializing Site (Custom Command) ---"
 uv run python manage.py init_site # Ensure this command is idempotent or safe to run repeatedly
+if [ -f sites.toml ]; then
+  uv run python manage.py init_site --config sites.toml
+fi
 
 echo "Reloading systemd"
 sudo systemctl daemon-reload
@@ -49,36 +49,52 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'core.middleware.HealthCheckMiddleware',  # /healthz and /readyz, must stay first
+    'core.middleware.MetricsMiddleware',  # /metrics, active when METRICS_DIR is set
+    'core.middleware.QueryStatsMiddleware',  # slow query sampler, active when QUERYSTATS_ENABLED
+    'core.middleware.ProfilerMiddleware',  # profiles requests carrying a staff token, see core.profiling
     'django.middleware.security.SecurityMiddleware',
     'whitenoise.middleware.WhiteNoiseMiddleware',
+    'core.middleware.CompressionMiddleware',  # br/zstd/gzip for dynamic responses, above anything setting ETags
+    'core.middleware.RateLimitMiddleware',  # must run before SessionMiddleware
+    'core.middleware.SiteMiddleware',  # request.site from the Host header
     "debug_toolbar.middleware.DebugToolbarMiddleware",  # for django-debug-toolbar
+    'core.middleware.ServiceWorkerMiddleware',  # marks public pages cacheable, above anything setting cookies
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
+    'django.middleware.http.ConditionalGetMiddleware',  # ETag/304 for pages without a view-level ETag
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'allauth.account.middleware.AccountMiddleware',
+    'users.middleware.ActivityMiddleware',  # buffered last_seen, see users.activity
+    'core.middleware.UnpolyMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
 
 # Django and allauth authentication configurations
 AUTHENTICATION_BACKENDS = [
     # Needed to login by username in Django admin, regardless of `allauth`
-    "django.contrib.auth.backends.ModelBackend",
+    "users.backends.CachedModelBackend",
     # `allauth` specific authentication methods, such as login by e-mail
-    "allauth.account.auth_backends.AuthenticationBackend",
+    "users.backends.CachedAuthenticationBackend",
+    # Both read request.user through the cache (USER_CACHE_ENABLED), see users.backends
 ]
 
 SITE_DOMAIN = env.str('SITE_DOMAIN', "localhost:8000")
 SITE_NAME = env.str('SITE_NAME', "Local Dev")
-SITE_ID = 1  # required by django.contrib.sites
+# Sites are resolved per request from the Host header (core.sites), so SITE_ID must stay unset.
+# Hosts without a Site row use DEFAULT_SITE_ID, which init_site fills from SITE_DOMAIN / SITE_NAME
+DEFAULT_SITE_ID = 1
+SITE_CACHE_ALIAS = 'default'
+SITE_CACHE_CHECK_INTERVAL = 5  # seconds until a worker sees Site changes saved by another
 
 # Authentication settings
 ACCOUNT_SIGNUP_FIELDS = ['email*', 'password1*', "password2*"]
 ACCOUNT_EMAIL_VERIFICATION = 'mandatory'
 ACCOUNT_LOGIN_METHODS = {'email'}
 ACCOUNT_USER_MODEL_USERNAME_FIELD = 'username'  # Required by django-allauth
-ACCOUNT_EMAIL_SUBJECT_PREFIX = '%s: ' % SITE_NAME
+ACCOUNT_ADAPTER = 'users.adapters.AccountAdapter'  # subjects prefixed with the current site's name
 ACCOUNT_EMAIL_UNKNOWN_ACCOUNTS = False  # Send email for password reset attempts by unknown users
 ACCOUNT_EMAIL_NOTIFICATIONS = True  # Send security email for account changes
 ACCOUNT_EMAIL_CONFIRMATION_ANONYMOUS_REDIRECT_URL = '/accounts/login/'
@@ -89,12 +105,71 @@ PASSWORD_RESET_TIMEOUT = 86400  # 24 hours in seconds
 ALLAUTH_TRUSTED_CLIENT_IP_HEADER = "X-Real-IP"  # specifically allow header to be set by a trusted component 
 
 # Session settings
+SESSION_ENGINE = 'core.sessions'  # indexed core_session table, reaped by `manage.py reap_sessions`
 SESSION_COOKIE_AGE = 86400  # 24 hours (24 * 60 * 60 seconds)
 SESSION_EXPIRE_AT_BROWSER_CLOSE = True  # End session on browser close
 SESSION_COOKIE_HTTPONLY = True  # Prevent JavaScript access (XSS protection)
 SESSION_COOKIE_SAMESITE = 'Lax'  # CSRF protection while allowing normal navigation
 SESSION_SAVE_EVERY_REQUEST = True  # Sliding expiration for better UX (comment out for high-traffic sites)
 
+# Cache settings (set CACHE_URL to redis:// or memcached:// so all workers share counters)
+CACHES = {
+    'default': env.dj_cache_url('CACHE_URL', default='locmem://'),
+}
+
+# Rate limiting settings (enforced by core.middleware.RateLimitMiddleware)
+RATELIMIT_ENABLED = env.bool('RATELIMIT_ENABLED', default=True)
+RATELIMIT_CACHE_ALIAS = 'default'
+RATELIMIT_ALGORITHM = env.str('RATELIMIT_ALGORITHM', default='sliding_window')  # or 'token_bucket'
+RATELIMITS = {
+    # URL name: {HTTP method or '*': '<amount>/<period>/<ip|user|route>[,...]'}
+    'users:user_profile': {'GET': '120/m/user', 'POST': '10/m/user,30/m/ip'},
+    'users:delete_account': {'POST': '5/h/user,30/h/ip'},
+    'users:personal_data_export': {'POST': '3/h/user,20/h/ip'},
+    'users:personal_data_download': {'GET': '30/h/user'},
+    'account_login': {'POST': '30/m/ip'},
+    'account_signup': {'POST': '10/m/ip'},
+    'account_reset_password': {'POST': '10/m/ip'},
+}
+
+# Cache request.user between requests (users.backends). Only safe with a cache shared by all workers,
+# since invalidation (e.g. after a password change) must reach every worker
+USER_CACHE_ENABLED = env.bool(
+    'USER_CACHE_ENABLED', default=CACHES['default']['BACKEND'] != 'django.core.cache.backends.locmem.LocMemCache'
+)
+USER_CACHE_ALIAS = 'default'
+USER_CACHE_TIMEOUT = 60 * 60
+
+# Track CustomUser.last_seen (users.activity). Visits are buffered per worker and written in bulk
+# every ACTIVITY_RESOLUTION seconds, which is also how precise last_seen is
+ACTIVITY_TRACKING_ENABLED = env.bool('ACTIVITY_TRACKING_ENABLED', default=True)
+ACTIVITY_RESOLUTION = env.int('ACTIVITY_RESOLUTION', default=5 * 60)
+
+# Readiness probe (/readyz) settings, see core.health
+HEALTHCHECK_TIMEOUT = env.float('HEALTHCHECK_TIMEOUT', default=0.5)
+HEALTHCHECK_CACHE_SECONDS = env.float('HEALTHCHECK_CACHE_SECONDS', default=2.0)
+
+# Prometheus metrics (core.metrics); a directory shared by all Gunicorn workers, empty disables them
+METRICS_DIR = env.str('METRICS_DIR', default='')
+METRICS_ALLOWED_IPS = env.list('METRICS_ALLOWED_IPS', default=['127.0.0.1', '::1'])
+
+# Per-worker memory sampling and recycling (core.memory), run by Gunicorn's post_request hook
+MEMORY_SAMPLE_INTERVAL = env.int('MEMORY_SAMPLE_INTERVAL', default=60)  # seconds, 0 disables sampling
+MEMORY_RSS_LIMIT_MB = env.int('MEMORY_RSS_LIMIT_MB', default=0)  # recycle a worker above this RSS, 0 never
+
+# Slow query sampler (core.querystats); results in the admin and `manage.py querystats`
+QUERYSTATS_ENABLED = env.bool('QUERYSTATS_ENABLED', default=not DEBUG)
+QUERYSTATS_SLOW_MS = env.float('QUERYSTATS_SLOW_MS', default=100.0)
+QUERYSTATS_SAMPLE_SECONDS = 60  # at most one EXPLAIN per fingerprint per worker in this period
+QUERYSTATS_FLUSH_SECONDS = 60  # how often each worker adds its counters to the database
+QUERYSTATS_MAX_FINGERPRINTS = 500  # per worker
+QUERYSTATS_MAX_SAMPLES = 500  # slow query rows kept
+
+# On-demand request profiles (core.profiling); staff get tokens on the admin's Request profiles page
+PROFILE_DIR = env.str('PROFILE_DIR', default=str(BASE_DIR / 'profiles'))
+PROFILE_MAX_BYTES = env.int('PROFILE_MAX_BYTES', default=50 * 1024 * 1024)  # oldest profiles deleted beyond
+PROFILE_TOKEN_MAX_AGE = 60 * 60  # seconds
+
 # Set Django's default user model
 AUTH_USER_MODEL = 'users.CustomUser'
 
@@ -111,11 +186,17 @@ TEMPLATES = [
                 'django.template.context_processors.request',
                 'django.contrib.auth.context_processors.auth',
                 'django.contrib.messages.context_processors.messages',
+                'core.context_processors.site',
+                'core.context_processors.events',
+                'core.context_processors.service_worker',
             ],
         },
     },
 ]
 
+# Part of the ETag of per-user pages (core.conditional); defaults to a hash of the template files
+TEMPLATE_VERSION = env.str('TEMPLATE_VERSION', default='')
+
 WSGI_APPLICATION = 'project.wsgi.application'
 
 # Postgres settings (connection, data integrity & connection handling)
@@ -129,6 +210,42 @@ DATABASES = {
     }
 }
 
+# Deploy-time migration limits (PostgreSQL only, see core/management/commands/migrate.py). A migration that
+# waits longer than MIGRATION_LOCK_TIMEOUT for a table lock is retried (after a rollback, unless it is non-atomic),
+# rather than queueing every query on that table behind it. Check migrations with `manage.py check_migrations`
+MIGRATION_LOCK_TIMEOUT = env.str('MIGRATION_LOCK_TIMEOUT', default='5s')
+MIGRATION_STATEMENT_TIMEOUT = env.str('MIGRATION_STATEMENT_TIMEOUT', default='30min')
+MIGRATION_LOCK_RETRIES = env.int('MIGRATION_LOCK_RETRIES', default=3)
+
+# Server-Sent Events (core.events), served by project.asgi. Publishers hand events to EVENTS_BROADCAST:
+# PostgreSQL NOTIFY reaches every ASGI process, the local stand-in only the publishing one (empty disables).
+# Pages only open streams, and events are only published, with EVENTS_ENABLED: turn it on where an ASGI server
+# serves EVENTS_URL (setup_configs.sh does when uvicorn is installed), or every page view also requests a 404
+EVENTS_ENABLED = env.bool('EVENTS_ENABLED', default=False)
+EVENTS_URL = '/events/'
+EVENTS_BROADCAST = env.str('EVENTS_BROADCAST', default=(
+    'core.events.PostgresBroadcast' if DATABASES['default']['ENGINE'].endswith('postgresql')
+    else 'core.events.LocalBroadcast'
+))
+EVENTS_HEARTBEAT = env.int('EVENTS_HEARTBEAT', default=25)
+EVENTS_MAX_CONNECTIONS = env.int('EVENTS_MAX_CONNECTIONS', default=10000)
+
+# Compression of dynamic responses (core.compression); whitenoise precompresses static files.
+# Levels favour CPU over ratio, since each page is compressed on every request (see bench_compression)
+COMPRESSION_ENABLED = env.bool('COMPRESSION_ENABLED', default=True)
+COMPRESSION_MIN_SIZE = env.int('COMPRESSION_MIN_SIZE', default=860)  # smaller bodies fit one packet anyway
+COMPRESSION_LEVELS = {'br': 4, 'zstd': 3, 'gzip': 6}
+COMPRESSION_MAX_PADDING = 100  # random bytes added to pages with a CSRF token (BREACH)
+
+# Views decorated with core.streaming.early_flush send base.html's <head> before rendering the body
+EARLY_FLUSH_ENABLED = env.bool('EARLY_FLUSH_ENABLED', default=True)
+
+# Service worker at /sw.js (core.serviceworker): precaches these hashed static files (patterns relative to
+# STATIC_ROOT), caches the CDN assets and keeps public pages for repeat visits. Off, it unregisters itself
+SERVICE_WORKER_ENABLED = env.bool('SERVICE_WORKER_ENABLED', default=not DEBUG)
+SERVICE_WORKER_PRECACHE = ['css/*', 'images/favicon.ico', 'images/logo.svg']
+SERVICE_WORKER_CDN_ORIGINS = ['https://cdn.jsdelivr.net']
+
 # Security and Hosts
 ALLOWED_HOSTS = env.list('DJANGO_ALLOWED_HOSTS', default=['localhost', '127.0.0.1'])
 if not DEBUG:
@@ -191,6 +308,20 @@ WHITENOISE_AUTOREFRESH = DEBUG  # Whitenoise will watch for file changes in dev
 # Media settings for storing uploaded data
 MEDIA_ROOT = env('MEDIA_ROOT', default=BASE_DIR / 'media')
 MEDIA_URL = env('MEDIA_URL', default='/media/')
+# Let nginx send media files (core.views.serve_media); see the internal location in setup_configs.sh
+MEDIA_X_ACCEL_REDIRECT = env.bool('MEDIA_X_ACCEL_REDIRECT', default=not DEBUG)
+MEDIA_X_ACCEL_PREFIX = '/protected-media/'
+
+# Uploads stream to temporary files, never into memory, and are skipped past FILE_UPLOAD_MAX_SIZE
+FILE_UPLOAD_HANDLERS = ['core.uploads.LimitedTemporaryFileUploadHandler']
+FILE_UPLOAD_MAX_SIZE = 2 * 1024 * 1024
+AVATAR_MAX_SIZE = FILE_UPLOAD_MAX_SIZE
+AVATAR_THUMBNAIL_SIZE = 128  # pixels, longest side
+
+# Personal data export (users.personal_data). By default the zip is streamed as it is built; with
+# DATA_EXPORT_BACKGROUND it is prepared on a background thread and kept DATA_EXPORT_TTL seconds for resumable downloads
+DATA_EXPORT_BACKGROUND = env.bool('DATA_EXPORT_BACKGROUND', default=False)
+DATA_EXPORT_TTL = env.int('DATA_EXPORT_TTL', default=24 * 60 * 60)
 
 # Default primary key field type
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
@@ -219,7 +350,7 @@ SHOW_TOOLBAR_CALLBACK = lambda request: DEBUG
 EMAIL_BACKEND = env.str('EMAIL_BACKEND', default='django.core.mail.backends.console.EmailBackend')
 
 # Validate email backend configuration
-if EMAIL_BACKEND == 'anymail.backends.mailgun.EmailBackend':
+if EMAIL_BACKEND in ('anymail.backends.mailgun.EmailBackend', 'core.email.MailgunBatchBackend'):
     # Validate Mailgun API credentials only when using Mailgun
     if not env.str('MAILGUN_API_KEY', default=None):
         raise ValueError("MAILGUN_API_KEY environment variable is required when using Mailgun backend")
@@ -232,6 +363,8 @@ if EMAIL_BACKEND == 'anymail.backends.mailgun.EmailBackend':
 ANYMAIL = {
     'MAILGUN_API_KEY': env.str('MAILGUN_API_KEY'),
     'MAILGUN_SENDER_DOMAIN': env.str('MAILGUN_DOMAIN'),  # e.g., sandbox123456.mailgun.org or yourdomain.com
+    'MAILGUN_API_URL': env.str('MAILGUN_API_URL', default='https://api.mailgun.net/v3'),  # or a fake_mailgun server
+    'MAILGUN_BATCH_SIZE': 1000,  # recipients per batch send (core.email.MailgunBatchBackend)
 }
 DEFAULT_FROM_EMAIL = env.str('DEFAULT_FROM_EMAIL')
 # DEFAULT_FROM_EMAIL = f"admin@{env.str('MAILGUN_DOMAIN')}" # For user-facing emails
@@ -2,12 +2,18 @@ from django.conf import settings
 from django.contrib import admin
 from django.urls import path, include
 
+from core.views import serve_media, service_worker
+
+handler429 = 'core.views.rate_limited'  # also used by allauth's rate limits
+
 urlpatterns = [
     path("accounts/", include("allauth.urls")),
     path("admin/", admin.site.urls),
+    path("sw.js", service_worker, name="service_worker"),
     path("i18n/", include("django.conf.urls.i18n")),
     path("", include("core.urls")),
     path("users/", include("users.urls")),
+    path(f"{settings.MEDIA_URL.strip('/')}/<path:path>", serve_media, name="media"),
 ]
 
 if settings.DEBUG:
@@ -12,6 +12,11 @@
 # 2025-04-20: Corrected the import path to project.wsgi:application (not $PROJECT_NAME.wsgi:application)
 # 2025-05-01: Updated Nginx configuration script for proper path to /staticfiles directory.
 # 2025-07-28: Modified Gunicorn service to use environment variable to use .env.prod 
+# 2026-10-18: Add a systemd timer that reaps expired sessions in small batches.
+# 2026-10-19: Serve media from /var/www/media/<project> (survives redeploys) through X-Accel-Redirect.
+# 2026-10-19: Serve /events/ (Server-Sent Events) from an ASGI (uvicorn) service when uvicorn is installed.
+# 2026-10-19: Add a nightly systemd timer that recounts the admin user statistics.
+# 2026-10-19: Set EVENTS_ENABLED only with the events service; remove that service when uvicorn is gone.
 
 
 PROJECT_NAME=$1
@@ -26,6 +31,15 @@ APP_DIR="/var/www/sites/$PROJECT_NAME"
 SOCKET_PATH="/run/$PROJECT_NAME.sock"
 #UV_PATH="/home/$DEPLOY_USER/.local/bin/uv"
 GUNICORN_PATH="$APP_DIR/.venv/bin/gunicorn"
+# Outside APP_DIR, which setup_deploy.sh wipes; must match MEDIA_ROOT in .env.prod
+MEDIA_DIR="/var/www/media/$PROJECT_NAME"
+UVICORN_PATH="$APP_DIR/.venv/bin/uvicorn"
+EVENTS_SOCKET_PATH="/run/$PROJECT_NAME-events/events.sock"
+# Pages only open /events/ streams where the events service below serves them
+EVENTS_ENABLED=False
+if [ -x "$UVICORN_PATH" ]; then
+  EVENTS_ENABLED=True
+fi
 
 echo "🛠️ Generating and deploying Gunicorn and Nginx configs for '$PROJECT_NAME'..."
 
@@ -33,6 +47,9 @@ echo "🛠️ Generating and deploying Gunicorn and Nginx configs for '$PROJECT_
 sudo chown -R $DEPLOY_USER:www-data "$APP_DIR"
 sudo chmod 640 "$APP_DIR/.env.prod"
 sudo chmod 755 "$APP_DIR"
+sudo mkdir -p "$MEDIA_DIR"
+sudo chown -R $DEPLOY_USER:www-data "$MEDIA_DIR"
+sudo chmod 755 "$MEDIA_DIR"
 
 # === Gunicorn socket ===
 cat <<EOF | sudo tee /etc/systemd/system/gunicorn-$PROJECT_NAME.socket > /dev/null
@@ -62,7 +79,12 @@ Group=www-data
 WorkingDirectory=$APP_DIR
 EnvironmentFile=$APP_DIR/.env
 Environment=DJANGO_ENV=prod
+# Per-worker metrics files (core.metrics); systemd empties the directory on every restart
+RuntimeDirectory=$PROJECT_NAME-metrics
+Environment=METRICS_DIR=/run/$PROJECT_NAME-metrics
+Environment=EVENTS_ENABLED=$EVENTS_ENABLED
 ExecStart=$GUNICORN_PATH \\
+          --config $APP_DIR/gunicorn.conf.py \\
           --access-logfile - \\
           --workers 3 \\
           --bind unix:$SOCKET_PATH \\
@@ -72,6 +94,110 @@ ExecStart=$GUNICORN_PATH \\
 WantedBy=multi-user.target
 EOF
 
+# === Server-Sent Events (project.asgi, core.events), only with uvicorn installed (uv add uvicorn) ===
+# One process holds thousands of idle streams; it LISTENs for the events the Gunicorn workers NOTIFY
+EVENTS_LOCATION=""
+if [ "$EVENTS_ENABLED" = True ]; then
+cat <<EOF | sudo tee /etc/systemd/system/events-$PROJECT_NAME.service > /dev/null
+[Unit]
+Description=Server-Sent Events (ASGI) for $PROJECT_NAME
+After=network.target
+
+[Service]
+User=$DEPLOY_USER
+Group=www-data
+WorkingDirectory=$APP_DIR
+EnvironmentFile=$APP_DIR/.env
+Environment=DJANGO_ENV=prod
+Environment=EVENTS_ENABLED=True
+RuntimeDirectory=$PROJECT_NAME-events
+ExecStart=$UVICORN_PATH \\
+          --uds $EVENTS_SOCKET_PATH \\
+          --lifespan off \\
+          --no-access-log \\
+          --timeout-graceful-shutdown 5 \\
+          project.asgi:application
+LimitNOFILE=65536
+Restart=on-failure
+
+[Install]
+WantedBy=multi-user.target
+EOF
+EVENTS_LOCATION="
+    # Long-lived event streams: unbuffered, kept open by heartbeats (EVENTS_HEARTBEAT)
+    location = /events/ {
+        proxy_set_header Host \$http_host;
+        proxy_set_header X-Forwarded-Proto \$scheme;
+        proxy_set_header Connection '';
+        proxy_http_version 1.1;
+        proxy_pass http://unix:$EVENTS_SOCKET_PATH;
+        proxy_buffering off;
+        proxy_read_timeout 1h;
+        access_log off;
+    }
+"
+fi
+
+# === Expired session reaper (batched, time-bounded) ===
+cat <<EOF | sudo tee /etc/systemd/system/reap-sessions-$PROJECT_NAME.service > /dev/null
+[Unit]
+Description=reap expired sessions for $PROJECT_NAME
+
+[Service]
+Type=oneshot
+User=$DEPLOY_USER
+Group=www-data
+WorkingDirectory=$APP_DIR
+EnvironmentFile=$APP_DIR/.env
+Environment=DJANGO_ENV=prod
+ExecStart=$APP_DIR/.venv/bin/python manage.py reap_sessions --batch-size 1000 --time-budget 120
+Nice=10
+IOSchedulingClass=idle
+EOF
+
+cat <<EOF | sudo tee /etc/systemd/system/reap-sessions-$PROJECT_NAME.timer > /dev/null
+[Unit]
+Description=reap expired sessions for $PROJECT_NAME every 15 minutes
+
+[Timer]
+OnCalendar=*:0/15
+RandomizedDelaySec=60
+Persistent=true
+
+[Install]
+WantedBy=timers.target
+EOF
+
+# === Nightly recount of the admin user statistics (users.stats) ===
+cat <<EOF | sudo tee /etc/systemd/system/reconcile-user-stats-$PROJECT_NAME.service > /dev/null
+[Unit]
+Description=reconcile user statistics for $PROJECT_NAME
+
+[Service]
+Type=oneshot
+User=$DEPLOY_USER
+Group=www-data
+WorkingDirectory=$APP_DIR
+EnvironmentFile=$APP_DIR/.env
+Environment=DJANGO_ENV=prod
+ExecStart=$APP_DIR/.venv/bin/python manage.py reconcile_user_stats
+Nice=10
+IOSchedulingClass=idle
+EOF
+
+cat <<EOF | sudo tee /etc/systemd/system/reconcile-user-stats-$PROJECT_NAME.timer > /dev/null
+[Unit]
+Description=reconcile user statistics for $PROJECT_NAME nightly
+
+[Timer]
+OnCalendar=*-*-* 03:30
+RandomizedDelaySec=600
+Persistent=true
+
+[Install]
+WantedBy=timers.target
+EOF
+
 # === Nginx config ===
 NGINX_AVAILABLE="/etc/nginx/sites-available/$PROJECT_NAME"
 NGINX_ENABLED="/etc/nginx/sites-enabled/$PROJECT_NAME"
@@ -87,6 +213,34 @@ server {
     location = /favicon.ico { access_log off; log_not_found off; }
     location = /robots.txt  { access_log off; log_not_found off; }
 
+    # Probes are answered by HealthCheckMiddleware before sessions, CSRF or the database
+    location ~ ^/(healthz|readyz)$ {
+        access_log off;
+        proxy_set_header Host \$http_host;
+        proxy_pass http://unix:$SOCKET_PATH;
+        proxy_read_timeout 5s;
+    }
+
+    location = /metrics {
+        allow 127.0.0.1;
+        deny all;
+        access_log off;
+        proxy_set_header Host \$http_host;
+        proxy_set_header X-Real-IP \$remote_addr;
+        proxy_pass http://unix:$SOCKET_PATH;
+    }
+
+$EVENTS_LOCATION
+    # Avatar uploads (AVATAR_MAX_SIZE) plus form fields
+    client_max_body_size 3m;
+
+    # Media is requested from Django, which answers with X-Accel-Redirect to this internal location
+    location /protected-media/ {
+        internal;
+        alias $MEDIA_DIR/;
+        access_log off;
+    }
+
     location /static/ {
         alias $APP_DIR/staticfiles/;
         access_log off;
@@ -126,10 +280,21 @@ sudo systemctl stop gunicorn-$PROJECT_NAME.service
 sudo rm -f $SOCKET_PATH  # Clean up any existing socket
 sudo systemctl enable gunicorn-$PROJECT_NAME.socket
 sudo systemctl start gunicorn-$PROJECT_NAME.socket
+sudo systemctl enable --now reap-sessions-$PROJECT_NAME.timer
+sudo systemctl enable --now reconcile-user-stats-$PROJECT_NAME.timer
+if [ -n "$EVENTS_LOCATION" ]; then
+  sudo systemctl enable events-$PROJECT_NAME.service
+  sudo systemctl restart events-$PROJECT_NAME.service
+elif [ -f /etc/systemd/system/events-$PROJECT_NAME.service ]; then
+  # uvicorn was removed since the last run
+  sudo systemctl disable --now events-$PROJECT_NAME.service || true
+  sudo rm -f /etc/systemd/system/events-$PROJECT_NAME.service
+  sudo systemctl daemon-reload
+fi
 
 # === Test the socket activation ===
 echo "Testing socket activation..."
-curl --unix-socket $SOCKET_PATH http://localhost/ || echo "Socket test failed, but continuing deployment..."
+curl --fail --unix-socket $SOCKET_PATH http://localhost/readyz || echo "Socket test failed, but continuing deployment..."
 
 # === Test and reload Nginx ===
 sudo nginx -t && sudo systemctl restart nginx
@@ -6,6 +6,7 @@
 # 2025-04-28: Add commands to restart Gunicorn workers and restart Nginx after deployment.
 # 2025-07-28: Modified backup and restore of .env to use .env.prod 
 # 2025-08-06: Parameterized project name and updated call to post_deploy script accordingly.
+# 2026-10-19: Restart the Server-Sent Events service (see setup_configs.sh) when it is installed.
 
 set -e
 set -o pipefail
@@ -78,4 +79,7 @@ fi
 # === Restart services to load new code ===
 sudo systemctl restart gunicorn-$PROJECT_NAME.service
 sudo systemctl restart gunicorn-$PROJECT_NAME.socket
+if systemctl is-enabled --quiet events-$PROJECT_NAME.service 2>/dev/null; then
+  sudo systemctl restart events-$PROJECT_NAME.service
+fi
 sudo systemctl restart nginx
\ No newline at end of file
@@ -0,0 +1,103 @@
+{% if enabled %}// Generated by core.serviceworker. The version changes with the static manifest and the templates.
+const VERSION = '{{ version }}';
+const STATIC_CACHE = `static-${VERSION}`;
+const PAGE_CACHE = `pages-${VERSION}`;
+const CDN_CACHE = 'cdn';  // versioned URLs, kept across deploys
+const PRECACHE = {{ precache|safe }};
+const CDN_ORIGINS = {{ cdn_origins|safe }};
+const CACHE_HEADER = '{{ cache_header }}';
+const ACCOUNTS_URL = '{{ accounts_url|escapejs }}';
+
+self.addEventListener('install', (event) => {
+    event.waitUntil(
+        caches.open(STATIC_CACHE).then((cache) => cache.addAll(PRECACHE)).then(() => self.skipWaiting())
+    );
+});
+
+// Drop the caches of previous deploys
+self.addEventListener('activate', (event) => {
+    const current = [STATIC_CACHE, PAGE_CACHE, CDN_CACHE];
+    event.waitUntil(
+        caches.keys()
+            .then((keys) => Promise.all(keys.filter((key) => !current.includes(key)).map((key) => caches.delete(key))))
+            .then(() => self.clients.claim())
+    );
+});
+
+async function cacheFirst(cacheName, request) {
+    const cache = await caches.open(cacheName);
+    const cached = await cache.match(request);
+    if (cached) {
+        return cached;
+    }
+    const response = await fetch(request);
+    if (response.ok) {
+        cache.put(request, response.clone());
+    }
+    return response;
+}
+
+// Unpoly requests for a fragment are cached apart from the full page
+function pageKey(request) {
+    const target = request.headers.get('X-Up-Target');
+    if (!target) {
+        return request.url;
+    }
+    const url = new URL(request.url);
+    url.searchParams.set('_up_target', target);
+    return url.href;
+}
+
+async function staleWhileRevalidate(event) {
+    const cache = await caches.open(PAGE_CACHE);
+    const key = pageKey(event.request);
+    const cached = await cache.match(key, { ignoreVary: true });
+    const network = fetch(event.request).then((response) => {
+        // Only pages the server marked as the same for every anonymous visitor are kept
+        if (response.ok && response.headers.get(CACHE_HEADER) === 'public') {
+            cache.put(key, response.clone());
+        } else {
+            cache.delete(key);
+        }
+        return response;
+    });
+    event.waitUntil(network.catch(() => null));
+    return cached || network;
+}
+
+self.addEventListener('fetch', (event) => {
+    const request = event.request;
+    const url = new URL(request.url);
+    const sameOrigin = url.origin === self.location.origin;
+    if (request.method !== 'GET') {
+        // Signing in or out, and any other form, may change what the cached pages should show
+        if (sameOrigin) {
+            event.waitUntil(caches.delete(PAGE_CACHE));
+        }
+        return;
+    }
+    if (CDN_ORIGINS.includes(url.origin)) {
+        event.respondWith(cacheFirst(CDN_CACHE, request));
+    } else if (!sameOrigin) {
+        return;
+    } else if (PRECACHE.includes(url.pathname)) {
+        event.respondWith(cacheFirst(STATIC_CACHE, request));
+    } else if (url.pathname.startsWith(ACCOUNTS_URL)) {
+        if (request.mode === 'navigate') {
+            event.waitUntil(caches.delete(PAGE_CACHE));
+        }
+    } else if (request.mode === 'navigate' || request.headers.has('X-Up-Target')) {
+        event.respondWith(staleWhileRevalidate(event));
+    }
+});
+{% else %}// The service worker is disabled (SERVICE_WORKER_ENABLED): remove its caches and unregister it.
+self.addEventListener('install', () => self.skipWaiting());
+
+self.addEventListener('activate', (event) => {
+    event.waitUntil(
+        caches.keys()
+            .then((keys) => Promise.all(keys.map((key) => caches.delete(key))))
+            .then(() => self.registration.unregister())
+    );
+});
+{% endif %}
@@ -16,10 +16,19 @@ sudo systemctl stop gunicorn-$PROJECT_NAME.service || true
 sudo systemctl stop gunicorn-$PROJECT_NAME.socket || true
 sudo systemctl disable gunicorn-$PROJECT_NAME.service || true
 sudo systemctl disable gunicorn-$PROJECT_NAME.socket || true
+sudo systemctl disable --now reap-sessions-$PROJECT_NAME.timer || true
+sudo systemctl disable --now reconcile-user-stats-$PROJECT_NAME.timer || true
+sudo systemctl stop events-$PROJECT_NAME.service || true
+sudo systemctl disable events-$PROJECT_NAME.service || true
 
 echo "🧹 Removing Gunicorn systemd unit files..."
 sudo rm -f /etc/systemd/system/gunicorn-$PROJECT_NAME.service
 sudo rm -f /etc/systemd/system/gunicorn-$PROJECT_NAME.socket
+sudo rm -f /etc/systemd/system/reap-sessions-$PROJECT_NAME.service
+sudo rm -f /etc/systemd/system/reap-sessions-$PROJECT_NAME.timer
+sudo rm -f /etc/systemd/system/reconcile-user-stats-$PROJECT_NAME.service
+sudo rm -f /etc/systemd/system/reconcile-user-stats-$PROJECT_NAME.timer
+sudo rm -f /etc/systemd/system/events-$PROJECT_NAME.service
 
 echo "🧼 Cleaning up leftover socket file..."
 sudo rm -f /run/$PROJECT_NAME.sock
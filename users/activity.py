@@ -0,0 +1,138 @@
+"""
+Write-coalesced "last seen" tracking for ``CustomUser.last_seen``.
+
+``ActivityMiddleware`` only stores ``user_id -> time`` in a per-worker buffer,
+and at most once per user every ``ACTIVITY_RESOLUTION`` seconds. Every
+``ACTIVITY_RESOLUTION`` seconds the buffer is handed to a background thread,
+which writes all of it with one ``UPDATE ... FROM (VALUES ...)`` per
+``BATCH_SIZE`` users. A request never waits for a write. Timestamps only move
+forward, so workers flushing out of order cannot turn a user's time back.
+A worker that is killed loses at most one period; gunicorn's ``worker_exit``
+hook flushes the rest on a graceful exit.
+
+The flush does not invalidate cached users (``users.backends``), which would
+empty the cache of every active user each period, so ``request.user.last_seen``
+may lag behind the database.
+"""
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connections, transaction
+from django.db.models import Case, F, Value, When
+from django.db.models.functions import Coalesce, Greatest
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = 1000
+
+_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='activity')
+
+
+class ActivityBuffer:
+    """Per-process ``user_id -> last seen`` map, drained by the flusher."""
+
+    def __init__(self):
+        self.pending = {}
+        self.recorded = {}  # user_id -> monotonic time of the last buffered visit
+        self.lock = threading.Lock()
+        self.flushed_at = time.monotonic()
+
+    def record(self, user_id, seen, now, resolution):
+        """Buffer a visit unless the user was already buffered within ``resolution`` seconds."""
+        with self.lock:
+            if now - self.recorded.get(user_id, float('-inf')) < resolution:
+                return False
+            self.recorded[user_id] = now
+            self.pending[user_id] = seen
+            return True
+
+    def should_flush(self, now, interval):
+        with self.lock:
+            if now - self.flushed_at < interval:
+                return False
+            self.flushed_at = now
+            # Forget users not seen for a whole period, so the map stays as small as the active set
+            self.recorded = {user_id: at for user_id, at in self.recorded.items() if now - at < interval}
+            return True
+
+    def drain(self):
+        with self.lock:
+            pending, self.pending = self.pending, {}
+        return pending
+
+
+_buffer = ActivityBuffer()
+
+
+def get_buffer():
+    return _buffer
+
+
+def record(user):
+    """Note that ``user`` was active now; never touches the database."""
+    resolution = settings.ACTIVITY_RESOLUTION
+    seen = timezone.now()
+    if user.last_seen is not None and seen - user.last_seen < timedelta(seconds=resolution):
+        return
+    now = time.monotonic()
+    buffer = get_buffer()
+    buffer.record(user.pk, seen, now, resolution)
+    if buffer.should_flush(now, resolution):
+        submit(buffer.drain())
+
+
+def submit(pending):
+    if not pending:
+        return
+
+    def run():
+        try:
+            flush(pending)
+        except Exception:
+            logger.exception("Flushing last_seen for %d users failed", len(pending))
+        finally:
+            connections['default'].close_if_unusable_or_obsolete()
+
+    _executor.submit(run)
+
+
+def flush(pending):
+    """Write ``{user_id: seen}`` to ``last_seen``, keeping any later value already stored."""
+    from .models import CustomUser
+
+    items = sorted(pending.items())  # a stable row order keeps concurrent flushes from deadlocking
+    connection = connections['default']
+    with transaction.atomic():
+        for start in range(0, len(items), BATCH_SIZE):
+            batch = items[start:start + BATCH_SIZE]
+            if connection.vendor == 'postgresql':
+                update_from_values(connection, CustomUser, batch)
+            else:
+                CustomUser.objects.filter(pk__in=[user_id for user_id, _ in batch]).update(last_seen=Case(*(
+                    When(pk=user_id, then=Greatest(Coalesce(F('last_seen'), Value(seen)), Value(seen)))
+                    for user_id, seen in batch
+                )))
+
+
+def update_from_values(connection, model, batch):
+    quote = connection.ops.quote_name
+    table = quote(model._meta.db_table)
+    pk = quote(model._meta.pk.column)
+    column = quote(model._meta.get_field('last_seen').column)
+    values = ', '.join(['(%s::bigint, %s::timestamptz)'] * len(batch))
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"UPDATE {table} AS u SET {column} = v.seen FROM (VALUES {values}) AS v(id, seen) "
+            f"WHERE u.{pk} = v.id AND (u.{column} IS NULL OR u.{column} < v.seen)",
+            [value for row in batch for value in row],
+        )
+
+
+def flush_now():
+    """Write this worker's buffer synchronously (for shutdown hooks and tests)."""
+    flush(get_buffer().drain())
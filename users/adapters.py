@@ -0,0 +1,23 @@
+"""
+allauth account adapter for per-site email subjects and account change events.
+
+Enable with ``ACCOUNT_ADAPTER = 'users.adapters.AccountAdapter'``.
+"""
+from allauth.account.adapter import DefaultAccountAdapter
+from allauth.core import context
+from django.utils.encoding import force_str
+
+from core import events
+from core.sites import get_site
+
+
+class AccountAdapter(DefaultAccountAdapter):
+
+    def format_email_subject(self, subject):
+        """Prefix the subject with the name of the site the request came in on, e.g. ``"Acme: "``."""
+        return f'{get_site(context.request).name}: {force_str(subject)}'
+
+    def send_notification_mail(self, template_prefix, user, context=None, email=None):
+        """Tell the user's open pages about the change too (``account`` event, see core.events)."""
+        events.publish([user.pk], 'account', {'reason': template_prefix.rsplit('/', 1)[-1]})
+        super().send_notification_mail(template_prefix, user, context=context, email=email)
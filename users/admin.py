@@ -1,6 +1,19 @@
-from django.contrib import admin
+from allauth.account.models import EmailAddress
+from django.contrib import admin, messages
+from django.contrib.admin import helpers
+from django.contrib.admin.utils import model_ngettext
 from django.contrib.auth.admin import UserAdmin
+from django.core.exceptions import PermissionDenied
+from django.http import HttpResponseBadRequest
+from django.template.response import TemplateResponse
+from django.urls import path
+from django.utils.translation import gettext as _, gettext_lazy
 
+from core.models import Session
+
+from . import stats
+from .bulk import bulk_delete, bulk_update
+from .export import FORMATS, parse_fields, stream_export
 from .forms import CustomUserCreationForm, CustomUserChangeForm
 from .models import CustomUser
 
@@ -17,10 +30,138 @@ class CustomUserAdmin(UserAdmin):
     add_form = CustomUserCreationForm
     form = CustomUserChangeForm
     model = CustomUser
-    list_display = ['email', 'username', 'is_staff', 'is_active']
-    list_filter = ['email', 'is_staff', 'is_active', ]
+    list_display = ['email', 'username', 'is_staff', 'is_active', 'last_seen']
+    list_filter = ['email', 'is_staff', 'is_active', 'last_seen']
+    readonly_fields = ['last_seen']
+    fieldsets = UserAdmin.fieldsets[:-1] + (
+        (gettext_lazy('Important dates'), {'fields': ('last_login', 'last_seen', 'date_joined')}),
+    )
     search_fields = ['email']
     ordering = ['email']
+    actions = [
+        'activate_users', 'deactivate_users', 'grant_staff', 'revoke_staff', 'delete_selected',
+        'export_csv', 'export_jsonl',
+    ]
+    change_list_template = 'admin/users/customuser/change_list.html'
+
+    def get_urls(self):
+        return [
+            path('export/', self.admin_site.admin_view(self.export_view), name='users_customuser_export'),
+            path('stats/', self.admin_site.admin_view(self.stats_view), name='users_customuser_stats'),
+        ] + super().get_urls()
+
+    def export_view(self, request):
+        """Stream the changelist (with its filters and search applied) as CSV or JSON Lines"""
+        if not self.has_view_permission(request):
+            raise PermissionDenied
+        params = request.GET.copy()
+        export_format = params.pop('format', ['csv'])[-1]
+        if export_format not in FORMATS:
+            return HttpResponseBadRequest('Unknown export format')
+        try:
+            fields = parse_fields(params.pop('fields', [''])[-1])
+        except ValueError as error:
+            return HttpResponseBadRequest(str(error))
+        # The changelist treats every query parameter as a filter, so hand it only the filters
+        request.GET = params
+        queryset = self.get_changelist_instance(request).get_queryset(request)
+        return stream_export(queryset, export_format, fields)
+
+    def stats_view(self, request):
+        """Dashboard read from the summary tables only (users.stats), never from the users themselves"""
+        if not self.has_view_permission(request):
+            raise PermissionDenied
+        totals, history = stats.dashboard()
+        context = {
+            **self.admin_site.each_context(request),
+            'title': _("User statistics"),
+            'opts': self.opts,
+            'totals': totals,
+            'history': history,
+            'window': {
+                field: sum(getattr(day, field) for day in history)
+                for field in ('signups', 'verifications', 'logins', 'deletions')
+            },
+            'peak_signups': max(day.signups for day in history) or 1,
+        }
+        request.current_app = self.admin_site.name
+        return TemplateResponse(request, 'admin/users/customuser/stats.html', context)
+
+    def bulk_update_action(self, request, queryset, values, exclude_self=False):
+        """Apply ``values`` to the selection with set-based UPDATEs and report the count"""
+        if exclude_self:
+            queryset = queryset.exclude(pk=request.user.pk)
+        count = bulk_update(queryset, values, request.user.pk)
+        self.message_user(
+            request,
+            _("Successfully updated %(count)d %(items)s.") % {
+                'count': count, 'items': model_ngettext(self.opts, count),
+            },
+            messages.SUCCESS,
+        )
+
+    @admin.action(description='Activate selected users', permissions=['change'])
+    def activate_users(self, request, queryset):
+        self.bulk_update_action(request, queryset, {'is_active': True})
+
+    @admin.action(description='Deactivate selected users', permissions=['change'])
+    def deactivate_users(self, request, queryset):
+        self.bulk_update_action(request, queryset, {'is_active': False}, exclude_self=True)
+
+    @admin.action(description='Grant staff status to selected users', permissions=['change'])
+    def grant_staff(self, request, queryset):
+        self.bulk_update_action(request, queryset, {'is_staff': True})
+
+    @admin.action(description='Revoke staff status from selected users', permissions=['change'])
+    def revoke_staff(self, request, queryset):
+        self.bulk_update_action(request, queryset, {'is_staff': False}, exclude_self=True)
+
+    @admin.action(description=gettext_lazy('Delete selected %(verbose_name_plural)s'), permissions=['delete'])
+    def delete_selected(self, request, queryset):
+        """
+        Replace Django's delete_selected, which collects and lists every related
+        object, with a count-only confirmation and batched DELETEs.
+        The acting user is never deleted.
+        """
+        queryset = queryset.exclude(pk=request.user.pk)
+        if request.POST.get('post'):
+            count = bulk_delete(queryset, request.user.pk)
+            self.message_user(
+                request,
+                _("Successfully deleted %(count)d %(items)s.") % {
+                    'count': count, 'items': model_ngettext(self.opts, count),
+                },
+                messages.SUCCESS,
+            )
+            # Return None to display the change list page again
+            return None
+        count = queryset.count()
+        context = {
+            **self.admin_site.each_context(request),
+            'title': _("Delete multiple objects"),
+            'subtitle': None,
+            'opts': self.opts,
+            'objects_name': str(model_ngettext(self.opts, count)),
+            'count': count,
+            'email_count': EmailAddress.objects.filter(user__in=queryset).count(),
+            'session_count': Session.objects.filter(user_id__in=queryset.values('pk')).count(),
+            # With "select all" the changelist filters in the URL define the selection, and the
+            # checkboxes only hold the current page, so no primary key list is materialized
+            'select_across': request.POST.get('select_across') == '1',
+            'selected': request.POST.getlist(helpers.ACTION_CHECKBOX_NAME),
+            'action_checkbox_name': helpers.ACTION_CHECKBOX_NAME,
+            'media': self.media,
+        }
+        request.current_app = self.admin_site.name
+        return TemplateResponse(request, 'admin/users/customuser/bulk_delete_confirmation.html', context)
+
+    @admin.action(description='Export selected users as CSV', permissions=['view'])
+    def export_csv(self, request, queryset):
+        return stream_export(queryset, 'csv')
+
+    @admin.action(description='Export selected users as JSON Lines', permissions=['view'])
+    def export_jsonl(self, request, queryset):
+        return stream_export(queryset, 'jsonl')
 
 
 admin.site.register(CustomUser, CustomUserAdmin)
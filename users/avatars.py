@@ -0,0 +1,156 @@
+"""
+Profile avatars: validation, content-addressed storage and thumbnails.
+
+Avatars are stored as ``avatars/<xx>/<sha256>.<ext>``. Identical uploads share
+one file and the name never changes for given content, so the files can be
+cached forever. Thumbnails are generated after the request commits, on a
+background thread, and need Pillow (``uv add pillow``). Without it, pages show
+the original image.
+"""
+import hashlib
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+from pathlib import PurePosixPath
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.core.files.base import ContentFile
+from django.core.files.storage import FileSystemStorage
+from django.db import connections, transaction
+from django.template.defaultfilters import filesizeformat
+from django.utils import timezone
+from django.utils.translation import gettext as _
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # thumbnails are optional
+    Image = ImageOps = None
+
+logger = logging.getLogger(__name__)
+
+# Leading bytes of the accepted image formats, checked instead of the client's Content-Type
+SIGNATURES = [
+    (b'\xff\xd8\xff', 'jpg'),
+    (b'\x89PNG\r\n\x1a\n', 'png'),
+    (b'GIF87a', 'gif'),
+    (b'GIF89a', 'gif'),
+]
+
+_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='avatars')
+
+
+class ContentAddressedStorage(FileSystemStorage):
+    """File storage where a name identifies its content: saving an existing name reuses the file."""
+
+    def get_available_name(self, name, max_length=None):
+        return name
+
+    def _save(self, name, content):
+        if self.exists(name):
+            return name
+        return super()._save(name, content)
+
+
+avatar_storage = ContentAddressedStorage()
+
+
+def get_avatar_storage():
+    return avatar_storage
+
+
+def image_extension(file):
+    """Return the extension for the image format of ``file`` by its magic bytes, or None."""
+    file.seek(0)
+    header = file.read(12)
+    file.seek(0)
+    if header[:4] == b'RIFF' and header[8:12] == b'WEBP':
+        return 'webp'
+    for signature, extension in SIGNATURES:
+        if header.startswith(signature):
+            return extension
+    return None
+
+
+def too_large_error(max_size):
+    return ValidationError(
+        _('The image is too large. The maximum size is %(size)s.'),
+        params={'size': filesizeformat(max_size)},
+        code='file_too_large',
+    )
+
+
+def validate_avatar(file):
+    if file.size > settings.AVATAR_MAX_SIZE:
+        raise too_large_error(settings.AVATAR_MAX_SIZE)
+    if image_extension(file) is None:
+        raise ValidationError(_('Upload a JPEG, PNG, GIF or WebP image.'), code='invalid_image')
+
+
+def avatar_upload_to(instance, filename):
+    """Name the uploaded avatar after the SHA-256 of its content, read in chunks."""
+    file = instance.avatar.file
+    digest = hashlib.sha256()
+    for chunk in file.chunks():
+        digest.update(chunk)
+    hexdigest = digest.hexdigest()
+    return f'avatars/{hexdigest[:2]}/{hexdigest}.{image_extension(file)}'
+
+
+def thumbnail_name(avatar_name):
+    stem = PurePosixPath(avatar_name).stem
+    return f'avatars/thumbs/{stem[:2]}/{stem}-{settings.AVATAR_THUMBNAIL_SIZE}.webp'
+
+
+def render_thumbnail(source):
+    """Return WebP bytes of ``source`` scaled to fit ``AVATAR_THUMBNAIL_SIZE``."""
+    size = settings.AVATAR_THUMBNAIL_SIZE
+    with Image.open(source) as image:
+        image = ImageOps.exif_transpose(image)
+        image.thumbnail((size, size))
+        if image.mode not in ('RGB', 'RGBA'):
+            image = image.convert('RGBA')
+        buffer = BytesIO()
+        image.save(buffer, 'WEBP', quality=85)
+    return buffer.getvalue()
+
+
+def make_thumbnail(user_id):
+    """Create the user's avatar thumbnail (shared by identical avatars) and record it on the user."""
+    from .backends import invalidate
+    from .models import CustomUser
+
+    user = CustomUser.objects.filter(pk=user_id).only('avatar').first()
+    if user is None or not user.avatar:
+        return None
+    if Image is None:
+        logger.info("Pillow is not installed, serving avatars without thumbnails")
+        return None
+    name = thumbnail_name(user.avatar.name)
+    if not avatar_storage.exists(name):
+        try:
+            with avatar_storage.open(user.avatar.name) as source:
+                content = render_thumbnail(source)
+        except (OSError, Image.DecompressionBombError) as error:
+            logger.warning("Cannot create a thumbnail for %s: %s", user.avatar.name, error)
+            return None
+        avatar_storage.save(name, ContentFile(content))
+    # Only record the thumbnail if the avatar has not been replaced meanwhile
+    if CustomUser.objects.filter(pk=user_id, avatar=user.avatar.name).update(
+        avatar_thumbnail=name, updated_at=timezone.now(),
+    ):
+        invalidate([user_id])
+    return name
+
+
+def schedule_thumbnail(user_id):
+    """Generate the thumbnail on the background thread once the current transaction commits."""
+    def run():
+        try:
+            make_thumbnail(user_id)
+        except Exception:
+            logger.exception("Avatar thumbnail for user %s failed", user_id)
+        finally:
+            connections['default'].close_if_unusable_or_obsolete()
+
+    transaction.on_commit(lambda: _executor.submit(run))
@@ -0,0 +1,94 @@
+"""
+Authentication backends that resolve ``request.user`` from the cache.
+
+On every authenticated request Django's ``get_user()`` asks the session's
+backend for the user by primary key, which costs a SELECT. These backends
+keep the row's field values in the cache next to a per-user version, read
+together with one ``get_many``. Django still compares the session auth hash
+(derived from the cached password hash) afterwards, so changing the password
+logs out other sessions as before.
+
+Every change bumps the user's version (see ``users.signals``): save, delete,
+``touch()``, bulk admin updates and group or permission changes. The bump
+happens immediately and again after the transaction commits, so a
+concurrent request cannot cache the row from before the commit under the
+new version.
+"""
+import uuid
+from functools import cache
+
+from allauth.account.auth_backends import AuthenticationBackend
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.auth.backends import ModelBackend
+from django.core.cache import caches
+from django.db import transaction
+
+
+def entry_key(user_id):
+    return f'users:user:{user_id}'
+
+
+def version_key(user_id):
+    return f'users:user-version:{user_id}'
+
+
+@cache
+def field_names():
+    return tuple(field.attname for field in get_user_model()._meta.concrete_fields)
+
+
+def get_cache():
+    return caches[settings.USER_CACHE_ALIAS]
+
+
+def bump_versions(user_ids):
+    """Give each user a new random version, orphaning their cached entries."""
+    user_ids = list(user_ids)
+    if user_ids:
+        get_cache().set_many({version_key(pk): uuid.uuid4().hex for pk in user_ids}, settings.USER_CACHE_TIMEOUT)
+
+
+def invalidate(user_ids):
+    """Invalidate cached users now and again once the current transaction commits."""
+    if not settings.USER_CACHE_ENABLED:
+        return
+    user_ids = list(user_ids)
+    bump_versions(user_ids)
+    transaction.on_commit(lambda: bump_versions(user_ids))
+
+
+class CachedUserMixin:
+    """Override ``get_user`` of a ModelBackend subclass to read through the cache."""
+
+    def get_user(self, user_id):
+        if not settings.USER_CACHE_ENABLED:
+            return super().get_user(user_id)
+        UserModel = get_user_model()
+        cache = get_cache()
+        keys = version_key(user_id), entry_key(user_id)
+        values = cache.get_many(keys)
+        version = values.get(keys[0])
+        if version is None:
+            version = uuid.uuid4().hex
+            # add() so a concurrent bump is not overwritten
+            if not cache.add(keys[0], version, settings.USER_CACHE_TIMEOUT):
+                version = cache.get(keys[0], version)
+        entry = values.get(keys[1])
+        names = field_names()
+        if entry is not None and entry[0] == version and entry[1] == names:
+            user = UserModel.from_db(UserModel._default_manager.db, names, entry[2])
+            return user if self.user_can_authenticate(user) else None
+        user = super().get_user(user_id)
+        if user is not None:
+            cache.set(keys[1], (version, names, tuple(getattr(user, name) for name in names)),
+                      settings.USER_CACHE_TIMEOUT)
+        return user
+
+
+class CachedModelBackend(CachedUserMixin, ModelBackend):
+    pass
+
+
+class CachedAuthenticationBackend(CachedUserMixin, AuthenticationBackend):
+    pass
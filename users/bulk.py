@@ -0,0 +1,76 @@
+"""
+Set-based bulk operations on CustomUser for admin actions.
+
+Selections are walked in primary key order ``batch_size`` rows at a time
+(keyset pagination), so "select all matching" never loads the full primary
+key list. Each batch is one UPDATE or DELETE, one bulk insert of admin
+LogEntry rows and one ``users_updated``/``users_deleted`` signal, instead of
+a save(), log entry and signal per user.
+"""
+from django.contrib.admin.models import CHANGE, DELETION, LogEntry
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from core.models import Session
+
+from . import stats
+from .signals import users_deleted, users_updated
+
+DEFAULT_BATCH_SIZE = 1000
+
+
+def iter_batches(queryset, batch_size=DEFAULT_BATCH_SIZE):
+    """Yield lists of users (pk and username only) from ``queryset`` in primary key order."""
+    queryset = queryset.order_by('pk').only('pk', 'username')
+    last_pk = None
+    while True:
+        page = queryset if last_pk is None else queryset.filter(pk__gt=last_pk)
+        batch = list(page[:batch_size])
+        if not batch:
+            return
+        yield batch
+        last_pk = batch[-1].pk
+
+
+def bulk_update(queryset, values, user_id, batch_size=DEFAULT_BATCH_SIZE):
+    """
+    Set ``values`` on every user in ``queryset`` and return the number changed.
+
+    Users that already have the values are skipped, so they are neither
+    touched nor logged. ``updated_at`` is bumped to invalidate cached pages.
+    """
+    model = queryset.model
+    differs = Q()
+    for field, value in values.items():
+        differs |= ~Q(**{field: value})
+    change_message = [{'changed': {'fields': [str(model._meta.get_field(field).verbose_name) for field in values]}}]
+    updated = 0
+    for batch in iter_batches(queryset.filter(differs), batch_size):
+        pks = [user.pk for user in batch]
+        with transaction.atomic():
+            updated += model.objects.filter(pk__in=pks).update(updated_at=timezone.now(), **values)
+            LogEntry.objects.log_actions(user_id, batch, CHANGE, change_message)
+        users_updated.send(sender=model, pks=pks, values=values)
+    return updated
+
+
+def bulk_delete(queryset, user_id, batch_size=DEFAULT_BATCH_SIZE):
+    """
+    Delete every user in ``queryset`` along with their sessions, and return the number deleted.
+
+    Each batch is logged and deleted in its own transaction, so locks are
+    held briefly and an interrupted run leaves only whole batches deleted.
+    """
+    model = queryset.model
+    deleted = 0
+    for batch in iter_batches(queryset, batch_size):
+        pks = [user.pk for user in batch]
+        with transaction.atomic():
+            LogEntry.objects.log_actions(user_id, batch, DELETION)
+            Session.objects.filter(user_id__in=pks).delete()
+            with stats.deleting(pks):
+                _, per_model = model.objects.filter(pk__in=pks).delete()
+            deleted += per_model.get(model._meta.label, 0)
+        users_deleted.send(sender=model, pks=pks)
+    return deleted
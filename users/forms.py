@@ -1,8 +1,10 @@
 from django import forms
+from django.conf import settings
 from django.contrib.auth.forms import UserCreationForm, UserChangeForm
 from django.urls import reverse
 from django.utils.html import format_html
 
+from .avatars import too_large_error, validate_avatar
 from .models import CustomUser
 
 
@@ -37,7 +39,7 @@ class UserProfileForm(forms.ModelForm):
 
     class Meta:
         model = CustomUser
-        fields = ['first_name', 'last_name', 'email', 'display_name']
+        fields = ['first_name', 'last_name', 'email', 'display_name', 'avatar']
         widgets = {
             'first_name': forms.TextInput(attrs={
                 'class': 'form-control',
@@ -57,21 +59,39 @@ class UserProfileForm(forms.ModelForm):
                 'class': 'form-control',
                 'placeholder': 'Display Name (optional)',
             }),
+            'avatar': forms.ClearableFileInput(attrs={
+                'class': 'form-control',
+                'accept': 'image/jpeg,image/png,image/gif,image/webp',
+            }),
         }
 
         help_texts = {
             'display_name': 'Leave blank to automatically use your full name.'
         }
 
-    def __init__(self, *args, **kwargs):
+    def __init__(self, *args, oversized_uploads=(), **kwargs):
         """
         Initialize the form and set dynamic help text for the email field.
+
+        ``oversized_uploads`` names the file fields whose upload was skipped
+        for exceeding FILE_UPLOAD_MAX_SIZE (``request.oversized_uploads``).
         """
         super().__init__(*args, **kwargs)
+        self.oversized_uploads = oversized_uploads
         self.fields['email'].help_text = format_html(
             'To change your email, use the <a href="{}">Email management page</a>.',
             reverse('account_email')
         )
+        # Checked on the upload (size and magic bytes), not on the stored file
+        self.fields['avatar'].validators.append(validate_avatar)
+
+    def clean(self):
+        cleaned_data = super().clean()
+        # The upload handler dropped these files, so the field validators never saw them
+        for name in self.oversized_uploads:
+            if name in self.fields:
+                self.add_error(name, too_large_error(settings.FILE_UPLOAD_MAX_SIZE))
+        return cleaned_data
 
     def clean_email(self):
         """Prevent email from being changed via this form"""
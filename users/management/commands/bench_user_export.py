@@ -0,0 +1,64 @@
+import resource
+import sys
+import time
+
+from django.core.management.base import BaseCommand
+
+from users.export import DEFAULT_CHUNK_SIZE, EXPORT_FIELDS, iter_csv, iter_jsonl
+from users.models import CustomUser
+
+BENCH_PREFIX = 'bench-export-'
+
+
+def peak_rss_mb():
+    """Peak resident set size of this process in MB (ru_maxrss is KB on Linux, bytes on macOS)."""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+class Command(BaseCommand):
+    help = 'Benchmark the streaming user export (rows/sec and peak RSS)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--format', choices=['csv', 'jsonl'], default='csv')
+        parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE)
+        parser.add_argument('--create', type=int, default=0,
+                            help=f'Bulk create this many synthetic users ({BENCH_PREFIX}*) before measuring')
+        parser.add_argument('--cleanup', action='store_true', help='Delete the synthetic users afterwards')
+
+    def handle(self, *args, **options):
+        if options['create']:
+            self.create_users(options['create'])
+        rss_before = peak_rss_mb()
+        generator = iter_csv if options['format'] == 'csv' else iter_jsonl
+        rows = size = 0
+        started = time.perf_counter()
+        for line in generator(CustomUser.objects.all(), EXPORT_FIELDS, options['chunk_size']):
+            rows += 1
+            size += len(line)
+        elapsed = time.perf_counter() - started
+        self.stdout.write(self.style.SUCCESS(
+            f'{rows:,} lines, {size / 1e6:.1f} MB in {elapsed:.2f} s '
+            f'({rows / elapsed:,.0f} rows/s); peak RSS {peak_rss_mb():.1f} MB '
+            f'(was {rss_before:.1f} MB before the export)'
+        ))
+        if options['cleanup']:
+            deleted, _ = CustomUser.objects.filter(username__startswith=BENCH_PREFIX).delete()
+            self.stdout.write(f'Deleted {deleted} synthetic rows')
+
+    def create_users(self, count):
+        existing = CustomUser.objects.filter(username__startswith=BENCH_PREFIX).count()
+        users = (
+            CustomUser(
+                username=f'{BENCH_PREFIX}{i}',
+                email=f'{BENCH_PREFIX}{i}@example.com',
+                first_name='Bench',
+                last_name=str(i),
+                display_name=f'Bench {i}',
+            )
+            for i in range(existing, existing + count)
+        )
+        created = 0
+        while batch := [user for _, user in zip(range(5000), users)]:
+            created += len(CustomUser.objects.bulk_create(batch))
+        self.stdout.write(f'Created {created:,} synthetic users')
@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+
+from users.avatars import make_thumbnail
+from users.models import CustomUser
+
+
+class Command(BaseCommand):
+    help = 'Create missing avatar thumbnails (e.g. after installing Pillow or a worker restart)'
+
+    def handle(self, *args, **options):
+        pending = CustomUser.objects.exclude(avatar='').filter(avatar_thumbnail='').values_list('pk', flat=True)
+        created = 0
+        for user_id in pending.iterator():
+            if make_thumbnail(user_id):
+                created += 1
+        self.stdout.write(self.style.SUCCESS(f'Created or linked {created} avatar thumbnails'))
@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from users.stats import DEFAULT_RECONCILE_DAYS, reconcile
+
+
+class Command(BaseCommand):
+    help = 'Recount the user totals and recent signups behind the admin statistics (run nightly from a systemd timer)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=DEFAULT_RECONCILE_DAYS,
+                            help='Check the signups of this many recent days; use a large value once to backfill '
+                                 '(default: %(default)s)')
+
+    def handle(self, *args, **options):
+        totals, changed = reconcile(options['days'])
+        self.stdout.write(self.style.SUCCESS(
+            f"{totals['users']} users, {totals['active_users']} active, {totals['verified_users']} verified; "
+            f"corrected signups on {changed} of the last {options['days']} days"
+        ))
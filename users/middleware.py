@@ -0,0 +1,26 @@
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+
+from . import activity
+
+
+class ActivityMiddleware:
+    """
+    Buffer the time each signed-in user was last seen (see users.activity).
+
+    Nothing is written on the request path: visits go to a per-worker buffer
+    that a background thread flushes with one bulk UPDATE. Place it below
+    AuthenticationMiddleware. Disabled by ``ACTIVITY_TRACKING_ENABLED``.
+    """
+
+    def __init__(self, get_response):
+        if not settings.ACTIVITY_TRACKING_ENABLED:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        response = self.get_response(request)
+        # Without a session cookie nobody is signed in, so skip loading the session
+        if settings.SESSION_COOKIE_NAME in request.COOKIES and request.user.is_authenticated:
+            activity.record(request.user)
+        return response
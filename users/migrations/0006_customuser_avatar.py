@@ -0,0 +1,24 @@
+# Generated by Django 6.0.1 on 2026-10-19 00:10
+
+import users.avatars
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0005_customuser_updated_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='customuser',
+            name='avatar',
+            field=models.FileField(blank=True, help_text='Profile picture, stored under a hash of its content', max_length=200, storage=users.avatars.get_avatar_storage, upload_to=users.avatars.avatar_upload_to, verbose_name='avatar'),
+        ),
+        migrations.AddField(
+            model_name='customuser',
+            name='avatar_thumbnail',
+            field=models.FileField(blank=True, editable=False, help_text='Set in the background after the avatar changes (see users.avatars)', max_length=200, storage=users.avatars.get_avatar_storage, upload_to='', verbose_name='avatar thumbnail'),
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 6.0.1 on 2026-10-19 00:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auth', '0012_alter_user_first_name_max_length'),
+        ('users', '0006_customuser_avatar'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='customuser',
+            name='last_seen',
+            field=models.DateTimeField(blank=True, editable=False, help_text='Last signed-in request, to within ACTIVITY_RESOLUTION (see users.activity)', null=True, verbose_name='last seen'),
+        ),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 6.0.1 on 2026-10-19 00:20
+
+import core.operations
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    # The index is built with CREATE INDEX CONCURRENTLY, which cannot run in a transaction. It has a migration
+    # of its own because a non-atomic migration runs again from the start when migrate retries it
+    atomic = False
+
+    dependencies = [
+        ('users', '0007_customuser_last_seen'),
+    ]
+
+    operations = [
+        core.operations.AddIndexConcurrently(
+            model_name='customuser',
+            index=models.Index(fields=['last_seen'], name='users_last_seen_idx'),
+        ),
+    ]
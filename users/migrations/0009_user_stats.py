@@ -0,0 +1,42 @@
+# Generated by Django 6.0.1 on 2026-10-19 09:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0008_customuser_last_seen_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailyUserStats',
+            fields=[
+                ('date', models.DateField(primary_key=True, serialize=False, verbose_name='date')),
+                ('signups', models.PositiveIntegerField(default=0, verbose_name='signups')),
+                ('verifications', models.PositiveIntegerField(default=0, verbose_name='email verifications')),
+                ('logins', models.PositiveIntegerField(default=0, verbose_name='logins')),
+                ('deletions', models.PositiveIntegerField(default=0, verbose_name='deletions')),
+            ],
+            options={
+                'verbose_name': 'daily user statistics',
+                'verbose_name_plural': 'daily user statistics',
+                'ordering': ['-date'],
+            },
+        ),
+        migrations.CreateModel(
+            name='UserTotals',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('users', models.BigIntegerField(default=0, verbose_name='users')),
+                ('active_users', models.BigIntegerField(default=0, verbose_name='active users')),
+                ('verified_users', models.BigIntegerField(default=0, verbose_name='users with a verified email')),
+                ('reconciled_at', models.DateTimeField(blank=True, null=True, verbose_name='last reconciled')),
+            ],
+            options={
+                'verbose_name': 'user totals',
+                'verbose_name_plural': 'user totals',
+            },
+        ),
+    ]
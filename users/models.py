@@ -1,7 +1,10 @@
 from django.contrib.auth.models import AbstractUser
 from django.db import models
+from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
 
+from .avatars import avatar_upload_to, get_avatar_storage
+
 
 class CustomUser(AbstractUser):
     """
@@ -14,6 +17,33 @@ class CustomUser(AbstractUser):
         null=True,
         help_text=_("Custom display name (optional)")
     )
+    avatar = models.FileField(
+        _("avatar"),
+        upload_to=avatar_upload_to,
+        storage=get_avatar_storage,
+        max_length=200,
+        blank=True,
+        help_text=_("Profile picture, stored under a hash of its content")
+    )
+    avatar_thumbnail = models.FileField(
+        _("avatar thumbnail"),
+        storage=get_avatar_storage,
+        max_length=200,
+        blank=True,
+        editable=False,
+        help_text=_("Set in the background after the avatar changes (see users.avatars)")
+    )
+    updated_at = models.DateTimeField(
+        auto_now=True,
+        help_text=_("Last time the profile changed (used for conditional GET ETags)")
+    )
+    last_seen = models.DateTimeField(
+        _("last seen"),
+        null=True,
+        blank=True,
+        editable=False,
+        help_text=_("Last signed-in request, to within ACTIVITY_RESOLUTION (see users.activity)")
+    )
 
     @property
     def get_display_name(self):
@@ -24,6 +54,76 @@ class CustomUser(AbstractUser):
         """
         return self.display_name or self.get_full_name() or self.email.split('@')[0]
 
+    @property
+    def avatar_url(self):
+        """Return the thumbnail URL, the original avatar's while it is generated, or ''."""
+        if self.avatar_thumbnail:
+            return self.avatar_thumbnail.url
+        return self.avatar.url if self.avatar else ''
+
+    def touch(self):
+        """Bump updated_at without saving (or signalling) the rest of the row."""
+        from .backends import invalidate
+
+        self.updated_at = timezone.now()
+        type(self).objects.filter(pk=self.pk).update(updated_at=self.updated_at)
+        # update() sends no post_save, so drop the cached request.user here
+        invalidate([self.pk])
+
     class Meta:
         verbose_name = _('User')
         verbose_name_plural = _('Users')
+        indexes = [
+            models.Index(fields=['last_seen'], name='users_last_seen_idx'),
+        ]
+
+
+class DailyUserStats(models.Model):
+    """
+    One day's account counters, bumped by users.stats as things happen.
+
+    The admin dashboard reads these rows instead of grouping users by day.
+    """
+
+    date = models.DateField(_("date"), primary_key=True)
+    signups = models.PositiveIntegerField(_("signups"), default=0)
+    verifications = models.PositiveIntegerField(_("email verifications"), default=0)
+    logins = models.PositiveIntegerField(_("logins"), default=0)
+    deletions = models.PositiveIntegerField(_("deletions"), default=0)
+
+    class Meta:
+        ordering = ['-date']
+        verbose_name = _("daily user statistics")
+        verbose_name_plural = _("daily user statistics")
+
+    def __str__(self):
+        return str(self.date)
+
+
+class UserTotals(models.Model):
+    """
+    The single row of running user totals (see users.stats).
+
+    Kept exact by the incremental updates and recounted nightly by
+    ``reconcile_user_stats``.
+    """
+
+    users = models.BigIntegerField(_("users"), default=0)
+    active_users = models.BigIntegerField(_("active users"), default=0)
+    verified_users = models.BigIntegerField(_("users with a verified email"), default=0)
+    reconciled_at = models.DateTimeField(_("last reconciled"), null=True, blank=True)
+
+    class Meta:
+        verbose_name = _("user totals")
+        verbose_name_plural = _("user totals")
+
+    def __str__(self):
+        return f'{self.users} users'
+
+    @property
+    def inactive_users(self):
+        return self.users - self.active_users
+
+    @property
+    def verification_rate(self):
+        return self.verified_users / self.users if self.users else 0.0
@@ -0,0 +1,250 @@
+"""
+Personal data export ("download my data") as a zip archive built in constant memory.
+
+``zipfile`` writes into a small buffer that is drained after every chunk, so
+memory use stays flat however many sessions or email addresses a user has.
+The archive holds ``profile.json``, ``email_addresses.json``,
+``social_accounts.json``, ``sessions.json`` and the uploaded avatar.
+
+A streamed archive has no Content-Length and cannot be resumed. With
+``DATA_EXPORT_BACKGROUND`` the archive is instead prepared on a background
+thread under ``MEDIA_ROOT/exports/`` and sent like other media (through nginx
+in production), so interrupted downloads resume with Range requests.
+"""
+import hashlib
+import logging
+import os
+import tempfile
+import time
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from pathlib import Path, PurePosixPath
+from urllib.parse import quote
+
+from allauth.account.models import EmailAddress
+from allauth.socialaccount.models import SocialAccount
+from django.conf import settings
+from django.core.cache import cache
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connections, transaction
+from django.http import FileResponse, HttpResponse, StreamingHttpResponse
+from django.utils import timezone
+from django.utils.cache import patch_cache_control
+
+from core.models import Session
+
+logger = logging.getLogger(__name__)
+
+EXPORT_DIR = 'exports'
+CHUNK_SIZE = 64 * 1024
+QUERY_CHUNK_SIZE = 2000
+# A prepared export still running after this long is assumed lost and may be started again
+PENDING_TIMEOUT = 15 * 60
+
+PROFILE_FIELDS = [
+    'id', 'email', 'username', 'first_name', 'last_name', 'display_name',
+    'is_active', 'date_joined', 'last_login', 'updated_at',
+]
+
+_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='personal-data')
+
+
+class StreamWriter:
+    """Write-only file object for ZipFile that holds just the bytes not yet sent."""
+
+    def __init__(self):
+        self.buffer = bytearray()
+        self.offset = 0
+
+    def write(self, data):
+        self.buffer += data
+        self.offset += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.offset
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = bytes(self.buffer)
+        self.buffer.clear()
+        return data
+
+
+def iter_json(value):
+    encoder = DjangoJSONEncoder(indent=2)
+    yield (encoder.encode(value) + '\n').encode()
+
+
+def iter_json_array(rows):
+    """Encode ``rows`` as a JSON array one element at a time."""
+    encoder = DjangoJSONEncoder()
+    yield b'['
+    separator = '\n  '
+    for row in rows:
+        yield (separator + encoder.encode(row)).encode()
+        separator = ',\n  '
+    yield b'\n]\n'
+
+
+def iter_file(field_file):
+    field_file.open('rb')
+    try:
+        yield from field_file.chunks(CHUNK_SIZE)
+    finally:
+        field_file.close()
+
+
+def iter_sessions(user):
+    sessions = (
+        Session.objects.filter(user_id=user.pk).order_by('expire_date')
+        .values_list('session_key', 'expire_date').iterator(chunk_size=QUERY_CHUNK_SIZE)
+    )
+    for session_key, expire_date in sessions:
+        # The key itself is a credential, so only a digest identifies the session
+        yield {'id': hashlib.sha256(session_key.encode()).hexdigest()[:16], 'expire_date': expire_date}
+
+
+def iter_sections(user):
+    """Yield ``(filename, chunks)`` for every file in the archive."""
+    yield 'profile.json', iter_json({field: getattr(user, field) for field in PROFILE_FIELDS})
+    yield 'email_addresses.json', iter_json_array(
+        EmailAddress.objects.filter(user=user).order_by('pk').values('email', 'verified', 'primary')
+        .iterator(chunk_size=QUERY_CHUNK_SIZE)
+    )
+    # Tokens (SocialToken) are credentials, not personal data, and stay out of the archive
+    yield 'social_accounts.json', iter_json_array(
+        SocialAccount.objects.filter(user=user).order_by('pk')
+        .values('provider', 'uid', 'date_joined', 'last_login', 'extra_data')
+        .iterator(chunk_size=QUERY_CHUNK_SIZE)
+    )
+    yield 'sessions.json', iter_json_array(iter_sessions(user))
+    if user.avatar:
+        yield 'avatar' + PurePosixPath(user.avatar.name).suffix, iter_file(user.avatar)
+
+
+def iter_archive(user):
+    """Yield the zip archive of ``user``'s data in chunks of about CHUNK_SIZE bytes."""
+    writer = StreamWriter()
+    date_time = timezone.localtime().timetuple()[:6]
+    # Without seek() on the writer, zipfile writes sizes in data descriptors after each member
+    with zipfile.ZipFile(writer, 'w') as archive:
+        for name, chunks in iter_sections(user):
+            info = zipfile.ZipInfo(name, date_time)
+            info.compress_type = zipfile.ZIP_DEFLATED
+            with archive.open(info, 'w') as member:
+                for chunk in chunks:
+                    member.write(chunk)
+                    if len(writer.buffer) >= CHUNK_SIZE:
+                        yield writer.drain()
+    yield writer.drain()
+
+
+def archive_filename(when):
+    return f'personal-data-{when:%Y%m%d}.zip'
+
+
+def stream_response(user):
+    """Return a StreamingHttpResponse that downloads ``user``'s archive as it is built."""
+    response = StreamingHttpResponse(iter_archive(user), content_type='application/zip')
+    response['Content-Disposition'] = f'attachment; filename="{archive_filename(timezone.now())}"'
+    # Built on the fly, so a retried download starts over instead of requesting a range
+    response['Accept-Ranges'] = 'none'
+    patch_cache_control(response, private=True, no_store=True)
+    return response
+
+
+def export_name(user_id):
+    return f'{EXPORT_DIR}/{user_id}.zip'
+
+
+def export_path(user_id):
+    return Path(settings.MEDIA_ROOT) / export_name(user_id)
+
+
+def pending_key(user_id):
+    return f'personal-data:pending:{user_id}'
+
+
+def prepare(user_id):
+    """
+    Write the user's archive to ``export_path()``, replacing any earlier one atomically.
+
+    The pending flag is per worker when the cache is, so two workers may prepare the same
+    export at once; each writes its own temporary file and the last to finish wins.
+    """
+    from .models import CustomUser
+
+    user = CustomUser.objects.get(pk=user_id)
+    path = export_path(user_id)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with tempfile.NamedTemporaryFile(dir=path.parent, prefix=f'{user_id}.', suffix='.part', delete=False) as fp:
+        try:
+            for chunk in iter_archive(user):
+                fp.write(chunk)
+        except BaseException:
+            os.unlink(fp.name)
+            raise
+    # NamedTemporaryFile creates the file readable by its owner only; nginx serves it too
+    os.chmod(fp.name, settings.FILE_UPLOAD_PERMISSIONS or 0o644)
+    os.replace(fp.name, path)
+
+
+def prepared_export(user_id):
+    """Return the path of the user's unexpired prepared archive, or None, removing an expired one."""
+    path = export_path(user_id)
+    try:
+        modified = path.stat().st_mtime
+    except FileNotFoundError:
+        return None
+    if time.time() - modified > settings.DATA_EXPORT_TTL:
+        path.unlink(missing_ok=True)
+        return None
+    return path
+
+
+def is_pending(user_id):
+    return cache.get(pending_key(user_id)) is not None
+
+
+def schedule_export(user_id):
+    """
+    Prepare the archive on the background thread once the current transaction commits.
+
+    Returns False, without scheduling anything, while an export for the user is already pending.
+    """
+    if not cache.add(pending_key(user_id), True, PENDING_TIMEOUT):
+        return False
+
+    def run():
+        try:
+            prepare(user_id)
+        except Exception:
+            logger.exception("Personal data export for user %s failed", user_id)
+        finally:
+            cache.delete(pending_key(user_id))
+            connections['default'].close_if_unusable_or_obsolete()
+
+    transaction.on_commit(lambda: _executor.submit(run))
+    return True
+
+
+def serve_prepared(path, user_id):
+    """Send a prepared archive: nginx serves it (and its Range requests) in production, Django in development."""
+    filename = archive_filename(datetime.fromtimestamp(path.stat().st_mtime))
+    if settings.MEDIA_X_ACCEL_REDIRECT:
+        response = HttpResponse(content_type='application/zip')
+        response['X-Accel-Redirect'] = settings.MEDIA_X_ACCEL_PREFIX + quote(export_name(user_id))
+        response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    else:
+        response = FileResponse(open(path, 'rb'), as_attachment=True, filename=filename, content_type='application/zip')
+    patch_cache_control(response, private=True, no_store=True)
+    return response
+
+
+def delete_export(user_ids):
+    for user_id in user_ids:
+        export_path(user_id).unlink(missing_ok=True)
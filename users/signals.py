@@ -0,0 +1,141 @@
+from allauth.account.signals import email_added, email_changed, email_confirmed, email_removed
+from django.conf import settings
+from django.contrib.auth.models import Group, Permission
+from django.contrib.auth.signals import user_logged_in
+from django.db.models.signals import m2m_changed, post_delete, post_init, post_save, pre_delete
+from django.dispatch import Signal, receiver
+
+from core import events
+
+from . import stats
+from .backends import invalidate
+from .personal_data import delete_export
+
+# Sent once per batch by users.bulk with ``pks`` (and ``values`` for updates)
+users_updated = Signal()
+users_deleted = Signal()
+
+
+@receiver(email_added)
+@receiver(email_changed)
+@receiver(email_confirmed)
+@receiver(email_removed)
+def touch_user_on_email_change(sender, request=None, email_address=None, user=None, **kwargs):
+    """Invalidate the user's cached pages (ETags) when allauth changes their email addresses"""
+    user = user or getattr(email_address, 'user', None)
+    if user is not None:
+        user.touch()
+
+
+@receiver(email_confirmed)
+def publish_email_confirmed(sender, request=None, email_address=None, **kwargs):
+    """Refresh the user's open pages, e.g. a tab waiting for the confirmation link to be clicked"""
+    events.publish([email_address.user_id], 'account', {'reason': 'email_confirmed'})
+
+
+@receiver(users_updated)
+def publish_users_updated(sender, pks, **kwargs):
+    """Refresh open pages of users changed by bulk admin actions"""
+    events.publish(pks, 'account', {'reason': 'updated'})
+
+
+@receiver(post_save, sender=settings.AUTH_USER_MODEL)
+@receiver(post_delete, sender=settings.AUTH_USER_MODEL)
+def invalidate_cached_user(sender, instance, **kwargs):
+    """Drop the cached request.user after any save (including password changes) or delete"""
+    # bulk_delete invalidates the whole batch with users_deleted
+    if not stats.is_deleting(instance.pk):
+        invalidate([instance.pk])
+
+
+@receiver(users_updated)
+@receiver(users_deleted)
+def invalidate_cached_users(sender, pks, **kwargs):
+    invalidate(pks)
+
+
+@receiver(post_delete, sender=settings.AUTH_USER_MODEL)
+def delete_personal_data_export(sender, instance, **kwargs):
+    """Remove a deleted user's prepared data export"""
+    if not stats.is_deleting(instance.pk):
+        delete_export([instance.pk])
+
+
+@receiver(users_deleted)
+def delete_personal_data_exports(sender, pks, **kwargs):
+    delete_export(pks)
+
+
+@receiver(m2m_changed)
+def invalidate_cached_users_on_access_change(sender, instance, action, model, pk_set, **kwargs):
+    """Drop cached users whose groups or permissions (directly or through a group) changed"""
+    if action not in ('post_add', 'post_remove', 'pre_clear'):
+        return
+    from .models import CustomUser
+
+    if sender in (CustomUser.groups.through, CustomUser.user_permissions.through):
+        if isinstance(instance, CustomUser):
+            invalidate([instance.pk])
+        elif pk_set is not None:
+            invalidate(pk_set)
+        elif isinstance(instance, (Group, Permission)):
+            # Clearing a group's or permission's users
+            related = 'groups' if isinstance(instance, Group) else 'user_permissions'
+            invalidate(CustomUser.objects.filter(**{related: instance}).values_list('pk', flat=True))
+    elif sender is Group.permissions.through:
+        groups = [instance] if isinstance(instance, Group) else pk_set
+        if groups is None:  # a permission removed from every group
+            groups = instance.group_set.all()
+        invalidate(CustomUser.objects.filter(groups__in=groups).values_list('pk', flat=True).distinct())
+
+
+@receiver(post_init, sender=settings.AUTH_USER_MODEL)
+def remember_is_active(sender, instance, **kwargs):
+    """Keep the loaded is_active, so count_user_saved can tell activations apart (never loads a deferred field)"""
+    instance._loaded_is_active = instance.__dict__.get('is_active')
+
+
+@receiver(post_save, sender=settings.AUTH_USER_MODEL)
+def count_user_saved(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    if created:
+        stats.bump({'signups': 1}, {'users': 1, 'active_users': int(instance.is_active)})
+    elif instance._loaded_is_active is not None and instance.is_active != instance._loaded_is_active:
+        stats.bump(totals={'active_users': 1 if instance.is_active else -1})
+    instance._loaded_is_active = instance.is_active
+
+
+@receiver(pre_delete, sender=settings.AUTH_USER_MODEL)
+def remember_verified_email(sender, instance, **kwargs):
+    """Check before the cascade deletes them whether the user had a verified address (batched by bulk_delete)"""
+    instance._had_verified_email = stats.had_verified_email(instance.pk)
+
+
+@receiver(post_delete, sender=settings.AUTH_USER_MODEL)
+def count_user_deleted(sender, instance, **kwargs):
+    stats.user_deleted(instance)
+
+
+@receiver(users_updated)
+def count_users_updated(sender, pks, values=None, **kwargs):
+    """bulk_update only changes users that differ, so every pk flipped is_active"""
+    if values and 'is_active' in values:
+        stats.bump(totals={'active_users': len(pks) if values['is_active'] else -len(pks)})
+
+
+@receiver(email_confirmed)
+def count_email_confirmed(sender, request=None, email_address=None, **kwargs):
+    first = not stats.has_verified_email(email_address.user_id, exclude=email_address.pk)
+    stats.bump({'verifications': 1}, {'verified_users': int(first)})
+
+
+@receiver(email_removed)
+def count_email_removed(sender, request=None, user=None, email_address=None, **kwargs):
+    if email_address.verified and not stats.has_verified_email(user.pk):
+        stats.bump(totals={'verified_users': -1})
+
+
+@receiver(user_logged_in)
+def count_login(sender, request, user, **kwargs):
+    stats.bump({'logins': 1})
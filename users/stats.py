@@ -0,0 +1,152 @@
+"""
+Incrementally maintained user statistics for the admin dashboard.
+
+Counting signups per day, active users or verified addresses with
+``COUNT``/``GROUP BY`` gets slower with every user. Instead, the receivers in
+``users.signals`` bump counters as things happen: today's ``DailyUserStats``
+row (signups, verifications, logins, deletions) and the single ``UserTotals``
+row (users, active users, users with a verified email). The dashboard reads
+the totals row and a primary key range of ``DASHBOARD_DAYS`` daily rows, so it
+costs the same at any number of users.
+
+Counters are bumped with ``UPDATE ... SET n = n + delta`` once the transaction
+commits, so rolled-back signups are not counted and concurrent requests never
+lose an increment. Changes that bypass the signals (raw SQL, ``bulk_create``,
+admin edits of email addresses) are corrected by ``reconcile()``, run nightly
+by ``reconcile_user_stats``.
+"""
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import timedelta
+from functools import partial
+
+from allauth.account.models import EmailAddress
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, Q
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from .models import CustomUser, DailyUserStats, UserTotals
+
+DASHBOARD_DAYS = 30
+DEFAULT_RECONCILE_DAYS = 7
+
+# The batch being deleted (see deleting): whether each user had a verified address, and the counts removed so far
+_deleting = ContextVar('deleting', default=None)
+
+
+def bump(daily=None, totals=None):
+    """Add ``daily`` to today's counters and ``totals`` to the running totals once the transaction commits."""
+    transaction.on_commit(partial(apply, timezone.localdate(), daily or {}, totals or {}))
+
+
+def apply(day, daily, totals):
+    daily = {field: delta for field, delta in daily.items() if delta}
+    totals = {field: delta for field, delta in totals.items() if delta}
+    if daily and not increment(DailyUserStats.objects.filter(date=day), daily):
+        try:
+            with transaction.atomic():
+                DailyUserStats.objects.create(date=day, **daily)
+        except IntegrityError:
+            # Another request created today's row first
+            increment(DailyUserStats.objects.filter(date=day), daily)
+    if totals and not increment(UserTotals.objects.filter(pk=1), totals):
+        # No totals yet: count them once, which includes this change
+        reconcile_totals()
+
+
+def increment(queryset, deltas):
+    return queryset.update(**{field: F(field) + delta for field, delta in deltas.items()})
+
+
+def has_verified_email(user_id, exclude=None):
+    return EmailAddress.objects.filter(user_id=user_id, verified=True).exclude(pk=exclude).exists()
+
+
+@contextmanager
+def deleting(pks):
+    """
+    Batch the per-user delete receivers for ``pks`` (see ``users.bulk.bulk_delete``).
+
+    Which users have a verified address is looked up in one query, and the
+    deletions are counted with a single ``bump()`` when the block succeeds.
+    The caller sends ``users_deleted`` for the batch, whose receivers drop
+    the cached users and data exports the per-user receivers then skip.
+    """
+    verified = set(EmailAddress.objects.filter(user_id__in=pks, verified=True).values_list('user_id', flat=True))
+    batch = {'verified': {pk: pk in verified for pk in pks}, 'counts': Counter()}
+    token = _deleting.set(batch)
+    try:
+        yield
+    finally:
+        _deleting.reset(token)
+    counts = batch['counts']
+    if counts['users']:
+        bump({'deletions': counts['users']}, {field: -count for field, count in counts.items()})
+
+
+def is_deleting(user_id):
+    """Whether ``user_id`` is deleted inside ``deleting()``."""
+    batch = _deleting.get()
+    return batch is not None and user_id in batch['verified']
+
+
+def had_verified_email(user_id):
+    """Whether a user being deleted has a verified address; free inside ``deleting()``."""
+    if is_deleting(user_id):
+        return _deleting.get()['verified'][user_id]
+    return has_verified_email(user_id)
+
+
+def user_deleted(user):
+    """Count a deleted user, right away or with the rest of the batch inside ``deleting()``."""
+    counts = Counter(users=1, active_users=int(user.is_active),
+                     verified_users=int(getattr(user, '_had_verified_email', False)))
+    if is_deleting(user.pk):
+        _deleting.get()['counts'].update(counts)
+    else:
+        bump({'deletions': 1}, {field: -count for field, count in counts.items()})
+
+
+def reconcile_totals():
+    """Recount the totals exactly."""
+    counts = CustomUser.objects.aggregate(users=Count('pk'), active_users=Count('pk', filter=Q(is_active=True)))
+    counts['verified_users'] = EmailAddress.objects.filter(verified=True).values('user_id').distinct().count()
+    UserTotals.objects.update_or_create(pk=1, defaults={**counts, 'reconciled_at': timezone.now()})
+    return counts
+
+
+def reconcile_signups(days=DEFAULT_RECONCILE_DAYS):
+    """
+    Raise the signups of the last ``days`` days to the number of users who joined then.
+
+    Users deleted since are not counted by ``date_joined``, so a day that
+    records more signups than survive is left alone. Returns the days changed.
+    """
+    start = timezone.localdate() - timedelta(days=days - 1)
+    joined = (
+        CustomUser.objects.filter(date_joined__date__gte=start)
+        .annotate(day=TruncDate('date_joined')).values('day').annotate(count=Count('pk')).values_list('day', 'count')
+    )
+    recorded = dict(DailyUserStats.objects.filter(date__gte=start).values_list('date', 'signups'))
+    changed = 0
+    for day, count in joined:
+        if count > recorded.get(day, 0):
+            DailyUserStats.objects.update_or_create(date=day, defaults={'signups': count})
+            changed += 1
+    return changed
+
+
+def reconcile(days=DEFAULT_RECONCILE_DAYS):
+    with transaction.atomic():
+        totals = reconcile_totals()
+    return totals, reconcile_signups(days)
+
+
+def dashboard(days=DASHBOARD_DAYS):
+    """Return the totals row (None before the first reconcile) and the last ``days`` days, newest first."""
+    today = timezone.localdate()
+    rows = {row.date: row for row in DailyUserStats.objects.filter(date__gt=today - timedelta(days=days))}
+    history = [rows.get(day) or DailyUserStats(date=day) for day in (today - timedelta(days=n) for n in range(days))]
+    return UserTotals.objects.filter(pk=1).first(), history
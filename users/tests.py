@@ -1,9 +1,31 @@
-from allauth.account.models import EmailAddress
+import hashlib
+import json
+import tempfile
+import zipfile
+from datetime import timedelta
+from io import BytesIO, StringIO
+from unittest import mock, skipUnless
+
+from allauth.account.models import EmailAddress, EmailConfirmationHMAC
+from django.contrib.admin.models import CHANGE, DELETION, LogEntry
+from django.contrib.auth.models import Group
+from django.contrib.contenttypes.models import ContentType
 from django.core import mail
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connection
 from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
+from django.utils import timezone
 
-from users.models import CustomUser
+from core.models import Session
+from users import activity, avatars, personal_data, stats
+from users.bulk import bulk_delete, bulk_update
+from users.export import EXPORT_FIELDS, iter_csv
+from users.models import CustomUser, DailyUserStats, UserTotals
+from users.signals import users_updated
 
 """
 The testing framework starts with a clean environment, so we need to override 
@@ -170,6 +192,16 @@ class EmailTests(TestCase):
         self.assertIn("Password Reset", mail.outbox[0].subject)
         self.assertEqual(mail.outbox[0].to, ['test@example.com'])
 
+    def test_account_notification_publishes_event(self):
+        """Test that security notifications also refresh the user's open pages via an account event"""
+        user = CustomUser.objects.create_user(username='testuser', email='test@example.com', password='password123')
+        self.client.force_login(user)
+        with mock.patch('core.events.publish') as publish:
+            self.client.post(reverse('account_change_password'), {
+                'oldpassword': 'password123', 'password1': 'new-password-456', 'password2': 'new-password-456',
+            })
+        publish.assert_called_once_with([user.pk], 'account', {'reason': 'password_changed'})
+
 
 @override_settings(
     STORAGES={
@@ -334,6 +366,35 @@ class UserProfileViewTests(TestCase):
         self.assertTemplateUsed(response, 'users/profile.html')
         self.assertIn('form', response.context)
 
+    def test_profile_delete_partial_via_query_param(self):
+        """Test that ?partial=delete-account renders only the confirmation fragment"""
+        response = self.client.get(reverse('users:user_profile') + '?partial=delete-account')
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'id="delete-confirmation"')
+        self.assertNotContains(response, 'id="sidebar"')
+
+    def test_profile_delete_partial_via_unpoly_target(self):
+        """Test that an Unpoly request targeting the modal renders only the fragment"""
+        response = self.client.get(reverse('users:user_profile'), HTTP_X_UP_TARGET='#delete-confirmation')
+        self.assertContains(response, 'id="delete-confirmation"')
+        self.assertNotContains(response, '<form method="post" enctype="multipart/form-data" novalidate>')
+        self.assertIn('X-Up-Target', response['Vary'])
+        response = self.client.get(reverse('users:user_profile'),
+                                   HTTP_X_UP_TARGET='#delete-confirmation, #django-messages')
+        self.assertContains(response, 'id="delete-confirmation"')
+        self.assertNotContains(response, 'id="sidebar"')
+
+    def test_profile_unknown_partial_returns_404(self):
+        """Test that an unregistered partial name is rejected"""
+        response = self.client.get(reverse('users:user_profile') + '?partial=unknown')
+        self.assertEqual(response.status_code, 404)
+
+    def test_profile_unmapped_unpoly_target_renders_full_page(self):
+        """Test that Unpoly targets without a partial fall back to the full page"""
+        response = self.client.get(reverse('users:user_profile'), HTTP_X_UP_TARGET='.card')
+        self.assertContains(response, 'id="sidebar"')
+        self.assertContains(response, '<form method="post" enctype="multipart/form-data" novalidate>')
+
     def test_profile_update_with_display_name(self):
         """Test successful profile update with explicit display_name"""
         response = self.client.post(reverse('users:user_profile'), {
@@ -580,3 +641,752 @@ class DeleteAccountViewTests(TestCase):
         self.assertIn('messages', response.context)
         messages_list = list(response.context['messages'])
         self.assertTrue(any('deleted successfully' in str(msg) for msg in messages_list))
+
+
+@override_settings(
+    STORAGES={
+        "default": {"BACKEND": "django.core.files.storage.FileSystemStorage"},
+        "staticfiles": {"BACKEND": "django.contrib.staticfiles.storage.StaticFilesStorage"},
+    }
+)
+class ConditionalProfileTests(TestCase):
+    """
+    Test suite for updated_at maintenance and ETag/304 handling of the profile page.
+    """
+
+    def setUp(self):
+        self.user = CustomUser.objects.create_user(
+            username='testuser',
+            email='test@example.com',
+            password='password123'
+        )
+        EmailAddress.objects.create(user=self.user, email=self.user.email, primary=True, verified=True)
+        self.client.force_login(self.user)
+        self.url = reverse('users:user_profile')
+        # The first render sets the CSRF cookie, which is part of the ETag
+        self.client.get(self.url)
+
+    def test_updated_at_changes_on_save(self):
+        """Test that saving the user bumps updated_at"""
+        before = self.user.updated_at
+        self.user.first_name = 'Changed'
+        self.user.save()
+        self.assertGreater(self.user.updated_at, before)
+
+    def test_email_added_signal_touches_user(self):
+        """Test that allauth email changes bump updated_at"""
+        from allauth.account.signals import email_added
+        before = self.user.updated_at
+        email_added.send(sender=EmailAddress, request=None, user=self.user, email_address=None)
+        self.user.refresh_from_db()
+        self.assertGreater(self.user.updated_at, before)
+
+    def test_repeat_get_returns_304(self):
+        """Test that a matching If-None-Match is answered without rendering"""
+        first = self.client.get(self.url)
+        self.assertIn('ETag', first)
+        self.assertIn('private', first['Cache-Control'])
+        second = self.client.get(self.url, HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(second.status_code, 304)
+        self.assertEqual(second.content, b'')
+
+    def test_profile_update_invalidates_etag(self):
+        """Test that changing the profile produces a new ETag"""
+        etag = self.client.get(self.url)['ETag']
+        self.user.display_name = 'New Name'
+        self.user.save()
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_unpoly_target_has_its_own_etag(self):
+        """Test that fragment responses do not share the full page ETag"""
+        etag = self.client.get(self.url)['ETag']
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag, HTTP_X_UP_TARGET='#delete-confirmation')
+        self.assertEqual(response.status_code, 200)
+
+    def test_pending_messages_disable_etag(self):
+        """Test that pages with flash messages are never answered with 304"""
+        etag = self.client.get(self.url)['ETag']
+        response = self.client.post(self.url, {
+            'first_name': '',
+            'last_name': '',
+            'email': 'test@example.com',
+            'display_name': ''
+        })
+        self.assertRedirects(response, self.url, fetch_redirect_response=False)
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'Your profile has been updated successfully.')
+
+
+@override_settings(
+    STORAGES={
+        "default": {"BACKEND": "django.core.files.storage.FileSystemStorage"},
+        "staticfiles": {"BACKEND": "django.contrib.staticfiles.storage.StaticFilesStorage"},
+    }
+)
+class UserExportTests(TestCase):
+    """
+    Test suite for the streaming CSV / JSON Lines user export in the admin.
+    """
+
+    def setUp(self):
+        self.admin = CustomUser.objects.create_superuser(
+            username='admin',
+            email='admin@example.com',
+            password='password123'
+        )
+        for i in range(3):
+            user = CustomUser.objects.create_user(username=f'user{i}', email=f'user{i}@example.com')
+            EmailAddress.objects.create(user=user, email=user.email, primary=True, verified=i != 2)
+        self.client.force_login(self.admin)
+        self.url = reverse('admin:users_customuser_export')
+
+    def read(self, response):
+        return b''.join(response.streaming_content).decode()
+
+    def test_export_csv(self):
+        """Test that the CSV export has a header and one row per user"""
+        response = self.client.get(self.url, {'format': 'csv'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'text/csv')
+        self.assertIn('attachment;', response['Content-Disposition'])
+        lines = self.read(response).splitlines()
+        self.assertTrue(lines[0].startswith('id,email,username'))
+        self.assertEqual(len(lines), 5)
+        self.assertTrue(any(line.endswith(',user0@example.com') for line in lines))
+
+    def test_export_csv_neutralizes_formulas(self):
+        """Test that user-controlled text starting like a formula is prefixed with a quote in CSV only"""
+        CustomUser.objects.filter(username='user0').update(first_name='=HYPERLINK("http://x")', last_name='-1')
+        lines = self.read(self.client.get(self.url, {'format': 'csv', 'fields': 'username,first_name,last_name,id'}))
+        self.assertIn('user0,"\'=HYPERLINK(""http://x"")",\'-1,', lines)
+        response = self.client.get(self.url, {'format': 'jsonl', 'fields': 'username,first_name', 'q': 'user0'})
+        self.assertEqual(json.loads(self.read(response))['first_name'], '=HYPERLINK("http://x")')
+
+    def test_export_jsonl_lists_verified_emails(self):
+        """Test that only verified addresses are exported"""
+        response = self.client.get(self.url, {'format': 'jsonl', 'fields': 'username,verified_emails'})
+        rows = [json.loads(line) for line in self.read(response).splitlines()]
+        by_username = {row['username']: row['verified_emails'] for row in rows}
+        self.assertEqual(by_username['user1'], ['user1@example.com'])
+        self.assertEqual(by_username['user2'], [])
+
+    def test_export_applies_changelist_filters(self):
+        """Test that changelist search parameters are passed through"""
+        response = self.client.get(self.url, {'format': 'jsonl', 'q': 'user1'})
+        self.assertEqual(len(self.read(response).splitlines()), 1)
+
+    def test_export_rejects_unknown_format_and_fields(self):
+        """Test that bad parameters return 400"""
+        self.assertEqual(self.client.get(self.url, {'format': 'xml'}).status_code, 400)
+        self.assertEqual(self.client.get(self.url, {'fields': 'password'}).status_code, 400)
+
+    def test_export_requires_staff(self):
+        """Test that non-staff users are redirected to the admin login"""
+        self.client.force_login(CustomUser.objects.get(username='user0'))
+        self.assertEqual(self.client.get(self.url).status_code, 302)
+
+    def test_export_action(self):
+        """Test that the changelist action streams the selected users"""
+        selected = CustomUser.objects.filter(username__in=['user0', 'user1'])
+        response = self.client.post(reverse('admin:users_customuser_changelist'), {
+            'action': 'export_jsonl',
+            '_selected_action': [user.pk for user in selected],
+        })
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        self.assertEqual(len(self.read(response).splitlines()), 2)
+
+    def test_export_query_count_is_per_chunk(self):
+        """Test that verified emails are fetched once per chunk, not per user"""
+        queryset = CustomUser.objects.all()
+        with self.assertNumQueries(3):
+            list(iter_csv(queryset, EXPORT_FIELDS, chunk_size=2))
+
+
+@override_settings(
+    STORAGES={
+        "default": {"BACKEND": "django.core.files.storage.FileSystemStorage"},
+        "staticfiles": {"BACKEND": "django.contrib.staticfiles.storage.StaticFilesStorage"},
+    }
+)
+class BulkAdminActionTests(TestCase):
+    """
+    Test suite for the set-based bulk admin actions on CustomUser.
+    """
+
+    def setUp(self):
+        self.admin = CustomUser.objects.create_superuser(
+            username='admin',
+            email='admin@example.com',
+            password='password123'
+        )
+        self.users = [
+            CustomUser.objects.create_user(username=f'user{i}', email=f'user{i}@example.com')
+            for i in range(4)
+        ]
+        EmailAddress.objects.create(user=self.users[0], email='user0@example.com', primary=True, verified=True)
+        self.client.force_login(self.admin)
+        self.url = reverse('admin:users_customuser_changelist')
+
+    def post_action(self, action, users, **extra):
+        return self.client.post(self.url, {
+            'action': action,
+            '_selected_action': [user.pk for user in users],
+            **extra,
+        })
+
+    def test_deactivate_users(self):
+        """Test that deactivation is applied, logged and signalled in bulk"""
+        received = []
+
+        def receiver(sender, pks, **kwargs):
+            received.append(pks)
+
+        users_updated.connect(receiver)
+        self.addCleanup(users_updated.disconnect, receiver)
+        response = self.post_action('deactivate_users', self.users[:2], index=0)
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(CustomUser.objects.filter(is_active=False).count(), 2)
+        self.assertEqual(LogEntry.objects.filter(action_flag=CHANGE).count(), 2)
+        self.assertEqual(received, [[self.users[0].pk, self.users[1].pk]])
+
+    def test_deactivate_skips_acting_user_and_unchanged_rows(self):
+        """Test that admins cannot lock themselves out and no-op rows are not logged"""
+        self.users[0].is_active = False
+        self.users[0].save()
+        self.post_action('deactivate_users', [self.admin, self.users[0]], index=0)
+        self.admin.refresh_from_db()
+        self.assertTrue(self.admin.is_active)
+        self.assertFalse(LogEntry.objects.exists())
+
+    def test_bulk_update_batches(self):
+        """Test that each batch is a bounded number of queries"""
+        queryset = CustomUser.objects.exclude(pk=self.admin.pk)
+        ContentType.objects.clear_cache()
+        # Per batch of 2: select, savepoint, update, log insert, release; plus one content type
+        # lookup and the final empty select
+        with self.assertNumQueries(12):
+            self.assertEqual(bulk_update(queryset, {'is_staff': True}, self.admin.pk, batch_size=2), 4)
+
+    def test_delete_shows_count_only_confirmation(self):
+        """Test that the confirmation page shows counts rather than every related object"""
+        response = self.post_action('delete_selected', self.users)
+        self.assertTemplateUsed(response, 'admin/users/customuser/bulk_delete_confirmation.html')
+        self.assertEqual(response.context['count'], 4)
+        self.assertEqual(response.context['email_count'], 1)
+        self.assertEqual(CustomUser.objects.count(), 5)
+
+    def test_delete_confirmed(self):
+        """Test that confirmed deletion removes users, their emails and sessions"""
+        Session.objects.create(session_key='x' * 32, session_data='', expire_date=timezone.now(),
+                               user_id=self.users[0].pk)
+        self.post_action('delete_selected', self.users[:3], post='yes')
+        self.assertEqual(CustomUser.objects.count(), 2)
+        self.assertFalse(EmailAddress.objects.exists())
+        self.assertFalse(Session.objects.filter(user_id=self.users[0].pk).exists())
+        self.assertEqual(LogEntry.objects.filter(action_flag=DELETION).count(), 3)
+
+    def test_delete_select_across_uses_changelist_filters(self):
+        """Test that "select all" deletes every matching user, not just the posted page"""
+        response = self.client.post(f'{self.url}?q=user', {
+            'action': 'delete_selected',
+            '_selected_action': [self.users[0].pk],
+            'select_across': '1',
+            'post': 'yes',
+        })
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(list(CustomUser.objects.values_list('username', flat=True)), ['admin'])
+
+
+@override_settings(
+    STORAGES={
+        "default": {"BACKEND": "django.core.files.storage.FileSystemStorage"},
+        "staticfiles": {"BACKEND": "django.contrib.staticfiles.storage.StaticFilesStorage"},
+    },
+    USER_CACHE_ENABLED=True,
+)
+class CachedUserTests(TestCase):
+    """
+    Test suite for resolving request.user from the cache and invalidating it.
+    """
+
+    def setUp(self):
+        cache.clear()
+        self.user = CustomUser.objects.create_user(
+            username='testuser',
+            email='test@example.com',
+            password='password123'
+        )
+        self.client.login(username='testuser', password='password123')
+        self.url = reverse('users:user_profile')
+        # The first request caches the user
+        self.client.get(self.url)
+
+    def user_selects(self):
+        """Return the number of user SELECTs issued by a profile request"""
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        return sum('FROM "users_customuser"' in query['sql'] for query in queries.captured_queries)
+
+    def test_user_is_served_from_cache(self):
+        """Test that repeat requests do not SELECT the user row"""
+        self.assertEqual(self.user_selects(), 0)
+
+    def test_save_invalidates_cache(self):
+        """Test that a saved change is visible on the next request"""
+        self.user.display_name = 'Changed Name'
+        self.user.save()
+        response = self.client.get(self.url)
+        self.assertEqual(response.context['user'].display_name, 'Changed Name')
+
+    def test_password_change_logs_out_other_sessions(self):
+        """Test that the session auth hash is still verified against the new password"""
+        self.user.set_password('new-password-456')
+        self.user.save()
+        response = self.client.get(self.url)
+        self.assertRedirects(response, f"{reverse('account_login')}?next={self.url}", fetch_redirect_response=False)
+
+    def test_bulk_deactivation_logs_user_out(self):
+        """Test that bulk updates, which bypass save(), still invalidate the cache"""
+        bulk_update(CustomUser.objects.filter(pk=self.user.pk), {'is_active': False}, self.user.pk)
+        self.assertEqual(self.client.get(self.url).status_code, 302)
+
+    def test_touch_invalidates_cache(self):
+        """Test that touch() (an update() without signals) refreshes updated_at"""
+        self.user.touch()
+        response = self.client.get(self.url)
+        self.assertEqual(response.context['user'].updated_at, self.user.updated_at)
+
+    def test_group_change_invalidates_cache(self):
+        """Test that adding the user to a group drops the cached entry"""
+        group = Group.objects.create(name='editors')
+        group.user_set.add(self.user)
+        self.assertEqual(self.user_selects(), 1)
+
+    def test_stale_entry_from_before_commit_is_ignored(self):
+        """Test that the on-commit version bump orphans entries cached during the transaction"""
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.first_name = 'Committed'
+            self.user.save()
+            # A concurrent request re-caches the row before the commit
+            self.client.get(self.url)
+        self.assertEqual(self.user_selects(), 1)
+
+    @override_settings(USER_CACHE_ENABLED=False)
+    def test_disabled_cache_queries_every_request(self):
+        """Test that the backends fall back to Django's behaviour when disabled"""
+        self.assertEqual(self.user_selects(), 1)
+
+
+PNG_PIXEL = (
+    b'\x89PNG\r\n\x1a\n\x00\x00\x00\rIHDR\x00\x00\x00\x01\x00\x00\x00\x01\x08\x06\x00\x00\x00\x1f\x15\xc4\x89'
+    b'\x00\x00\x00\rIDATx\x9cc\xf8\xff\xff?\x00\x05\xfe\x02\xfe\xa7\x35\x81\x84\x00\x00\x00\x00IEND\xaeB`\x82'
+)
+
+
+@override_settings(
+    STORAGES={
+        "default": {"BACKEND": "django.core.files.storage.FileSystemStorage"},
+        "staticfiles": {"BACKEND": "django.contrib.staticfiles.storage.StaticFilesStorage"},
+    },
+    MEDIA_X_ACCEL_REDIRECT=False,
+)
+class AvatarTests(TestCase):
+    """
+    Test suite for avatar uploads, content-addressed storage and media serving.
+    """
+
+    def setUp(self):
+        media_root = tempfile.TemporaryDirectory()
+        self.addCleanup(media_root.cleanup)
+        override = override_settings(MEDIA_ROOT=media_root.name)
+        override.enable()
+        self.addCleanup(override.disable)
+        self.user = CustomUser.objects.create_user(
+            username='testuser',
+            email='test@example.com',
+            password='password123'
+        )
+        self.client.force_login(self.user)
+        self.url = reverse('users:user_profile')
+
+    def upload(self, content, name='avatar.png'):
+        return self.client.post(self.url, {
+            'first_name': '',
+            'last_name': '',
+            'email': 'test@example.com',
+            'display_name': '',
+            'avatar': SimpleUploadedFile(name, content, content_type='image/png'),
+        })
+
+    def test_upload_is_content_addressed(self):
+        """Test that the avatar is named after its hash and identical uploads share a file"""
+        with self.captureOnCommitCallbacks() as callbacks:
+            self.assertEqual(self.upload(PNG_PIXEL).status_code, 302)
+        self.assertEqual(len(callbacks), 1)  # the thumbnail is scheduled, not made in the request
+        self.user.refresh_from_db()
+        digest = hashlib.sha256(PNG_PIXEL).hexdigest()
+        self.assertEqual(self.user.avatar.name, f'avatars/{digest[:2]}/{digest}.png')
+        other = CustomUser.objects.create_user(username='other', email='other@example.com')
+        self.client.force_login(other)
+        self.upload(PNG_PIXEL, name='different-name.png')
+        other.refresh_from_db()
+        self.assertEqual(other.avatar.name, self.user.avatar.name)
+
+    def test_rejects_non_images(self):
+        """Test that the content, not the declared type, is checked"""
+        response = self.upload(b'<script>alert(1)</script>', name='avatar.png')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('avatar', response.context['form'].errors)
+
+    @override_settings(AVATAR_MAX_SIZE=100, FILE_UPLOAD_MAX_SIZE=100)
+    def test_rejects_large_files_without_writing_them(self):
+        """Test that oversized uploads are skipped by the upload handler and reported by the form"""
+        response = self.upload(PNG_PIXEL + b'\x00' * 10000)
+        self.assertEqual(response.wsgi_request.oversized_uploads, {'avatar'})
+        self.assertNotIn('avatar', response.wsgi_request.FILES)
+        self.assertIn('too large', str(response.context['form'].errors['avatar']))
+        self.user.refresh_from_db()
+        self.assertFalse(self.user.avatar)
+
+    def test_media_is_served_with_immutable_cache_headers(self):
+        """Test that avatars are served with long-lived cache headers"""
+        self.upload(PNG_PIXEL)
+        self.user.refresh_from_db()
+        response = self.client.get(self.user.avatar.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('immutable', response['Cache-Control'])
+
+    @override_settings(MEDIA_X_ACCEL_REDIRECT=True)
+    def test_media_uses_x_accel_redirect(self):
+        """Test that production responses hand the file to nginx"""
+        response = self.client.get('/media/avatars/ab/abc.png')
+        self.assertEqual(response['X-Accel-Redirect'], '/protected-media/avatars/ab/abc.png')
+        self.assertEqual(response['Content-Type'], 'image/png')
+        self.assertEqual(response.content, b'')
+
+    @skipUnless(avatars.Image, 'Pillow is not installed')
+    def test_make_thumbnail(self):
+        """Test that the background step records a WebP thumbnail"""
+        self.upload(PNG_PIXEL)
+        name = avatars.make_thumbnail(self.user.pk)
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.avatar_thumbnail.name, name)
+        self.assertTrue(name.endswith('.webp'))
+
+
+@override_settings(
+    STORAGES={
+        "default": {"BACKEND": "django.core.files.storage.FileSystemStorage"},
+        "staticfiles": {"BACKEND": "django.contrib.staticfiles.storage.StaticFilesStorage"},
+    },
+    MEDIA_X_ACCEL_REDIRECT=False,
+)
+class PersonalDataExportTests(TestCase):
+    """
+    Test suite for the streamed and background-prepared personal data export.
+    """
+
+    def setUp(self):
+        cache.clear()
+        media_root = tempfile.TemporaryDirectory()
+        self.addCleanup(media_root.cleanup)
+        override = override_settings(MEDIA_ROOT=media_root.name)
+        override.enable()
+        self.addCleanup(override.disable)
+        self.user = CustomUser.objects.create_user(
+            username='testuser',
+            email='test@example.com',
+            password='password123',
+            first_name='Test',
+        )
+        EmailAddress.objects.create(user=self.user, email='test@example.com', verified=True, primary=True)
+        self.client.force_login(self.user)
+        self.url = reverse('users:personal_data_export')
+
+    def read_archive(self, content):
+        archive = zipfile.ZipFile(BytesIO(content))
+        return {name: archive.read(name) for name in archive.namelist()}
+
+    def test_streamed_archive_contents(self):
+        """Test that POST streams a zip with the profile, emails, social accounts and sessions"""
+        session_key = self.client.session.session_key
+        response = self.client.post(self.url)
+        self.assertEqual(response['Content-Type'], 'application/zip')
+        self.assertEqual(response['Accept-Ranges'], 'none')
+        self.assertTrue(response.streaming)
+        files = self.read_archive(b''.join(response.streaming_content))
+        self.assertEqual(
+            set(files), {'profile.json', 'email_addresses.json', 'social_accounts.json', 'sessions.json'}
+        )
+        self.assertEqual(json.loads(files['profile.json'])['first_name'], 'Test')
+        self.assertEqual(json.loads(files['email_addresses.json'])[0]['email'], 'test@example.com')
+        self.assertEqual(json.loads(files['social_accounts.json']), [])
+        sessions = json.loads(files['sessions.json'])
+        self.assertEqual(len(sessions), 1)
+        self.assertNotIn(session_key.encode(), files['sessions.json'])
+
+    def test_archive_is_yielded_in_bounded_chunks(self):
+        """Test that large exports are sent in many small chunks rather than buffered"""
+        Session.objects.bulk_create(
+            Session(session_key=f'{index:032d}', session_data='', expire_date=timezone.now(), user_id=self.user.pk)
+            for index in range(5000)
+        )
+        with mock.patch.object(personal_data, 'CHUNK_SIZE', 1024):
+            chunks = list(personal_data.iter_archive(self.user))
+        self.assertGreater(len(chunks), 3)
+        # Each chunk holds at most one buffered deflate block beyond CHUNK_SIZE
+        self.assertLess(max(len(chunk) for chunk in chunks), 1024 + 32 * 1024)
+        self.assertEqual(
+            len(json.loads(self.read_archive(b''.join(chunks))['sessions.json'])),
+            Session.objects.filter(user_id=self.user.pk).count(),
+        )
+
+    @override_settings(DATA_EXPORT_BACKGROUND=True)
+    def test_background_export(self):
+        """Test that the archive is prepared once after commit and then downloaded from disk"""
+        with self.captureOnCommitCallbacks() as callbacks:
+            self.assertRedirects(self.client.post(self.url), self.url)
+            self.client.post(self.url)
+        self.assertEqual(len(callbacks), 1)  # the second request finds the export pending
+        self.assertContains(self.client.get(self.url), 'being prepared')
+        self.assertEqual(self.client.get(reverse('users:personal_data_download')).status_code, 404)
+
+        personal_data.prepare(self.user.pk)
+        cache.delete(personal_data.pending_key(self.user.pk))
+        self.assertContains(self.client.get(self.url), 'Your archive is ready')
+        response = self.client.get(reverse('users:personal_data_download'))
+        self.assertIn('attachment', response['Content-Disposition'])
+        self.assertIn('profile.json', self.read_archive(b''.join(response.streaming_content)))
+
+    @override_settings(DATA_EXPORT_BACKGROUND=True, MEDIA_X_ACCEL_REDIRECT=True)
+    def test_prepared_archive_is_private(self):
+        """Test that prepared archives go through nginx only via the owner's download view"""
+        personal_data.prepare(self.user.pk)
+        response = self.client.get(reverse('users:personal_data_download'))
+        self.assertEqual(response['X-Accel-Redirect'], f'/protected-media/exports/{self.user.pk}.zip')
+        self.assertEqual(self.client.get(f'/media/exports/{self.user.pk}.zip').status_code, 404)
+
+    @override_settings(DATA_EXPORT_BACKGROUND=True, DATA_EXPORT_TTL=0)
+    def test_expired_archive_is_removed(self):
+        """Test that archives older than DATA_EXPORT_TTL are deleted instead of served"""
+        personal_data.prepare(self.user.pk)
+        self.assertEqual(self.client.get(reverse('users:personal_data_download')).status_code, 404)
+        self.assertFalse(personal_data.export_path(self.user.pk).exists())
+
+    def test_failed_export_leaves_no_temporary_file(self):
+        """Test that each export writes its own temporary file and removes it when building the archive fails"""
+        personal_data.prepare(self.user.pk)
+        with mock.patch.object(personal_data, 'iter_archive', side_effect=RuntimeError), \
+                self.assertRaises(RuntimeError):
+            personal_data.prepare(self.user.pk)
+        exports = personal_data.export_path(self.user.pk).parent
+        self.assertEqual([path.name for path in exports.iterdir()], [f'{self.user.pk}.zip'])
+
+    def test_archive_is_removed_with_the_account(self):
+        """Test that deleting the user deletes their prepared archive"""
+        personal_data.prepare(self.user.pk)
+        self.user.delete()
+        self.assertFalse(personal_data.export_path(self.user.pk).exists())
+
+    def test_export_is_rate_limited(self):
+        """Test that repeated exports are rejected with 429"""
+        for _ in range(3):
+            self.assertEqual(self.client.post(self.url).status_code, 200)
+        self.assertEqual(self.client.post(self.url).status_code, 429)
+
+
+@override_settings(
+    STORAGES={
+        "default": {"BACKEND": "django.core.files.storage.FileSystemStorage"},
+        "staticfiles": {"BACKEND": "django.contrib.staticfiles.storage.StaticFilesStorage"},
+    },
+    ACTIVITY_RESOLUTION=300,
+)
+class ActivityTests(TestCase):
+    """
+    Test suite for buffered last_seen tracking.
+    """
+
+    def setUp(self):
+        self.buffer = activity.ActivityBuffer()
+        patcher = mock.patch.object(activity, 'get_buffer', return_value=self.buffer)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.user = CustomUser.objects.create_user(
+            username='testuser',
+            email='test@example.com',
+            password='password123',
+        )
+        self.other = CustomUser.objects.create_user(
+            username='otheruser',
+            email='other@example.com',
+            password='password123',
+        )
+
+    def test_requests_are_buffered_not_written(self):
+        """Test that a signed-in request records the user in the buffer without an UPDATE"""
+        self.client.force_login(self.user)
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(reverse('users:user_profile'))
+        self.assertFalse(any(query['sql'].startswith('UPDATE') and 'last_seen' in query['sql'] for query in queries))
+        self.assertEqual(list(self.buffer.pending), [self.user.pk])
+        self.user.refresh_from_db()
+        self.assertIsNone(self.user.last_seen)
+
+    def test_visits_are_coalesced_per_resolution(self):
+        """Test that repeated visits within ACTIVITY_RESOLUTION are buffered once"""
+        self.assertTrue(self.buffer.record(self.user.pk, timezone.now(), 0, 300))
+        self.assertFalse(self.buffer.record(self.user.pk, timezone.now(), 299, 300))
+        self.assertTrue(self.buffer.record(self.user.pk, timezone.now(), 300, 300))
+
+    def test_anonymous_requests_are_ignored(self):
+        """Test that requests without a signed-in user are not recorded"""
+        self.client.get(reverse('users:user_profile'))
+        self.assertEqual(self.buffer.pending, {})
+
+    def test_buffer_is_submitted_after_resolution(self):
+        """Test that the request that ends a period hands the buffer to the flusher"""
+        self.buffer.flushed_at -= 300
+        with mock.patch.object(activity, 'submit') as submit:
+            activity.record(self.user)
+        submit.assert_called_once()
+        self.assertEqual(list(submit.call_args.args[0]), [self.user.pk])
+        self.assertEqual(self.buffer.pending, {})
+
+    def test_flush_is_one_update_and_only_moves_forward(self):
+        """Test that a flush writes all users in one UPDATE and never moves last_seen back"""
+        later = timezone.now()
+        earlier = later - timedelta(hours=1)
+        with CaptureQueriesContext(connection) as queries:
+            activity.flush({self.user.pk: later, self.other.pk: earlier})
+        self.assertEqual(sum(query['sql'].startswith('UPDATE') for query in queries), 1)
+        activity.flush({self.user.pk: earlier})
+        self.user.refresh_from_db()
+        self.other.refresh_from_db()
+        self.assertEqual(self.user.last_seen, later)
+        self.assertEqual(self.other.last_seen, earlier)
+
+    def test_admin_lists_last_seen(self):
+        """Test that the user changelist can be sorted by last_seen"""
+        admin = CustomUser.objects.create_superuser('admin', 'admin@example.com', 'password123')
+        self.client.force_login(admin)
+        response = self.client.get(reverse('admin:users_customuser_changelist'), {'o': '-5'})
+        self.assertContains(response, 'column-last_seen')
+
+
+@override_settings(
+    STORAGES={
+        "default": {"BACKEND": "django.core.files.storage.FileSystemStorage"},
+        "staticfiles": {"BACKEND": "django.contrib.staticfiles.storage.StaticFilesStorage"},
+    }
+)
+class UserStatsTests(TestCase):
+    """
+    Test suite for the incrementally maintained user statistics.
+    """
+
+    def setUp(self):
+        self.admin = CustomUser.objects.create_superuser('admin', 'admin@example.com', 'password123')
+        stats.reconcile_totals()
+
+    def create_user(self, username):
+        with self.captureOnCommitCallbacks(execute=True):
+            return CustomUser.objects.create_user(username=username, email=f'{username}@example.com', password='pw')
+
+    def assertTotals(self, users, active_users, verified_users):
+        totals = UserTotals.objects.get()
+        self.assertEqual((totals.users, totals.active_users, totals.verified_users),
+                         (users, active_users, verified_users))
+
+    def test_signup_confirmation_and_login_are_counted(self):
+        """Test that signals bump today's row and the totals"""
+        user = self.create_user('alice')
+        address = EmailAddress.objects.create(user=user, email='alice@example.com', primary=True)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('account_confirm_email', args=[EmailConfirmationHMAC(address).key]))
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.login(username='alice', password='pw')
+        today = DailyUserStats.objects.get(date=timezone.localdate())
+        self.assertEqual((today.signups, today.verifications, today.logins), (1, 1, 1))
+        self.assertTotals(users=2, active_users=2, verified_users=1)
+
+    def test_deactivation_and_deletion_are_counted(self):
+        """Test that is_active changes (saved or bulk) and deletions adjust the totals"""
+        user = self.create_user('bob')
+        other = self.create_user('carol')
+        EmailAddress.objects.create(user=user, email='bob@example.com', primary=True, verified=True)
+        stats.reconcile_totals()
+        user.is_active = False
+        with self.captureOnCommitCallbacks(execute=True):
+            user.save()
+        with self.captureOnCommitCallbacks(execute=True):
+            bulk_update(CustomUser.objects.filter(pk=other.pk), {'is_active': False}, self.admin.pk)
+        self.assertTotals(users=3, active_users=1, verified_users=1)
+        with self.captureOnCommitCallbacks(execute=True):
+            user.delete()
+        self.assertEqual(DailyUserStats.objects.get(date=timezone.localdate()).deletions, 1)
+        self.assertTotals(users=2, active_users=1, verified_users=0)
+
+    def test_bulk_delete_checks_verified_addresses_once_per_batch(self):
+        """Test that bulk deletes count verified users without a query per deleted user"""
+        users = [self.create_user(f'bulk{n}') for n in range(4)]
+        for user in users[:3]:
+            EmailAddress.objects.create(user=user, email=user.email, primary=True, verified=True)
+        stats.reconcile_totals()
+        with CaptureQueriesContext(connection) as queries, self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(bulk_delete(CustomUser.objects.filter(pk__in=[u.pk for u in users]), self.admin.pk), 4)
+        verified_lookups = [query for query in queries if 'account_emailaddress' in query['sql']
+                            and '"verified"' in query['sql']]
+        self.assertEqual(len(verified_lookups), 1)
+        self.assertTotals(users=1, active_users=1, verified_users=0)
+
+    def test_bulk_delete_counts_each_batch_once(self):
+        """Test that bulk deletes bump the counters, drop cached users and remove exports once per batch"""
+        pks = [self.create_user(f'bulk{n}').pk for n in range(4)]
+        stats.reconcile_totals()
+        with mock.patch.object(stats, 'bump', wraps=stats.bump) as bump, \
+                mock.patch('users.signals.invalidate') as invalidate, \
+                mock.patch('users.signals.delete_export') as delete_export, \
+                self.captureOnCommitCallbacks(execute=True):
+            bulk_delete(CustomUser.objects.filter(pk__in=pks), self.admin.pk, batch_size=2)
+        self.assertEqual(bump.call_count, 2)
+        self.assertEqual([call.args[0] for call in invalidate.call_args_list], [pks[:2], pks[2:]])
+        self.assertEqual([call.args[0] for call in delete_export.call_args_list], [pks[:2], pks[2:]])
+        self.assertEqual(DailyUserStats.objects.get(date=timezone.localdate()).deletions, 4)
+        self.assertTotals(users=1, active_users=1, verified_users=0)
+
+    def test_rolled_back_signup_is_not_counted(self):
+        """Test that counters only move once the transaction commits"""
+        with self.captureOnCommitCallbacks(execute=False) as callbacks:
+            CustomUser.objects.create_user(username='dave', email='dave@example.com', password='pw')
+        self.assertEqual(len(callbacks), 1)
+        self.assertFalse(DailyUserStats.objects.exists())
+
+    def test_reconcile_repairs_drift(self):
+        """Test that the nightly recount fixes totals and missing signups"""
+        CustomUser.objects.bulk_create([CustomUser(username=f'bulk{n}', email=f'bulk{n}@example.com') for n in range(3)])
+        UserTotals.objects.update(users=99)
+        call_command('reconcile_user_stats', stdout=StringIO())
+        self.assertTotals(users=4, active_users=4, verified_users=0)
+        # The superuser from setUp joined today too
+        self.assertEqual(DailyUserStats.objects.get(date=timezone.localdate()).signups, 4)
+
+    def test_dashboard_reads_only_the_summary(self):
+        """Test that the admin dashboard runs the same queries, and no COUNT, however many users exist"""
+        self.client.force_login(self.admin)
+        url = reverse('admin:users_customuser_stats')
+        self.client.get(url)
+        with CaptureQueriesContext(connection) as before:
+            self.client.get(url)
+        for username in ('erin', 'frank', 'grace'):
+            self.create_user(username)
+        with CaptureQueriesContext(connection) as after:
+            response = self.client.get(url)
+        self.assertEqual(len(after), len(before))
+        self.assertFalse(any('COUNT(' in query['sql'] for query in after))
+        self.assertContains(response, '<td>4</td>')
+        self.assertEqual(len(response.context['history']), stats.DASHBOARD_DAYS)
@@ -6,5 +6,7 @@ app_name = 'users'
 
 urlpatterns = [
     path('profile/', views.user_profile, name='user_profile'),
+    path('personal-data/', views.personal_data_export, name='personal_data_export'),
+    path('personal-data/download/', views.personal_data_download, name='personal_data_download'),
     path('delete-account/', views.delete_account, name='delete_account'),
 ]
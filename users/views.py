@@ -1,51 +1,83 @@
+from django.conf import settings
 from django.contrib import messages
 from django.contrib.auth.decorators import login_required
-from django.shortcuts import render, redirect
+from django.http import Http404
+from django.shortcuts import redirect
 from django.template.response import TemplateResponse  # needed for partials
 
+from core.conditional import conditional_page
+from core.streaming import early_flush
+from core.unpoly import fragments
+from . import personal_data
+from .avatars import schedule_thumbnail
 from .forms import UserProfileForm
 
 
 @login_required
+@conditional_page
+@early_flush
+@fragments({'#delete-confirmation': 'delete-account'})
 def user_profile(request):
     """View for users to update their profile information"""
-    # Handle partial requests
-    partial = request.GET.get('partial')
-    if partial:
-        return _render_partial(request, partial)
+    # The delete confirmation partial needs no form
+    if request.up_fragment == 'delete-account':
+        return TemplateResponse(request, 'users/profile.html', {})
 
-    # Handle full page requests
     context = {}
 
     if request.method == 'POST':
-        form = UserProfileForm(request.POST, instance=request.user)
+        form = UserProfileForm(request.POST, request.FILES, instance=request.user,
+                               oversized_uploads=getattr(request, 'oversized_uploads', ()))
         if form.is_valid():
             user = form.save(commit=False)
             if not user.display_name:
                 full_name = user.get_full_name().strip()
                 if full_name:
                     user.display_name = full_name
+            avatar_changed = 'avatar' in form.changed_data
+            if avatar_changed:
+                user.avatar_thumbnail = ''
             user.save()
+            if avatar_changed and user.avatar:
+                schedule_thumbnail(user.pk)
             messages.success(request, 'Your profile has been updated successfully.')
             return redirect('users:user_profile')
     else:
         form = UserProfileForm(instance=request.user)
 
     context['form'] = form
-    return render(request, 'users/profile.html', context)
+    return TemplateResponse(request, 'users/profile.html', context)
 
 
-def _render_partial(request, partial_name):
-    """Route partial requests to appropriate handlers"""
-    partials = {
-        'delete-account': 'users/profile.html#delete-account',
+@login_required
+def personal_data_export(request):
+    """View for users to download their personal data; POST streams or prepares the archive"""
+    user_id = request.user.pk
+    background = settings.DATA_EXPORT_BACKGROUND
+
+    if request.method == 'POST':
+        if not background:
+            return personal_data.stream_response(request.user)
+        if personal_data.schedule_export(user_id):
+            messages.info(request, 'Your data is being prepared. Reload this page in a few minutes to download it.')
+        return redirect('users:personal_data_export')
+
+    context = {
+        'background': background,
+        'pending': background and personal_data.is_pending(user_id),
+        'prepared': background and personal_data.prepared_export(user_id) is not None,
+        'ttl_hours': settings.DATA_EXPORT_TTL // 3600,
     }
+    return TemplateResponse(request, 'users/personal_data.html', context)
 
-    if partial_name not in partials:
-        return TemplateResponse(request, 'errors/404.html', status=404)
 
-    context = {}
-    return TemplateResponse(request, partials[partial_name], context)
+@login_required
+def personal_data_download(request):
+    """Send the archive prepared by personal_data_export (resumable through nginx)"""
+    path = personal_data.prepared_export(request.user.pk)
+    if path is None:
+        raise Http404
+    return personal_data.serve_prepared(path, request.user.pk)
 
 
 @login_required